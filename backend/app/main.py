@@ -45,7 +45,7 @@ import warnings
 warnings.filterwarnings('ignore')
 os.environ['CUDA_VISIBLE_DEVICES'] = ''
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 import json
 import asyncio
@@ -70,6 +70,12 @@ OUTPUT_DIR = Path(settings.OUTPUT_DIR)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Preload the background removal model at import time. Under gunicorn --preload
+# this runs in the master, so forked workers share one copy of the model.
+if os.environ.get('PRELOAD_MODELS'):
+    from app.services.ai.background_removal import warmup as warmup_background_removal
+    warmup_background_removal()
+
 
 # ==================== HELPER FUNCTIONS ====================
 
@@ -83,6 +89,21 @@ def run_async(coro):
         loop.close()
 
 
+def iter_async(agen):
+    """Drive an async generator from Flask sync context, one item at a time."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
 def get_document_data(data):
     """
     Extract and convert document data from request.
@@ -360,7 +381,7 @@ def translate_command():
     Translate natural language command to canvas actions.
     This is for the editor's AI assistant.
     """
-    from app.services.ai.gemini_service import get_gemini_service
+    from app.services.ai.gemini_service import get_gemini_service, extract_json
     
     data = request.get_json()
     command = data.get('command', '')
@@ -421,17 +442,13 @@ Respond ONLY with valid JSON, no markdown or explanations outside the JSON."""
     try:
         response = run_async(translate())
         
-        # Parse the AI response
-        import json
-        import re
-        
         # Extract JSON from response
         response_text = response.get('response', '') if isinstance(response, dict) else str(response)
         
-        # Try to find JSON in the response
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            result = json.loads(json_match.group())
+        # Try to find JSON in the response (single forward scan)
+        json_text = extract_json(response_text)
+        if json_text is not None:
+            result = json.loads(json_text)
             return jsonify({
                 "success": True,
                 "actions": result.get("actions", []),
@@ -505,7 +522,8 @@ def get_suggestions():
             doc=doc,
             intent=data.get('intent', 'creative_rewrite'),
             locale=locale,
-            context=data.get('context')
+            context=data.get('context'),
+            refresh=bool(data.get('refresh'))
         )
     
     suggestion = run_async(get_suggestions_async())
@@ -524,6 +542,135 @@ def get_suggestions():
     })
 
 
+@app.route('/api/ai/agent/suggest/stream', methods=['POST'])
+@handle_errors
+def stream_creative_rewrite():
+    """
+    Stream creative rewrite variants as server-sent events.
+    Each headline variant is sent as soon as Gemini finishes it; the final
+    event carries the full suggestion and patch.
+    """
+    from app.services.ai.unified_agent import get_unified_agent, DocumentModel, Language
+    
+    data = request.get_json()
+    agent = get_unified_agent()
+    
+    doc_data = data.get('doc') or data.get('document')
+    if not doc_data:
+        return jsonify({"success": False, "error": "Missing document data"}), 400
+    doc = DocumentModel.from_dict(doc_data)
+    
+    locale_str = data.get('locale', 'en')
+    locale = Language(locale_str) if locale_str in [l.value for l in Language] else Language.ENGLISH
+    
+    def events():
+        for kind, item in iter_async(agent.stream_creative_rewrite(
+            doc, locale, data.get('context'), refresh=bool(data.get('refresh'))
+        )):
+            if kind == "variant":
+                payload = {"type": "variant", "variant": item}
+            else:
+                payload = {
+                    "type": "suggestion",
+                    "suggestion": {
+                        "id": item.id,
+                        "intent": item.intent.value,
+                        "variants": item.variants,
+                        "recommended_index": item.recommended_index,
+                        "reason": item.reason,
+                        "confidence": item.confidence
+                    },
+                    "patch": item.patch.to_dict() if item.patch else None
+                }
+            yield f"data: {json.dumps(payload)}\n\n"
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
+
+
+@app.route('/api/ai/agent/suggest/bulk', methods=['POST'])
+@handle_errors
+def get_suggestions_bulk():
+    """Get AI suggestions for several intents in one concurrent request."""
+    from app.services.ai.unified_agent import get_unified_agent, DocumentModel, Language
+    
+    data = request.get_json()
+    agent = get_unified_agent()
+    
+    # Create document model - support both 'doc' and 'document' keys
+    doc_data = data.get('doc') or data.get('document')
+    if not doc_data:
+        return jsonify({"success": False, "error": "Missing document data"}), 400
+    
+    intents = data.get('intents')
+    if not intents:
+        return jsonify({"success": False, "error": "Missing intents"}), 400
+    
+    doc = DocumentModel.from_dict(doc_data)
+    
+    # Parse locale
+    locale_str = data.get('locale', 'en')
+    locale = Language(locale_str) if locale_str in [l.value for l in Language] else Language.ENGLISH
+    
+    suggestions = run_async(agent.get_suggestions_bulk(
+        doc=doc,
+        intents=intents,
+        locale=locale,
+        context=data.get('context')
+    ))
+    
+    return jsonify({
+        "success": True,
+        "suggestions": [
+            {
+                "suggestion": {
+                    "id": suggestion.id,
+                    "intent": suggestion.intent.value,
+                    "variants": suggestion.variants,
+                    "recommended_index": suggestion.recommended_index,
+                    "reason": suggestion.reason,
+                    "confidence": suggestion.confidence
+                },
+                "patch": suggestion.patch.to_dict() if suggestion.patch else None
+            }
+            for suggestion in suggestions
+        ]
+    })
+
+
+@app.route('/api/ai/agent/warmup', methods=['POST'])
+@handle_errors
+def warmup_suggestions():
+    """Prefetch likely suggestions in the background when a document is opened."""
+    from app.services.ai.unified_agent import get_unified_agent, DocumentModel, Language
+    
+    data = request.get_json()
+    agent = get_unified_agent()
+    
+    doc_data = data.get('doc') or data.get('document')
+    if not doc_data:
+        return jsonify({"success": False, "error": "Missing document data"}), 400
+    doc = DocumentModel.from_dict(doc_data)
+    
+    locales = [l.value for l in Language]
+    locale_str = data.get('locale', 'en')
+    locale = Language(locale_str) if locale_str in locales else Language.ENGLISH
+    
+    # Optional per-intent requests, sent exactly as the editor's later
+    # suggestion calls will send them so the cache keys match
+    requests = [
+        (
+            req['intent'],
+            Language(req['locale']) if req.get('locale') in locales else Language.ENGLISH,
+            req.get('context')
+        )
+        for req in data.get('requests') or []
+        if req.get('intent')
+    ]
+    
+    scheduled = agent.schedule_warmup(doc, locale, data.get('context'), requests or None)
+    return jsonify({"success": True, "scheduled": scheduled})
+
+
 @app.route('/api/ai/agent/command', methods=['POST'])
 @handle_errors
 def process_command():
@@ -736,6 +883,56 @@ def generate_ab_variants():
     })
 
 
+@app.route('/api/ai/agent/ab-test/batch', methods=['POST'])
+@handle_errors
+def generate_ab_variants_batch():
+    """
+    Queue offline A/B generation for many creatives via Gemini Batch Mode.
+    Returns the job name; poll /api/ai/agent/ab-test/batch/<job> to collect
+    the results, which are then also returned by /api/ai/agent/ab-test.
+    """
+    from app.services.ai.unified_agent import get_unified_agent, DocumentModel
+    
+    data = request.get_json()
+    agent = get_unified_agent()
+    
+    docs = []
+    for doc_data in data.get('documents', []):
+        doc_data = get_document_data({'doc': doc_data})
+        if doc_data:
+            docs.append(DocumentModel.from_dict(doc_data))
+    if not docs:
+        return jsonify({"success": False, "error": "Missing document data"}), 400
+    
+    job = run_async(agent.submit_ab_batch(docs, data.get('context', {})))
+    return jsonify({"success": True, "scheduled": len(docs), "job": job})
+
+
+@app.route('/api/ai/agent/ab-test/batch/<path:job>', methods=['GET'])
+@handle_errors
+def get_ab_variants_batch(job):
+    """
+    Check a queued A/B batch job. The first call after the job finishes
+    collects its results; any worker can answer.
+    """
+    from app.services.ai.unified_agent import get_unified_agent
+    
+    agent = get_unified_agent()
+    record = run_async(agent.collect_ab_batch(job))
+    if record is None:
+        return jsonify({"success": False, "error": "Unknown batch job"}), 404
+    
+    return jsonify({
+        "success": True,
+        "job": job,
+        "state": record["state"],
+        "results": [
+            {"doc_id": entry["doc_id"], "suggestion": entry["suggestion"]}
+            for entry in record["requests"].values()
+        ] if record["state"] == "done" else []
+    })
+
+
 @app.route('/api/ai/agent/style-suggestions', methods=['POST'])
 @handle_errors
 def get_style_suggestions():
@@ -991,7 +1188,7 @@ def telemetry():
 def remove_background():
     """Remove background from image - handles both JSON and FormData."""
     try:
-        from app.services.ai.background_removal import BackgroundRemovalService
+        from app.services.ai.background_removal import get_background_removal_service
         import base64
         from PIL import Image
         import io
@@ -1060,7 +1257,7 @@ def remove_background():
         
         try:
             # Use silueta model - much smaller (~4MB vs 176MB u2net)
-            service = BackgroundRemovalService(model='silueta')
+            service = get_background_removal_service(model='silueta')
             
             # Remove background with memory-optimized settings
             result = service.remove_background(
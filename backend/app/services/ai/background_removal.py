@@ -4,8 +4,11 @@ Removes backgrounds from product images for clean compositing.
 """
 
 import io
+import os
+import time
 import base64
-from typing import Dict, Any, Optional, Tuple
+import threading
+from typing import Dict, Any, Optional, Tuple, Union, Literal
 from dataclasses import dataclass
 from pathlib import Path
 from loguru import logger
@@ -13,6 +16,8 @@ from loguru import logger
 # Try importing rembg
 try:
     from rembg import remove, new_session
+    from rembg.sessions import sessions_class
+    import onnxruntime as ort
     REMBG_AVAILABLE = True
 except ImportError:
     REMBG_AVAILABLE = False
@@ -26,6 +31,51 @@ except ImportError:
     PIL_AVAILABLE = False
     logger.warning("PIL not available")
 
+# Try importing numpy
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Try importing OpenCV (guided-filter edge refinement)
+try:
+    import cv2
+    CV2_AVAILABLE = True
+    XIMGPROC_AVAILABLE = hasattr(cv2, "ximgproc")
+except ImportError:
+    CV2_AVAILABLE = False
+    XIMGPROC_AVAILABLE = False
+
+# Optional fast codecs: libvips for PNG/other formats, libjpeg-turbo for JPEG
+try:
+    import pyvips
+    VIPS_AVAILABLE = True
+except (ImportError, OSError):
+    VIPS_AVAILABLE = False
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except (ImportError, OSError, RuntimeError):
+    TURBOJPEG_AVAILABLE = False
+
+_VIPS_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+# Band layouts _VIPS_MODES holds for; anything else is decoded by PIL
+_VIPS_INTERPRETATIONS = ("srgb", "b-w")
+
+# zlib level for PNG output (fast encode over small size savings)
+PNG_COMPRESS_LEVEL = 1
+
+
+# Where graph-optimized ONNX models are persisted between runs
+ORT_CACHE_DIR = Path(os.path.expanduser("~/.cache/rmcb"))
+
+
+# Output formats accepted by remove_background(return_type=...)
+ReturnType = Literal["base64", "pil", "bytes", "ndarray"]
+
 
 class RembgModel:
     """Available rembg models."""
@@ -38,6 +88,18 @@ class RembgModel:
     ISNET_ANIME = "isnet-anime"
 
 
+# Fixed input side each model is fed by rembg (U²-Net family 320, ISNet 1024)
+MODEL_INPUT_SIZES = {
+    RembgModel.U2NET: 320,
+    RembgModel.U2NETP: 320,
+    RembgModel.U2NET_HUMAN_SEG: 320,
+    RembgModel.U2NET_CLOTH_SEG: 768,
+    RembgModel.SILUETA: 320,
+    RembgModel.ISNET_GENERAL_USE: 1024,
+    RembgModel.ISNET_ANIME: 1024,
+}
+
+
 @dataclass
 class RemovalResult:
     """Result of background removal."""
@@ -48,6 +110,7 @@ class RemovalResult:
     processing_time: float
     model_used: str
     error: Optional[str] = None
+    image: Optional[Any] = None  # PIL image / PNG bytes / ndarray for non-base64 return types
 
 
 class BackgroundRemovalService:
@@ -61,16 +124,22 @@ class BackgroundRemovalService:
     - Transparent PNG output
     """
     
-    def __init__(self, model: str = RembgModel.SILUETA):
+    def __init__(self, model: str = RembgModel.SILUETA, max_side: Optional[int] = 1024):
         """
         Initialize background removal service.
         
         Args:
             model: rembg model to use (silueta is lightweight ~4MB)
+            max_side: Longest side used for inference; larger inputs are
+                downscaled and the mask is upscaled back (None disables)
         """
         self.model_name = model
+        self.max_side = max_side
         self.session = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
         
     def initialize(self) -> bool:
         """Initialize the removal model."""
@@ -79,42 +148,118 @@ class BackgroundRemovalService:
             
         if not REMBG_AVAILABLE:
             logger.error("rembg not available")
+            self._ready.set()
             return False
+        
+        with self._init_lock:
+            if self._initialized:
+                return True
+            try:
+                logger.info(f"Loading background removal model: {self.model_name}")
+                try:
+                    self.session = self._new_optimized_session()
+                except Exception as e:
+                    logger.warning(f"Optimized session unavailable, using default: {e}")
+                    self.session = new_session(self.model_name)
+                self._initialized = True
+                logger.info("✓ Background removal model loaded")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to load rembg model: {e}")
+                return False
+            finally:
+                self._ready.set()
+    
+    def warmup_async(self) -> None:
+        """Start loading the model on a daemon thread so it is hot before first use."""
+        if self._initialized or self._warmup_thread is not None:
+            return
+        self._warmup_thread = threading.Thread(
+            target=self.initialize,
+            name="rembg-warmup",
+            daemon=True
+        )
+        self._warmup_thread.start()
+    
+    def _session_options(self) -> "ort.SessionOptions":
+        """Build ORT session options, honouring OMP_NUM_THREADS like rembg."""
+        opts = ort.SessionOptions()
+        # Keep weights out of the per-process arena so pages loaded in a
+        # pre-fork master stay shared copy-on-write across workers
+        opts.enable_mem_pattern = True
+        opts.enable_cpu_mem_arena = False
+        # Pin dynamic H/W dims to the size rembg always feeds, so execution
+        # providers compile shape-specific kernels once
+        input_size = MODEL_INPUT_SIZES.get(self.model_name)
+        if input_size:
+            opts.add_free_dimension_override_by_name("height", input_size)
+            opts.add_free_dimension_override_by_name("width", input_size)
+        if "OMP_NUM_THREADS" in os.environ:
+            threads = int(os.environ["OMP_NUM_THREADS"])
+            opts.inter_op_num_threads = threads
+            opts.intra_op_num_threads = threads
+        return opts
+    
+    def _new_optimized_session(self):
+        """
+        Create a rembg session whose ORT graph optimizations are cached on disk.
+        
+        The first run optimizes the model and writes it to ORT_CACHE_DIR;
+        later runs load the pre-optimized graph and skip optimization.
+        """
+        session_class = next(sc for sc in sessions_class if sc.name() == self.model_name)
+        opt_path = ORT_CACHE_DIR / f"{self.model_name}.opt.onnx"
+        opts = self._session_options()
+        
+        if opt_path.exists():
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
             
-        try:
-            logger.info(f"Loading background removal model: {self.model_name}")
-            self.session = new_session(self.model_name)
-            self._initialized = True
-            logger.info("✓ Background removal model loaded")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to load rembg model: {e}")
-            return False
+            class _PreoptimizedSession(session_class):
+                @classmethod
+                def download_models(cls, *args, **kwargs):
+                    return str(opt_path)
+            
+            logger.info(f"Using cached optimized model: {opt_path}")
+            return _PreoptimizedSession(self.model_name, opts)
+        
+        ORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.optimized_model_filepath = str(opt_path)
+        return session_class(self.model_name, opts)
     
     def remove_background(
         self,
-        image_input: str,  # Base64 or file path
-        alpha_matting: bool = True,
+        image_input: Union[str, bytes, "Image.Image", "np.ndarray"],
+        alpha_matting: bool = False,
         post_process: bool = True,
-        add_shadow: bool = False
+        add_shadow: bool = False,
+        return_type: ReturnType = "base64",
+        refine_edges: bool = True
     ) -> RemovalResult:
         """
         Remove background from an image.
         
         Args:
-            image_input: Base64 encoded image or file path
-            alpha_matting: Use alpha matting for better edges
+            image_input: Base64 string, file path, raw bytes, PIL image or ndarray
+            alpha_matting: Use rembg's closed-form alpha matting (slow, CPU-bound)
             post_process: Apply post-processing (smoothing, etc.)
             add_shadow: Add drop shadow for compositing
+            return_type: "base64" fills image_base64; "pil", "bytes" and
+                "ndarray" fill image and skip the base64 encode
+            refine_edges: Refine the mask with a fast guided filter
             
         Returns:
             RemovalResult with transparent PNG
         """
-        import time
-        start = time.time()
+        start = time.perf_counter()
         
         if not self._initialized:
-            self.initialize()
+            if self._warmup_thread is not None:
+                # Background warmup in progress - wait instead of loading twice
+                self._ready.wait()
+            if not self._initialized:
+                # No warmup, or it failed - load (or retry) here
+                self.initialize()
             
         if not REMBG_AVAILABLE or not PIL_AVAILABLE:
             return RemovalResult(
@@ -128,30 +273,11 @@ class BackgroundRemovalService:
             )
         
         try:
-            # Load image
-            if image_input.startswith("data:"):
-                # Data URL
-                image_data = base64.b64decode(image_input.split(",")[1])
-                image = Image.open(io.BytesIO(image_data))
-            elif len(image_input) > 500:  
-                # Likely base64
-                image_data = base64.b64decode(image_input)
-                image = Image.open(io.BytesIO(image_data))
-            else:
-                # File path
-                image = Image.open(image_input)
-            
+            image = self._load_image(image_input)
             original_size = image.size
             
             # Remove background
-            result_image = remove(
-                image,
-                session=self.session,
-                alpha_matting=alpha_matting,
-                alpha_matting_foreground_threshold=240,
-                alpha_matting_background_threshold=10,
-                alpha_matting_erode_size=10
-            )
+            result_image = self._remove(image, alpha_matting, refine_edges)
             
             # Post-process
             if post_process:
@@ -161,12 +287,21 @@ class BackgroundRemovalService:
             if add_shadow:
                 result_image = self._add_shadow(result_image)
             
-            # Convert to base64
-            buffered = io.BytesIO()
-            result_image.save(buffered, format="PNG")
-            img_b64 = base64.b64encode(buffered.getvalue()).decode()
+            # Convert to the requested output format
+            img_b64 = None
+            output = None
+            if return_type == "base64":
+                img_b64 = base64.b64encode(self._encode_png(result_image)).decode("ascii")
+            elif return_type == "pil":
+                output = result_image
+            elif return_type == "bytes":
+                output = bytes(self._encode_png(result_image))
+            elif return_type == "ndarray":
+                output = np.asarray(result_image)
+            else:
+                raise ValueError(f"Unknown return_type: {return_type}")
             
-            elapsed = time.time() - start
+            elapsed = time.perf_counter() - start
             
             return RemovalResult(
                 success=True,
@@ -174,7 +309,8 @@ class BackgroundRemovalService:
                 original_size=original_size,
                 has_alpha=True,
                 processing_time=elapsed,
-                model_used=self.model_name
+                model_used=self.model_name,
+                image=output
             )
             
         except Exception as e:
@@ -184,11 +320,154 @@ class BackgroundRemovalService:
                 image_base64=None,
                 original_size=(0, 0),
                 has_alpha=False,
-                processing_time=time.time() - start,
+                processing_time=time.perf_counter() - start,
                 model_used=self.model_name,
                 error=str(e)
             )
     
+    def _remove(
+        self,
+        image: "Image.Image",
+        alpha_matting: bool,
+        refine_edges: bool = False
+    ) -> "Image.Image":
+        """
+        Run rembg, downscaling large inputs first.
+        
+        Alpha matting runs at full input resolution, so for large photos
+        the cutout is computed on a copy no bigger than max_side and only
+        its alpha is upscaled back onto the original pixels. Edge
+        refinement also runs at that reduced size.
+        """
+        options = dict(
+            session=self.session,
+            alpha_matting=alpha_matting,
+            alpha_matting_foreground_threshold=240,
+            alpha_matting_background_threshold=10,
+            alpha_matting_erode_size=10
+        )
+        
+        if not self.max_side or max(image.size) <= self.max_side:
+            result = remove(image, **options)
+            if refine_edges:
+                result.putalpha(self._refine_mask(image, result.getchannel("A")))
+            return result
+        
+        w, h = image.size
+        scale = self.max_side / max(w, h)
+        small = image.resize((round(w * scale), round(h * scale)), Image.LANCZOS)
+        
+        mask = remove(small, **options).getchannel("A")
+        if refine_edges:
+            mask = self._refine_mask(small, mask)
+        mask = mask.resize(image.size, Image.BICUBIC)
+        
+        rgb = image.convert("RGB")
+        return Image.merge("RGBA", (*rgb.split(), mask))
+    
+    def _refine_mask(
+        self,
+        guide: "Image.Image",
+        mask: "Image.Image",
+        radius: int = 8,
+        eps: float = 1e-3
+    ) -> "Image.Image":
+        """
+        Snap mask edges to the image with a guided filter.
+        
+        Uses cv2.ximgproc when opencv-contrib is installed, otherwise the
+        box-filter formulation on a grayscale guide.
+        """
+        if not (CV2_AVAILABLE and NUMPY_AVAILABLE):
+            return mask
+        
+        rgb = np.asarray(guide.convert("RGB"), dtype=np.float32) / 255.0
+        p = np.asarray(mask, dtype=np.float32) / 255.0
+        
+        if XIMGPROC_AVAILABLE:
+            q = cv2.ximgproc.guidedFilter(guide=rgb, src=p, radius=radius, eps=eps)
+        else:
+            I = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+            ksize = (2 * radius + 1, 2 * radius + 1)
+            mean_I = cv2.boxFilter(I, -1, ksize)
+            mean_p = cv2.boxFilter(p, -1, ksize)
+            var_I = cv2.boxFilter(I * I, -1, ksize) - mean_I * mean_I
+            cov_Ip = cv2.boxFilter(I * p, -1, ksize) - mean_I * mean_p
+            a = cov_Ip / (var_I + eps)
+            b = mean_p - a * mean_I
+            q = cv2.boxFilter(a, -1, ksize) * I + cv2.boxFilter(b, -1, ksize)
+        
+        return Image.fromarray((np.clip(q, 0.0, 1.0) * 255.0).astype(np.uint8), mode="L")
+    
+    def _load_image(
+        self,
+        image_input: Union[str, bytes, "Image.Image", "np.ndarray"]
+    ) -> "Image.Image":
+        """Load any supported input into a PIL image without extra round-trips."""
+        if isinstance(image_input, Image.Image):
+            return image_input
+        if NUMPY_AVAILABLE and isinstance(image_input, np.ndarray):
+            return Image.fromarray(image_input)
+        if isinstance(image_input, (bytes, bytearray, memoryview)):
+            return self._decode_bytes(image_input)
+        
+        if image_input.startswith("data:"):
+            # Data URL - decode after the comma without splitting the string
+            comma = image_input.find(",")
+            image_data = base64.b64decode(image_input[comma + 1:] if comma != -1 else image_input)
+            return self._decode_bytes(image_data)
+        if os.path.exists(image_input):
+            # File path
+            return Image.open(image_input)
+        # Raw base64
+        image_data = base64.b64decode(image_input)
+        return self._decode_bytes(image_data)
+    
+    def _decode_bytes(self, data: bytes) -> "Image.Image":
+        """Decode encoded image bytes, preferring turbojpeg/libvips over PIL."""
+        try:
+            if TURBOJPEG_AVAILABLE and NUMPY_AVAILABLE and bytes(data[:3]) == b"\xff\xd8\xff":
+                return Image.fromarray(_turbo_jpeg.decode(bytes(data), pixel_format=TJPF_RGB))
+            
+            if VIPS_AVAILABLE:
+                vips_img = pyvips.Image.new_from_buffer(data, "")
+                if vips_img.interpretation == "cmyk":
+                    # Four bands, but not RGBA - convert before picking a mode
+                    vips_img = vips_img.colourspace("srgb")
+                mode = _VIPS_MODES.get(vips_img.bands)
+                if (vips_img.format == "uchar" and mode
+                        and vips_img.interpretation in _VIPS_INTERPRETATIONS):
+                    return Image.frombytes(
+                        mode,
+                        (vips_img.width, vips_img.height),
+                        vips_img.write_to_memory()
+                    )
+        except Exception as e:
+            logger.debug(f"Fast decode failed, falling back to PIL: {e}")
+        
+        return Image.open(io.BytesIO(data))
+    
+    def _encode_png(self, image: "Image.Image") -> Union[bytes, memoryview]:
+        """
+        Encode an image as PNG, using libvips when available.
+        
+        The PIL path returns a zero-copy view of the encode buffer. Responses
+        are ephemeral, so a low compression level is used: zlib level 6 costs
+        most of the encode time for a few percent of size.
+        """
+        if VIPS_AVAILABLE and image.mode in ("L", "LA", "RGB", "RGBA"):
+            try:
+                vips_img = pyvips.Image.new_from_memory(
+                    image.tobytes(), image.width, image.height, len(image.mode), "uchar"
+                )
+                return vips_img.write_to_buffer(f".png[compression={PNG_COMPRESS_LEVEL},filter=none]")
+            except Exception as e:
+                logger.debug(f"libvips PNG encode failed, falling back to PIL: {e}")
+        
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return buffered.getbuffer()
+    
     def _post_process(self, image: "Image.Image") -> "Image.Image":
         """Apply post-processing to improve edges."""
         if not PIL_AVAILABLE:
@@ -198,14 +477,9 @@ class BackgroundRemovalService:
         if image.mode != "RGBA":
             image = image.convert("RGBA")
         
-        # Get alpha channel
-        r, g, b, a = image.split()
-        
-        # Smooth alpha edges slightly
-        a = a.filter(ImageFilter.SMOOTH)
-        
-        # Recombine
-        image = Image.merge("RGBA", (r, g, b, a))
+        # Smooth alpha edges slightly, in place (no RGB channel copies)
+        alpha = image.getchannel("A").filter(ImageFilter.SMOOTH)
+        image.putalpha(alpha)
         
         return image
     
@@ -267,7 +541,14 @@ class BackgroundRemovalService:
         images: list,
         **kwargs
     ) -> list:
-        """Remove backgrounds from multiple images."""
+        """
+        Remove backgrounds from multiple images.
+        
+        Results default to PIL images so in-process pipelines skip the
+        PNG/base64 encode between stages; pass return_type="base64" for
+        API responses.
+        """
+        kwargs.setdefault("return_type", "pil")
         results = []
         for img in images:
             result = self.remove_background(img, **kwargs)
@@ -280,7 +561,9 @@ class BackgroundRemovalService:
             "initialized": self._initialized,
             "model": self.model_name,
             "rembg_available": REMBG_AVAILABLE,
-            "pil_available": PIL_AVAILABLE
+            "pil_available": PIL_AVAILABLE,
+            "vips_available": VIPS_AVAILABLE,
+            "turbojpeg_available": TURBOJPEG_AVAILABLE
         }
 
 
@@ -289,12 +572,30 @@ _bg_removal_service: Optional[BackgroundRemovalService] = None
 
 
 def get_background_removal_service(model: str = None) -> BackgroundRemovalService:
-    """Get or create the global background removal service."""
+    """Get or create the global background removal service (model loads in the background)."""
     global _bg_removal_service
     
     if _bg_removal_service is None:
         _bg_removal_service = BackgroundRemovalService(
             model=model or RembgModel.SILUETA  # Use silueta - only ~4MB
         )
+        _bg_removal_service.warmup_async()
     
     return _bg_removal_service
+
+
+def warmup(model: str = None) -> bool:
+    """
+    Load the global background removal model synchronously.
+    
+    Call from a pre-fork master (gunicorn --preload) so forked workers
+    share the loaded model instead of each loading their own copy.
+    """
+    global _bg_removal_service
+    
+    if _bg_removal_service is None:
+        _bg_removal_service = BackgroundRemovalService(
+            model=model or RembgModel.SILUETA
+        )
+    
+    return _bg_removal_service.initialize()
@@ -0,0 +1,112 @@
+"""
+Request Batching
+Coalesces concurrent pipeline calls from worker threads into batched calls.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, List, Callable, Hashable
+
+
+class RequestBatcher:
+    """
+    Coalesces concurrent single-image pipeline calls into list-input calls.
+    
+    submit() blocks the calling worker thread. One caller at a time leads:
+    it runs pending items as one pipeline call per key group until its own
+    item is done, then hands leadership to a thread that is still waiting.
+    Items that arrive while a batch runs are picked up by the next one; the
+    leader only waits window_ms for a batch to fill when the previous batch
+    had more than one item. Being thread-based, it batches across event
+    loops too.
+    """
+    
+    def __init__(
+        self,
+        run_batch: Callable[[List[Dict[str, Any]]], List[Any]],
+        max_batch: int = 4,
+        window_ms: int = 20,
+        key: Optional[Callable[[Dict[str, Any]], Hashable]] = None
+    ):
+        """
+        Args:
+            run_batch: Runs a list of items, returning one output per item
+            max_batch: Largest number of items per pipeline call
+            window_ms: How long the leader waits for a batch to fill under load
+            key: Items are only batched with items of the same key
+        """
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.key = key
+        self._cond = threading.Condition()
+        self._pending: List[tuple] = []
+        self._leading = False
+        self._last_batch_size = 0
+    
+    def submit(self, item: Dict[str, Any]) -> Any:
+        """Run item as part of the next batch and return its output."""
+        future = Future()
+        with self._cond:
+            self._pending.append((item, future))
+            self._cond.notify_all()
+            while self._leading and not future.done():
+                self._cond.wait()
+            if future.done():
+                return future.result()
+            self._leading = True
+        
+        try:
+            self._lead(future)
+        finally:
+            with self._cond:
+                self._leading = False
+                self._cond.notify_all()
+        return future.result()
+    
+    def _lead(self, own: Future) -> None:
+        """Run pending items in batches until own is resolved."""
+        while not own.done():
+            with self._cond:
+                if self._last_batch_size > 1:
+                    self._cond.wait_for(
+                        lambda: len(self._pending) >= self.max_batch,
+                        timeout=self.window
+                    )
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            
+            self._last_batch_size = len(batch)
+            try:
+                self._run(batch)
+            finally:
+                with self._cond:
+                    self._cond.notify_all()
+    
+    def _run(self, batch: List[tuple]) -> None:
+        """Run one batch, resolving every future in it."""
+        groups: Dict[Hashable, List[tuple]] = {}
+        for entry in batch:
+            groups.setdefault(self.key(entry[0]) if self.key else None, []).append(entry)
+        
+        try:
+            for group in groups.values():
+                try:
+                    outputs = list(self.run_batch([item for item, _ in group]))
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                
+                for (_, future), output in zip(group, outputs):
+                    future.set_result(output)
+                for _, future in group[len(outputs):]:
+                    future.set_exception(RuntimeError(
+                        f"run_batch returned {len(outputs)} outputs for {len(group)} items"
+                    ))
+        except BaseException as e:
+            # Interrupted mid-batch: don't leave any caller waiting forever
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
@@ -10,12 +10,16 @@ Perfect for cloud deployment (Render/Railway/Vercel):
 """
 
 import os
+import time
+import asyncio
 import requests
+import httpx
 import base64
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Awaitable
 from loguru import logger
-from io import BytesIO
-from PIL import Image
+
+# PNG and JPEG magic numbers
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff")
 
 
 class FreeImageAPI:
@@ -35,12 +39,65 @@ class FreeImageAPI:
         "realistic": "SG161222/Realistic_Vision_V5.1_noVAE"
     }
     
+    # Max in-flight requests for generate_many (Hugging Face rate limits)
+    MAX_CONCURRENCY = 8
+    
     def __init__(self):
         self.api_url = "https://router.huggingface.co/models/"
         # Optional: Add HF token for faster inference (not required)
         self.hf_token = os.getenv("HF_TOKEN", "")
         logger.info("Free Image API initialized (Hugging Face Router)")
         
+    def _build_request(
+        self,
+        prompt: str,
+        model_type: str,
+        negative_prompt: str,
+        width: int,
+        height: int,
+        num_inference_steps: int,
+        guidance_scale: float
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """Build the URL, headers and payload for a generation request."""
+        model_id = self.MODELS.get(model_type, self.MODELS["sdxl"])
+        url = f"{self.api_url}{model_id}"
+        
+        headers = {"Content-Type": "application/json"}
+        if self.hf_token:
+            headers["Authorization"] = f"Bearer {self.hf_token}"
+        
+        # Build payload
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "negative_prompt": negative_prompt,
+                "width": width,
+                "height": height,
+                "num_inference_steps": num_inference_steps,
+                "guidance_scale": guidance_scale
+            }
+        }
+        return url, headers, payload
+    
+    def _image_result(self, image_bytes: bytes, model_type: str) -> Optional[Dict[str, Any]]:
+        """Validate image bytes and wrap them in a result dict."""
+        # Cheap magic-number check instead of a full PIL decode/verify
+        if not image_bytes.startswith(IMAGE_SIGNATURES):
+            logger.error(f"Invalid image data: unrecognized header {image_bytes[:8]!r}")
+            return None
+        
+        # Convert to base64
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        
+        logger.info(f"✅ Image generated successfully ({len(image_bytes)} bytes)")
+        
+        return {
+            "success": True,
+            "image": base64_image,
+            "model": model_type,
+            "source": "huggingface_api"
+        }
+    
     def generate(
         self,
         prompt: str,
@@ -57,24 +114,10 @@ class FreeImageAPI:
         Returns dict with base64 image
         """
         try:
-            model_id = self.MODELS.get(model_type, self.MODELS["sdxl"])
-            url = f"{self.api_url}{model_id}"
-            
-            headers = {"Content-Type": "application/json"}
-            if self.hf_token:
-                headers["Authorization"] = f"Bearer {self.hf_token}"
-            
-            # Build payload
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "negative_prompt": negative_prompt,
-                    "width": width,
-                    "height": height,
-                    "num_inference_steps": num_inference_steps,
-                    "guidance_scale": guidance_scale
-                }
-            }
+            url, headers, payload = self._build_request(
+                prompt, model_type, negative_prompt, width, height,
+                num_inference_steps, guidance_scale
+            )
             
             logger.info(f"🎨 Generating image via API: {model_type}")
             
@@ -85,33 +128,12 @@ class FreeImageAPI:
                 
                 if response.status_code == 200:
                     # Success - convert to base64
-                    image_bytes = response.content
-                    
-                    # Verify it's a valid image
-                    try:
-                        img = Image.open(BytesIO(image_bytes))
-                        img.verify()
-                        
-                        # Convert to base64
-                        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-                        
-                        logger.info(f"✅ Image generated successfully ({len(image_bytes)} bytes)")
-                        
-                        return {
-                            "success": True,
-                            "image": base64_image,
-                            "model": model_type,
-                            "source": "huggingface_api"
-                        }
-                    except Exception as e:
-                        logger.error(f"Invalid image data: {e}")
-                        return None
+                    return self._image_result(response.content, model_type)
                         
                 elif response.status_code == 503:
                     # Model loading, retry
                     if attempt < max_retries - 1:
                         logger.warning(f"Model loading... retrying in 20s (attempt {attempt+1}/{max_retries})")
-                        import time
                         time.sleep(20)
                         continue
                     else:
@@ -127,6 +149,86 @@ class FreeImageAPI:
             logger.error(f"Image generation failed: {e}")
             return None
     
+    async def generate_async(
+        self,
+        prompt: str,
+        model_type: str = "sdxl",
+        negative_prompt: str = "blurry, low quality, distorted",
+        width: int = 1024,
+        height: int = 768,
+        num_inference_steps: int = 25,
+        guidance_scale: float = 7.5,
+        client: Optional[httpx.AsyncClient] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Async variant of generate() so several images can be requested concurrently.
+        Pass a shared client to reuse its connection pool.
+        """
+        if client is None:
+            async with httpx.AsyncClient(timeout=120) as own_client:
+                return await self.generate_async(
+                    prompt, model_type, negative_prompt, width, height,
+                    num_inference_steps, guidance_scale, client=own_client
+                )
+        
+        try:
+            url, headers, payload = self._build_request(
+                prompt, model_type, negative_prompt, width, height,
+                num_inference_steps, guidance_scale
+            )
+            
+            logger.info(f"🎨 Generating image via API (async): {model_type}")
+            
+            max_retries = 2
+            for attempt in range(max_retries):
+                response = await client.post(url, headers=headers, json=payload, timeout=120)
+                
+                if response.status_code == 200:
+                    return self._image_result(response.content, model_type)
+                elif response.status_code == 503:
+                    if attempt < max_retries - 1:
+                        logger.warning(f"Model loading... retrying in 20s (attempt {attempt+1}/{max_retries})")
+                        await asyncio.sleep(20)
+                        continue
+                    else:
+                        logger.error("Model failed to load after retries")
+                        return None
+                else:
+                    logger.error(f"API error {response.status_code}: {response.text}")
+                    return None
+            
+            return None
+        
+        except Exception as e:
+            logger.error(f"Image generation failed: {e}")
+            return None
+    
+    async def generate_many(
+        self,
+        prompts: List[str],
+        max_concurrency: int = MAX_CONCURRENCY,
+        **kwargs
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Generate one image per prompt concurrently over a shared connection pool.
+        Concurrency is capped to respect Hugging Face rate limits.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        limits = httpx.Limits(max_connections=max_concurrency * 2)
+        
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            # Created up front so an unknown keyword raises TypeError here
+            # instead of being swallowed by gather as a failed image
+            calls = [self.generate_async(p, client=client, **kwargs) for p in prompts]
+            
+            async def _one(call: Awaitable[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+                async with semaphore:
+                    return await call
+            
+            results = await asyncio.gather(*(_one(c) for c in calls), return_exceptions=True)
+        
+        return [None if isinstance(r, BaseException) else r for r in results]
+    
     def generate_background(
         self,
         prompt: str,
@@ -4,14 +4,27 @@ Provides AI-powered creative suggestions, layout generation, and text content us
 """
 
 import asyncio
+import atexit
+import concurrent.futures
+import functools
+import hashlib
 import json
 import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
 from typing import Dict, Any, List, Optional, AsyncGenerator
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 from enum import Enum
+from types import MappingProxyType
 from loguru import logger
 from pathlib import Path
 
+from .semantic_cache import SemanticCache
+
 # Load environment variables
 try:
     from dotenv import load_dotenv
@@ -24,10 +37,58 @@ except ImportError:
 try:
     from google import genai
     GEMINI_AVAILABLE = True
+    # service_tier arrived in google-genai 2.0; older config models reject
+    # unknown fields, so only send it when the installed SDK defines it
+    SERVICE_TIER_SUPPORTED = "service_tier" in genai.types.GenerateContentConfig.model_fields
 except ImportError:
     GEMINI_AVAILABLE = False
+    SERVICE_TIER_SUPPORTED = False
     logger.warning("google-genai library not installed. Run: pip install google-genai")
 
+# Faster JSON parsing/serialization when orjson is installed
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps_sorted(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps_sorted(obj: Any) -> bytes:
+        return json.dumps(obj, sort_keys=True).encode()
+
+# Subheadlines used when creative suggestions can't be parsed
+SUBHEADLINE_FALLBACK = ("Limited time offer", "While stocks last", "Exclusive deal")
+
+# Appended to prompts in json_mode
+JSON_MODE_SUFFIX = "\n\nRespond ONLY with valid JSON, no markdown or code blocks."
+
+# Retries for transient API failures: exponential backoff from
+# RETRY_BASE_DELAY seconds (capped at RETRY_MAX_DELAY) plus up to 1s jitter
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 8.0
+TRANSIENT_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Terminal Batch Mode job states
+BATCH_DONE_STATES = frozenset({
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+})
+
+# Characters that affect JSON object boundaries
+_JSON_STRUCTURAL = re.compile(r'[{}"\\]')
+
+# Optional on-disk response cache shared across processes
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
 
 class GeminiModel(str, Enum):
     """Available Gemini models for different tasks."""
@@ -37,7 +98,7 @@ class GeminiModel(str, Enum):
     GEMINI_1_5_FLASH = "gemini-1.5-flash"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GeminiResponse:
     """Response from Gemini API."""
     success: bool
@@ -48,6 +109,92 @@ class GeminiResponse:
     error: Optional[str] = None
 
 
+def extract_json(text: str) -> Optional[str]:
+    """
+    Return the first complete top-level JSON object in text.
+    
+    Jumps between structural characters tracking brace depth and string
+    state, so braces inside string values don't end the object early.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_string = False
+    skip = -1
+    for match in _JSON_STRUCTURAL.finditer(text, start):
+        i = match.start()
+        if i == skip:
+            continue
+        ch = match.group()
+        if in_string:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+class _OwnerCancelled(Exception):
+    """The request a single-flight waiter was sharing got cancelled."""
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed Gemini call is worth retrying."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in TRANSIENT_STATUS_CODES
+
+
+async def _aiter_in_executor(iterable, executor: concurrent.futures.Executor = None):
+    """Iterate a blocking iterator without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(executor, next, iterator, done)
+        if item is done:
+            break
+        yield item
+
+
+class _RateLimiter:
+    """
+    Sliding-window limit on request starts across all event loops.
+    
+    Uses a thread lock and polling sleeps instead of asyncio primitives, which
+    are bound to a single loop while Flask runs each request on a new one.
+    """
+    
+    def __init__(self, max_requests: int, period: float = 60.0):
+        self.max_requests = max_requests
+        self.period = period
+        self._starts: deque = deque()
+        self._lock = threading.Lock()
+    
+    async def acquire(self) -> None:
+        """Wait until a request may start within the limit, then record it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= self.period:
+                    self._starts.popleft()
+                if len(self._starts) < self.max_requests:
+                    self._starts.append(now)
+                    return
+                wait = self._starts[0] + self.period - now
+            await asyncio.sleep(wait)
+
+
 class GeminiService:
     """
     Google Gemini LLM Service for AI-powered creative generation.
@@ -92,54 +239,136 @@ Suggest improvements and identify any compliance issues."""
     # Creative templates for different campaign types
     CAMPAIGN_TEMPLATES = {
         "sale": {
-            "headlines": [
+            "headlines": (
                 "{discount}% OFF - Limited Time!",
                 "MEGA SALE: Save Big on {product}",
                 "Flash Deal: {discount}% Off Everything",
                 "Don't Miss Out - {discount}% Discount"
-            ],
-            "ctas": ["Shop Now", "Grab Deal", "Buy Now", "Save Today"],
+            ),
+            "ctas": ("Shop Now", "Grab Deal", "Buy Now", "Save Today"),
             "mood": "urgent, exciting, bold"
         },
         "festive": {
-            "headlines": [
+            "headlines": (
                 "Celebrate {festival} with Amazing Deals",
                 "{festival} Special: Up to {discount}% Off",
                 "Festive Season Sale is Here!",
                 "Spread Joy with {festival} Offers"
-            ],
-            "ctas": ["Celebrate Now", "Shop Festive", "Get Festive Deals", "Unwrap Offers"],
+            ),
+            "ctas": ("Celebrate Now", "Shop Festive", "Get Festive Deals", "Unwrap Offers"),
             "mood": "joyful, celebratory, warm"
         },
         "new_arrival": {
-            "headlines": [
+            "headlines": (
                 "Just Arrived: {product}",
                 "NEW: Discover {product}",
                 "Fresh Arrivals You'll Love",
                 "Be First to Get {product}"
-            ],
-            "ctas": ["Explore Now", "Discover", "Shop New", "See What's New"],
+            ),
+            "ctas": ("Explore Now", "Discover", "Shop New", "See What's New"),
             "mood": "fresh, exciting, exclusive"
         },
         "premium": {
-            "headlines": [
+            "headlines": (
                 "Experience Premium Quality",
                 "Luxury Meets Value",
                 "The Finest {product} Collection",
                 "Elevate Your Style"
-            ],
-            "ctas": ["Explore Collection", "Discover Luxury", "Shop Premium", "Experience Now"],
+            ),
+            "ctas": ("Explore Collection", "Discover Luxury", "Shop Premium", "Experience Now"),
             "mood": "elegant, sophisticated, exclusive"
         }
     }
+    # Read-only all the way down (tuples inside) so the fallback can hand
+    # out template copy without callers mutating the shared templates
+    CAMPAIGN_TEMPLATES = MappingProxyType({
+        theme: MappingProxyType(template) for theme, template in CAMPAIGN_TEMPLATES.items()
+    })
+    
+    # Prompt templates, filled with str.format_map per call
+    _CREATIVE_PROMPT_TMPL = """Generate creative advertising copy for:
+Product: {product}
+Theme: {theme}
+Target Audience: {target_audience}
+Tone: {tone}
+Campaign Mood: {mood}
+
+Provide:
+1. 5 headline options (punchy, attention-grabbing)
+2. 3 subheadline options (support the headline)
+3. 5 CTA options (action-oriented)
+4. Short description (2-3 sentences)
+
+Output as JSON with keys: headlines, subheadlines, ctas, description"""
+
+    _LAYOUT_PROMPT_TMPL = """Design a {platform} ad layout for {width}x{height}px canvas.
+
+Elements to position: {elements}
+
+For each element, provide:
+- x, y coordinates (top-left corner)
+- width, height dimensions
+- z-index (layering)
+- alignment suggestion
+
+Consider:
+- Visual hierarchy (most important elements prominent)
+- Balance and whitespace
+- Platform best practices
+- Safe zones (avoid edges)
+
+Output as JSON with element names as keys."""
+
+    _COMPLIANCE_PROMPT_TMPL = """Check this advertising text for compliance:
+
+Text: "{text}"
+Retailer: {retailer}
+
+Check for:
+1. Misleading claims
+2. Prohibited words (best, #1, guaranteed, etc.)
+3. Price claim accuracy
+4. Trademark issues
+5. Grammar and spelling
+
+Output as JSON with:
+- compliant: true/false
+- issues: list of issues found
+- suggestions: list of corrections"""
+
+    _PALETTE_PROMPT_TMPL = """Suggest a color palette for:
+
+Brand: {brand_name}
+Mood: {mood}
+{primary_color_line}
+
+Provide:
+- 5 colors (primary, secondary, accent, background, text)
+- Hex codes
+- Usage suggestions
+- Accessibility notes (WCAG contrast)
+
+Output as JSON."""
     
-    def __init__(self, api_key: str = None, default_model: str = None):
+    # System prompts with the separator already appended, keyed by prompt text
+    _SYSTEM_PREFIXED = {v: v + "\n\n" for v in SYSTEM_PROMPTS.values()}
+    
+    def __init__(
+        self,
+        api_key: str = None,
+        default_model: str = None,
+        cache_size: int = 1024,
+        semantic_threshold: float = 0.92
+    ):
         """
         Initialize Gemini service.
         
         Args:
             api_key: Google Gemini API key (reads from GEMINI_API_KEY env var if not provided)
             default_model: Default model to use (reads from GEMINI_MODEL env var if not provided)
+            cache_size: Max responses kept in the in-memory exact-match cache
+            semantic_threshold: Cosine similarity for semantic cache hits
+                (semantic cache is enabled with GEMINI_SEMANTIC_CACHE=1)
         """
         # Load from environment variables if not provided
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
@@ -147,11 +376,51 @@ Suggest improvements and identify any compliance issues."""
         self._client = None
         self._initialized = False
         
+        # Dedicated, bounded pool for blocking SDK calls so Gemini bursts
+        # don't starve the default executor.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            thread_name_prefix="gemini"
+        )
+        
+        # Client-side cap on requests per minute so bursts (bulk suggestions,
+        # warmups) are delayed here instead of rejected with 429s
+        self._rate_limiter = _RateLimiter(int(os.getenv("GEMINI_MAX_RPM", "500")))
+        
+        # Exact-match response cache. Guarded by a thread lock rather than
+        # asyncio primitives because Flask routes run each request on a new loop.
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[str, GeminiResponse]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._disk_cache = None
+        cache_dir = os.getenv('GEMINI_CACHE_DIR')
+        if cache_dir and DISKCACHE_AVAILABLE:
+            self._disk_cache = diskcache.Cache(cache_dir)
+        
+        # Semantic cache for slot-templated suggestion prompts (needs
+        # sentence-transformers, so it is opt-in)
+        self._semantic_cache = None
+        if os.getenv('GEMINI_SEMANTIC_CACHE'):
+            semantic_cache = SemanticCache(threshold=semantic_threshold)
+            if semantic_cache.available:
+                self._semantic_cache = semantic_cache
+            else:
+                logger.warning("GEMINI_SEMANTIC_CACHE set but sentence-transformers is not installed")
+        
         if not self.api_key or self.api_key == 'your_api_key_here':
             logger.warning("⚠️  No valid GEMINI_API_KEY found! Set it in .env file or environment variable.")
         
         logger.info(f"Gemini service configured with model: {self.default_model}")
     
+    def close(self) -> None:
+        """Shut down the SDK thread pool without waiting for in-flight calls."""
+        self._executor.shutdown(wait=False)
+    
+    async def aclose(self) -> None:
+        """Async alias for close()."""
+        self.close()
+    
     async def initialize(self) -> bool:
         """Initialize Gemini client."""
         if not GEMINI_AVAILABLE:
@@ -175,7 +444,9 @@ Suggest improvements and identify any compliance issues."""
         model: str = None,
         temperature: float = 0.7,
         max_tokens: int = 1000,
-        json_mode: bool = False
+        json_mode: bool = False,
+        cache: bool = True,
+        service_tier: Optional[str] = None
     ) -> GeminiResponse:
         """
         Generate text using Gemini.
@@ -187,6 +458,9 @@ Suggest improvements and identify any compliance issues."""
             temperature: Creativity (0-1)
             max_tokens: Max response length
             json_mode: Request JSON output
+            cache: Serve identical requests from the response cache
+            service_tier: Inference tier ("priority", "standard" or "flex");
+                None uses the project default
         """
         if not GEMINI_AVAILABLE:
             return GeminiResponse(
@@ -201,48 +475,389 @@ Suggest improvements and identify any compliance issues."""
             
         model = model or self.default_model
         
-        try:
-            # Build the full prompt with system context
-            full_prompt = prompt
-            if system:
-                full_prompt = f"{system}\n\n{prompt}"
+        if not cache:
+            return await self._generate_uncached(prompt, system, model, json_mode, service_tier)
+        
+        key = self._cache_key(model, system, prompt, temperature, max_tokens, json_mode)
+        
+        while True:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
             
-            if json_mode:
-                full_prompt += "\n\nRespond ONLY with valid JSON, no markdown or code blocks."
+            # Single-flight: concurrent identical requests wait for one API call
+            with self._cache_lock:
+                pending = self._inflight.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._inflight[key] = concurrent.futures.Future()
             
-            # Call Gemini API
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self._client.models.generate_content(
-                    model=model,
-                    contents=full_prompt
-                )
-            )
+            if not owner:
+                try:
+                    # Shielded so a waiter's own cancellation doesn't cancel
+                    # the shared future under the owner and other waiters
+                    return replace(await asyncio.shield(asyncio.wrap_future(pending)))
+                except _OwnerCancelled:
+                    # The owning request was cancelled (e.g. timed out);
+                    # try again, possibly as the new owner
+                    continue
             
-            response_text = response.text
+            try:
+                result = await self._generate_uncached(prompt, system, model, json_mode, service_tier)
+                if result.success:
+                    self._cache_put(key, result)
+                self._release_inflight(key, pending)
+                pending.set_result(replace(result))
+                return result
+            except asyncio.CancelledError:
+                self._release_inflight(key, pending)
+                pending.set_exception(_OwnerCancelled())
+                raise
+            except BaseException as e:
+                self._release_inflight(key, pending)
+                pending.set_exception(e)
+                raise
+    
+    def _release_inflight(self, key: str, pending: concurrent.futures.Future) -> None:
+        """Drop a single-flight entry if it still belongs to this call."""
+        with self._cache_lock:
+            if self._inflight.get(key) is pending:
+                del self._inflight[key]
+    
+    async def batch_generate(self, specs: List[Dict[str, Any]]) -> List[GeminiResponse]:
+        """
+        Run several generate() calls concurrently.
+        
+        Args:
+            specs: List of generate() keyword-argument dicts
             
-            return GeminiResponse(
-                success=True,
-                response=response_text,
-                model=model
-            )
+        Returns:
+            Responses in the same order as specs
+        """
+        return list(await asyncio.gather(*(self.generate(**spec) for spec in specs)))
+    
+    async def generate_offline_batch(
+        self,
+        prompts: Dict[str, str],
+        system: str = None,
+        model: str = None,
+        json_mode: bool = False,
+        display_name: str = "rmcb-batch",
+        poll_interval: float = 60
+    ) -> Dict[str, GeminiResponse]:
+        """
+        Run prompts through Gemini Batch Mode and wait for the results.
+        
+        Batch jobs cost half as much as interactive calls and have separate
+        rate limits, but may take up to 24 hours - only for offline work.
+        Long-running servers should use submit_offline_batch() and check
+        back with get_offline_batch() instead of holding a task open.
+        
+        Args:
+            prompts: Request key -> user prompt
+            system: System prompt applied to every request
+            model: Model to use
+            json_mode: Request JSON output
+            display_name: Job name shown in the Gemini console
+            poll_interval: Seconds between job status checks
             
+        Returns:
+            Request key -> response, for every key in prompts
+        """
+        try:
+            name = await self.submit_offline_batch(prompts, system, model, json_mode, display_name)
         except Exception as e:
-            logger.error(f"Gemini generation error: {e}")
-            return GeminiResponse(
-                success=False,
-                response="",
-                model=model,
-                error=str(e)
+            logger.error(f"Gemini batch error: {e}")
+            return self._batch_failed(prompts, model or self.default_model, str(e))
+        
+        while True:
+            results = await self.get_offline_batch(name, list(prompts))
+            if results is not None:
+                return results
+            await asyncio.sleep(poll_interval)
+    
+    async def submit_offline_batch(
+        self,
+        prompts: Dict[str, str],
+        system: str = None,
+        model: str = None,
+        json_mode: bool = False,
+        display_name: str = "rmcb-batch"
+    ) -> str:
+        """
+        Start a Gemini Batch Mode job without waiting for it.
+        
+        Args:
+            prompts: Request key -> user prompt
+            system: System prompt applied to every request
+            model: Model to use
+            json_mode: Request JSON output
+            display_name: Job name shown in the Gemini console
+            
+        Returns:
+            The job name, for get_offline_batch()
+        """
+        if not GEMINI_AVAILABLE:
+            raise RuntimeError("google-genai library not installed")
+        if not self._initialized and not await self.initialize():
+            raise RuntimeError("Gemini client not initialized")
+        
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+            for key, prompt in prompts.items():
+                f.write(json.dumps({
+                    "key": key,
+                    "request": {
+                        "contents": [{
+                            "role": "user",
+                            "parts": [{"text": self._build_prompt(prompt, system, json_mode)}]
+                        }]
+                    }
+                }) + "\n")
+        
+        try:
+            uploaded = await self._call_sdk(
+                self._client.files.upload,
+                file=f.name,
+                config={"display_name": display_name, "mime_type": "jsonl"}
+            )
+            job = await self._call_sdk(
+                self._client.batches.create,
+                model=model or self.default_model,
+                src=uploaded.name,
+                config={"display_name": display_name}
             )
+        finally:
+            os.unlink(f.name)
+        
+        logger.info(f"Gemini batch {job.name} submitted with {len(prompts)} requests")
+        return job.name
+    
+    async def get_offline_batch(
+        self,
+        name: str,
+        keys: List[str]
+    ) -> Optional[Dict[str, GeminiResponse]]:
+        """
+        Check a Batch Mode job once and collect its output if it has finished.
+        
+        Only needs the job name, so any process can pick up a job that
+        another one submitted.
+        
+        Args:
+            name: Job name from submit_offline_batch()
+            keys: Request keys the job was submitted with
+            
+        Returns:
+            None while the job is still running, else request key -> response
+            for every key (failed responses if the job did not succeed)
+        """
+        model = self.default_model
+        if not GEMINI_AVAILABLE:
+            return self._batch_failed(keys, model, "google-genai library not installed")
+        if not self._initialized and not await self.initialize():
+            return self._batch_failed(keys, model, "Gemini client not initialized")
+        
+        try:
+            job = await self._call_sdk(self._client.batches.get, name=name)
+            model = (job.model or model).removeprefix("models/")
+            if job.state.name not in BATCH_DONE_STATES:
+                return None
+            
+            if job.state.name != "JOB_STATE_SUCCEEDED":
+                logger.error(f"Gemini batch {name} ended in {job.state.name}")
+                return self._batch_failed(keys, model, job.state.name)
+            
+            content = await self._call_sdk(self._client.files.download, file=job.dest.file_name)
+        except Exception as e:
+            logger.error(f"Gemini batch error: {e}")
+            return self._batch_failed(keys, model, str(e))
+        
+        results = self._batch_failed(keys, model, "missing from batch output")
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = _json_loads(line)
+            key = item.get("key")
+            if key not in results:
+                continue
+            try:
+                parts = item["response"]["candidates"][0]["content"]["parts"]
+                text = "".join(part.get("text", "") for part in parts)
+                results[key] = GeminiResponse(success=True, response=text, model=model)
+            except (KeyError, IndexError, TypeError):
+                results[key] = replace(results[key], error=str(item.get("error", "malformed batch response")))
+        return results
+    
+    @staticmethod
+    def _batch_failed(keys, model: str, error: str) -> Dict[str, GeminiResponse]:
+        """A failed response for every request key."""
+        return {
+            key: GeminiResponse(success=False, response="", model=model, error=error)
+            for key in keys
+        }
+    
+    def _call_sdk(self, fn, **kwargs) -> "asyncio.Future":
+        """Run a blocking SDK call on the service's thread pool."""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(fn, **kwargs))
+    
+    def _build_prompt(self, prompt: str, system: Optional[str], json_mode: bool = False) -> str:
+        """Build the full prompt with system context."""
+        full_prompt = prompt
+        if system:
+            prefix = self._SYSTEM_PREFIXED.get(system) or system + "\n\n"
+            full_prompt = "".join((prefix, prompt))
+        
+        if json_mode:
+            full_prompt += JSON_MODE_SUFFIX
+        return full_prompt
+    
+    async def _generate_uncached(
+        self,
+        prompt: str,
+        system: Optional[str],
+        model: str,
+        json_mode: bool,
+        service_tier: Optional[str] = None
+    ) -> GeminiResponse:
+        """
+        Call the Gemini API without consulting the response cache.
+        
+        Timeouts, rate limits and 5xx errors are retried with backoff.
+        """
+        full_prompt = self._build_prompt(prompt, system, json_mode)
+        config = {"service_tier": service_tier} if service_tier and SERVICE_TIER_SUPPORTED else None
+        
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                await self._rate_limiter.acquire()
+                
+                # Call Gemini API
+                response = await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    functools.partial(
+                        self._client.models.generate_content,
+                        model=model,
+                        contents=full_prompt,
+                        config=config
+                    )
+                )
+                
+                response_text = response.text
+                
+                return GeminiResponse(
+                    success=True,
+                    response=response_text,
+                    model=model
+                )
+                
+            except Exception as e:
+                if attempt + 1 < RETRY_ATTEMPTS and _is_transient(e):
+                    delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) + random.random()
+                    logger.warning(f"Gemini call failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"Gemini generation error: {e}")
+                return GeminiResponse(
+                    success=False,
+                    response="",
+                    model=model,
+                    error=str(e)
+                )
+    
+    @staticmethod
+    def _cache_key(
+        model: str,
+        system: Optional[str],
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        json_mode: bool
+    ) -> str:
+        """Hash the request parameters into a cache key."""
+        params = {
+            "model": model,
+            "system": system,
+            "prompt": prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "json_mode": json_mode
+        }
+        return hashlib.blake2b(
+            _json_dumps_sorted(params), digest_size=16
+        ).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[GeminiResponse]:
+        """Return a copy of a cached response, checking memory then disk."""
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return replace(cached)
+        
+        if self._disk_cache is not None:
+            data = self._disk_cache.get(key)
+            if data is not None:
+                cached = GeminiResponse(**data)
+                self._cache_put(key, cached, persist=False)
+                return replace(cached)
+        return None
+    
+    def _cache_put(self, key: str, response: GeminiResponse, persist: bool = True) -> None:
+        """Store a response, evicting the least recently used entry when full."""
+        with self._cache_lock:
+            self._cache[key] = replace(response)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        
+        if persist and self._disk_cache is not None:
+            self._disk_cache.set(key, asdict(response))
+    
+    def clear_cache(self) -> None:
+        """Drop all cached responses."""
+        with self._cache_lock:
+            self._cache.clear()
+        if self._disk_cache is not None:
+            self._disk_cache.clear()
+    
+    async def _generate_slotted(
+        self,
+        prompt: str,
+        system: str,
+        slots: Dict[str, str]
+    ) -> GeminiResponse:
+        """JSON-mode generate() that consults the semantic cache first."""
+        # Both embed the prompt (a blocking encode), so they run off the loop
+        if self._semantic_cache is not None:
+            cached = await asyncio.to_thread(self._semantic_cache.lookup, prompt, slots)
+            if cached is not None:
+                return GeminiResponse(success=True, response=cached, model=self.default_model)
+        
+        response = await self.generate(prompt=prompt, system=system, json_mode=True)
+        
+        if response.success and self._semantic_cache is not None:
+            await asyncio.to_thread(self._semantic_cache.store, prompt, slots, response.response)
+        return response
+    
+    def _parse_json_response(self, response: GeminiResponse, fallback: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse the first JSON object in a successful response, else return fallback."""
+        if response.success:
+            json_text = extract_json(response.response)
+            if json_text is not None:
+                try:
+                    return _json_loads(json_text)
+                except ValueError:
+                    pass
+        return fallback
     
     async def generate_stream(
         self,
         prompt: str,
         system: str = None,
         model: str = None,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        json_mode: bool = False
     ) -> AsyncGenerator[str, None]:
         """
         Generate text using Gemini with streaming.
@@ -252,6 +867,7 @@ Suggest improvements and identify any compliance issues."""
             system: System prompt
             model: Model to use
             temperature: Creativity (0-1)
+            json_mode: Request JSON output
             
         Yields:
             Chunks of generated text
@@ -263,24 +879,33 @@ Suggest improvements and identify any compliance issues."""
         model = model or self.default_model
         
         try:
-            # Build full prompt
-            full_prompt = prompt
-            if system:
-                full_prompt = f"{system}\n\n{prompt}"
+            full_prompt = self._build_prompt(prompt, system, json_mode)
             
-            # For now, use non-streaming and yield the result
-            # Gemini streaming support can be added when available
-            response = await self.generate(full_prompt, model=model, temperature=temperature)
+            await self._rate_limiter.acquire()
+            loop = asyncio.get_running_loop()
+            try:
+                stream = await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(
+                        self._client.models.generate_content_stream,
+                        model=model,
+                        contents=full_prompt
+                    )
+                )
+            except AttributeError:
+                # SDK without streaming support - yield the full response
+                response = await self.generate(
+                    prompt, system=system, model=model, temperature=temperature, json_mode=json_mode
+                )
+                if response.success:
+                    yield response.response
+                else:
+                    yield f"Error: {response.error}"
+                return
             
-            if response.success:
-                # Simulate streaming by yielding chunks
-                text = response.response
-                chunk_size = 50
-                for i in range(0, len(text), chunk_size):
-                    yield text[i:i+chunk_size]
-                    await asyncio.sleep(0.05)  # Small delay for streaming effect
-            else:
-                yield f"Error: {response.error}"
+            async for chunk in _aiter_in_executor(stream, self._executor):
+                if chunk.text:
+                    yield chunk.text
                 
         except Exception as e:
             logger.error(f"Streaming error: {e}")
@@ -305,46 +930,35 @@ Suggest improvements and identify any compliance issues."""
         Returns:
             Dict with headlines, subheadlines, CTAs, and descriptions
         """
-        template = self.CAMPAIGN_TEMPLATES.get(theme, self.CAMPAIGN_TEMPLATES["sale"])
+        templates = self.CAMPAIGN_TEMPLATES
+        template = templates.get(theme) or templates["sale"]
         
-        prompt = f"""Generate creative advertising copy for:
-Product: {product}
-Theme: {theme}
-Target Audience: {target_audience}
-Tone: {tone}
-Campaign Mood: {template['mood']}
-
-Provide:
-1. 5 headline options (punchy, attention-grabbing)
-2. 3 subheadline options (support the headline)
-3. 5 CTA options (action-oriented)
-4. Short description (2-3 sentences)
-
-Output as JSON with keys: headlines, subheadlines, ctas, description"""
+        prompt = self._CREATIVE_PROMPT_TMPL.format_map({
+            "product": product,
+            "theme": theme,
+            "target_audience": target_audience,
+            "tone": tone,
+            "mood": template["mood"]
+        })
 
-        response = await self.generate(
+        response = await self._generate_slotted(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["creative_suggestion"],
-            json_mode=True
+            slots={
+                "product": product,
+                "theme": theme,
+                "target_audience": target_audience,
+                "tone": tone
+            }
         )
         
-        if response.success:
-            try:
-                # Try to parse JSON from response
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', response.response)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-        
-        # Fallback to template-based
-        return {
+        # Parse JSON, falling back to template-based copy
+        return self._parse_json_response(response, {
             "headlines": template["headlines"],
-            "subheadlines": ["Limited time offer", "While stocks last", "Exclusive deal"],
+            "subheadlines": SUBHEADLINE_FALLBACK,
             "ctas": template["ctas"],
             "description": f"Exciting {theme} campaign for {product}."
-        }
+        })
     
     async def generate_layout_suggestion(
         self,
@@ -365,23 +979,12 @@ Output as JSON with keys: headlines, subheadlines, ctas, description"""
         Returns:
             Dict with element positions
         """
-        prompt = f"""Design a {platform} ad layout for {width}x{height}px canvas.
-
-Elements to position: {', '.join(elements)}
-
-For each element, provide:
-- x, y coordinates (top-left corner)
-- width, height dimensions
-- z-index (layering)
-- alignment suggestion
-
-Consider:
-- Visual hierarchy (most important elements prominent)
-- Balance and whitespace
-- Platform best practices
-- Safe zones (avoid edges)
-
-Output as JSON with element names as keys."""
+        prompt = self._LAYOUT_PROMPT_TMPL.format_map({
+            "platform": platform,
+            "width": width,
+            "height": height,
+            "elements": ", ".join(elements)
+        })
 
         response = await self.generate(
             prompt=prompt,
@@ -389,21 +992,12 @@ Output as JSON with element names as keys."""
             json_mode=True
         )
         
-        if response.success:
-            try:
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', response.response)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-        
-        # Fallback layout
-        return {
+        # Parse JSON, falling back to a default layout
+        return self._parse_json_response(response, {
             "headline": {"x": 50, "y": 100, "width": width-100, "height": 80, "z": 2},
             "product": {"x": width//2-150, "y": height//2-150, "width": 300, "height": 300, "z": 1},
             "cta": {"x": 50, "y": height-120, "width": 200, "height": 60, "z": 3}
-        }
+        })
     
     async def check_compliance(
         self,
@@ -420,22 +1014,7 @@ Output as JSON with element names as keys."""
         Returns:
             Dict with compliance results
         """
-        prompt = f"""Check this advertising text for compliance:
-
-Text: "{text}"
-Retailer: {retailer}
-
-Check for:
-1. Misleading claims
-2. Prohibited words (best, #1, guaranteed, etc.)
-3. Price claim accuracy
-4. Trademark issues
-5. Grammar and spelling
-
-Output as JSON with:
-- compliant: true/false
-- issues: list of issues found
-- suggestions: list of corrections"""
+        prompt = self._COMPLIANCE_PROMPT_TMPL.format_map({"text": text, "retailer": retailer})
 
         response = await self.generate(
             prompt=prompt,
@@ -443,20 +1022,11 @@ Output as JSON with:
             json_mode=True
         )
         
-        if response.success:
-            try:
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', response.response)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-        
-        return {
+        return self._parse_json_response(response, {
             "compliant": True,
             "issues": [],
             "suggestions": []
-        }
+        })
     
     async def suggest_color_palette(
         self,
@@ -475,37 +1045,20 @@ Output as JSON with:
         Returns:
             Dict with color palette
         """
-        prompt = f"""Suggest a color palette for:
-
-Brand: {brand_name}
-Mood: {mood}
-{f'Primary Color: {primary_color}' if primary_color else ''}
-
-Provide:
-- 5 colors (primary, secondary, accent, background, text)
-- Hex codes
-- Usage suggestions
-- Accessibility notes (WCAG contrast)
-
-Output as JSON."""
+        prompt = self._PALETTE_PROMPT_TMPL.format_map({
+            "brand_name": brand_name,
+            "mood": mood,
+            "primary_color_line": f"Primary Color: {primary_color}" if primary_color else ""
+        })
 
-        response = await self.generate(
+        response = await self._generate_slotted(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["color_palette"],
-            json_mode=True
+            slots={"brand_name": brand_name, "mood": mood}
         )
         
-        if response.success:
-            try:
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', response.response)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-        
-        # Fallback palette
-        return {
+        # Parse JSON, falling back to a default palette
+        return self._parse_json_response(response, {
             "colors": {
                 "primary": "#6366f1",
                 "secondary": "#8b5cf6",
@@ -520,15 +1073,20 @@ Output as JSON."""
                 "background": "Canvas background",
                 "text": "Primary text"
             }
-        }
+        })
 
 
 # Global instance
 _gemini_service = None
+_gemini_service_lock = threading.Lock()
 
 def get_gemini_service() -> GeminiService:
-    """Get or create global Gemini service instance."""
+    """Get or create global Gemini service instance (thread-safe)."""
     global _gemini_service
     if _gemini_service is None:
-        _gemini_service = GeminiService()
+        with _gemini_service_lock:
+            if _gemini_service is None:
+                service = GeminiService()
+                atexit.register(service.close)
+                _gemini_service = service
     return _gemini_service
@@ -14,12 +14,72 @@ CLOUD (Deployment):
 
 import os
 import asyncio
-from typing import Optional, Dict, Any
+import hashlib
+import threading
+import importlib.util
+from typing import Optional, Dict, Any, Literal, Union
 from loguru import logger
 from PIL import Image
 import base64
 from io import BytesIO
 
+# SIMD-accelerated base64 decoding when pybase64 is installed
+try:
+    import pybase64
+    _b64decode = pybase64.b64decode
+except ImportError:
+    _b64decode = base64.b64decode
+
+# Optional on-disk cache for generated backgrounds
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+
+# Environment variables that indicate a cloud deployment
+_CLOUD_KEYS = (
+    "RENDER",                   # Render.com
+    "RAILWAY_ENVIRONMENT",      # Railway
+    "VERCEL",                   # Vercel
+    "DYNO",                     # Heroku
+    "KUBERNETES_SERVICE_HOST",  # K8s
+)
+
+# Env doesn't change after start-up, so detect once at import
+_IS_CLOUD = any(os.environ.get(k) for k in _CLOUD_KEYS)
+
+
+# Generated backgrounds cache (API mode); keep for 30 days, cap at 2 GB
+BG_CACHE_DIR = os.getenv("BG_CACHE_DIR", "/tmp/bg_cache")
+BG_CACHE_SIZE_LIMIT = 2 * 1024 ** 3
+BG_CACHE_TTL = 30 * 24 * 3600
+
+
+def _decode_bytes(image_bytes: bytes) -> Image.Image:
+    """Decode encoded image bytes into a loaded PIL Image."""
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+def _decode_image(image_b64: str) -> Image.Image:
+    """Decode a base64 image into a loaded PIL Image."""
+    return _decode_bytes(_b64decode(image_b64, validate=False))
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    """Encode a PIL Image as PNG bytes."""
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def _content_type(image_bytes: bytes) -> str:
+    """Guess the MIME type of encoded image bytes from their header."""
+    return "image/jpeg" if image_bytes.startswith(b"\xff\xd8\xff") else "image/png"
+
 
 class HybridImageGenerator:
     """
@@ -31,6 +91,12 @@ class HybridImageGenerator:
     def __init__(self):
         self.mode = self._detect_mode()
         self.generator = self._init_generator()
+        self._bg_cache = None
+        if DISKCACHE_AVAILABLE:
+            try:
+                self._bg_cache = diskcache.Cache(BG_CACHE_DIR, size_limit=BG_CACHE_SIZE_LIMIT)
+            except Exception as e:
+                logger.warning(f"Background cache unavailable: {e}")
         
     def _detect_mode(self) -> str:
         """Detect if running locally or in cloud"""
@@ -41,29 +107,19 @@ class HybridImageGenerator:
             logger.info(f"Image generation mode forced to: {force_mode}")
             return force_mode
         
-        # Auto-detect based on environment
-        indicators = {
-            "RENDER": os.getenv("RENDER"),  # Render.com
-            "RAILWAY_ENVIRONMENT": os.getenv("RAILWAY_ENVIRONMENT"),  # Railway
-            "VERCEL": os.getenv("VERCEL"),  # Vercel
-            "DYNO": os.getenv("DYNO"),  # Heroku
-            "KUBERNETES_SERVICE_HOST": os.getenv("KUBERNETES_SERVICE_HOST"),  # K8s
-        }
-        
         # If any cloud indicator exists, use API mode
-        if any(indicators.values()):
+        if _IS_CLOUD:
             logger.info("☁️ Cloud environment detected - using API mode")
             return "api"
         
-        # Check if local models exist
-        try:
-            import torch
-            from diffusers import StableDiffusionPipeline
+        # Check if local models exist (find_spec avoids importing torch here;
+        # the real import happens in _init_generator)
+        if importlib.util.find_spec("torch") is not None and importlib.util.find_spec("diffusers") is not None:
             logger.info("💻 Local environment detected - using local models")
             return "local"
-        except ImportError:
-            logger.info("📡 Diffusers not available - using API mode")
-            return "api"
+        
+        logger.info("📡 Diffusers not available - using API mode")
+        return "api"
     
     def _init_generator(self):
         """Initialize appropriate generator based on mode"""
@@ -92,11 +148,13 @@ class HybridImageGenerator:
         height: int = 768,
         num_inference_steps: int = 25,
         guidance_scale: float = 7.5,
+        return_format: Literal["pil", "bytes"] = "pil",
         **kwargs
     ) -> Optional[Dict[str, Any]]:
         """
         Generate image (automatically uses local or API)
-        Returns PIL Image and metadata
+        Returns PIL Image and metadata, or with return_format="bytes" the
+        encoded image as image_bytes/content_type (no PIL decode in API mode)
         """
         logger.info(f"Generating image in {self.mode} mode with {model_type}")
         
@@ -115,6 +173,15 @@ class HybridImageGenerator:
                         **kwargs
                     )
                     # Convert to expected format
+                    if result and result.get("success") and return_format == "bytes":
+                        image_bytes = await asyncio.to_thread(_encode_png, result.get("image"))
+                        return {
+                            "success": True,
+                            "image_bytes": image_bytes,
+                            "content_type": "image/png",
+                            "model": model_type,
+                            "mode": "local"
+                        }
                     if result and result.get("success"):
                         return {
                             "success": True,
@@ -123,8 +190,9 @@ class HybridImageGenerator:
                             "mode": "local"
                         }
             else:
-                # API generation - returns base64
-                result = self.generator.generate(
+                # API generation - returns base64 (blocking HTTP, run off the loop)
+                result = await asyncio.to_thread(
+                    self.generator.generate,
                     prompt=prompt,
                     model_type=model_type,
                     negative_prompt=negative_prompt,
@@ -135,10 +203,20 @@ class HybridImageGenerator:
                     **kwargs
                 )
                 
+                if result and result.get("success") and return_format == "bytes":
+                    # Serving paths want encoded bytes - skip PIL entirely
+                    image_bytes = await asyncio.to_thread(_b64decode, result["image"], validate=False)
+                    return {
+                        "success": True,
+                        "image_bytes": image_bytes,
+                        "content_type": _content_type(image_bytes),
+                        "model": model_type,
+                        "mode": "api"
+                    }
+                
                 if result and result.get("success"):
-                    # Convert base64 to PIL Image
-                    image_data = base64.b64decode(result["image"])
-                    image = Image.open(BytesIO(image_data))
+                    # Convert base64 to PIL Image off the event loop
+                    image = await asyncio.to_thread(_decode_image, result["image"])
                     
                     return {
                         "success": True,
@@ -159,18 +237,46 @@ class HybridImageGenerator:
         style: str = "modern",
         colors: str = "vibrant",
         width: int = 1024,
-        height: int = 768
-    ) -> Optional[Image.Image]:
-        """Generate advertising background - returns PIL Image"""
+        height: int = 768,
+        return_format: Literal["pil", "bytes"] = "pil"
+    ) -> Optional[Union[Image.Image, bytes]]:
+        """
+        Generate advertising background - returns PIL Image (or encoded bytes)
+        API-mode results are cached on disk by request, so repeated
+        boilerplate backgrounds skip the remote inference call.
+        """
         
         try:
+            use_cache = self._bg_cache is not None and self.mode == "api"
+            if use_cache:
+                key = hashlib.blake2b(
+                    f"{prompt}|{style}|{colors}|{width}x{height}".encode(), digest_size=16
+                ).hexdigest()
+                cached = self._bg_cache.get(key)
+                if cached is not None:
+                    logger.info("Background served from cache")
+                    if return_format == "bytes":
+                        return cached
+                    return await asyncio.to_thread(_decode_bytes, cached)
+            
             result = await self.generate(
                 prompt=f"professional advertising background, {prompt}, {style} style, {colors}",
                 negative_prompt="text, words, letters, watermark, person, face, product, cluttered",
                 width=width,
-                height=height
+                height=height,
+                return_format="bytes" if use_cache else return_format
             )
-            return result["image"] if result and result.get("success") else None
+            if not result or not result.get("success"):
+                return None
+            
+            if use_cache:
+                image_bytes = result["image_bytes"]
+                self._bg_cache.set(key, image_bytes, expire=BG_CACHE_TTL)
+                if return_format == "bytes":
+                    return image_bytes
+                return await asyncio.to_thread(_decode_bytes, image_bytes)
+            
+            return result["image_bytes"] if return_format == "bytes" else result["image"]
                 
         except Exception as e:
             logger.error(f"Background generation failed: {e}")
@@ -193,10 +299,13 @@ class HybridImageGenerator:
 
 # Singleton instance
 _hybrid_generator = None
+_hybrid_generator_lock = threading.Lock()
 
 def get_hybrid_generator() -> HybridImageGenerator:
-    """Get singleton hybrid generator"""
+    """Get singleton hybrid generator (thread-safe, constructed once)"""
     global _hybrid_generator
     if _hybrid_generator is None:
-        _hybrid_generator = HybridImageGenerator()
+        with _hybrid_generator_lock:
+            if _hybrid_generator is None:
+                _hybrid_generator = HybridImageGenerator()
     return _hybrid_generator
@@ -3,16 +3,436 @@ Multi-Model Image Generation Pipeline
 Uses 3+ AI models in sequence to create sophisticated, high-quality images
 """
 
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Hashable
 from PIL import Image
 import io
-import base64
+import os
+import asyncio
 import logging
+import threading
 import requests
 from pathlib import Path
+from .batching import RequestBatcher
+from .semantic_cache import ApproximateImageCache
+from .stable_diffusion import LCM_LORAS, StableDiffusionService
 
 logger = logging.getLogger(__name__)
 
+try:
+    import torch
+    TORCH_AVAILABLE = True
+    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    
+    # TF32 tensor cores for residual fp32 matmuls/convs (Ampere+), and let
+    # cuDNN pick the fastest conv algorithm for our fixed pipeline shapes
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    
+    # Prefer the fused SDPA kernels (FlashAttention / memory-efficient), which
+    # never materialize the NxN attention matrix; math stays as a fallback
+    torch.backends.cuda.enable_flash_sdp(True)
+    torch.backends.cuda.enable_mem_efficient_sdp(True)
+except ImportError:
+    torch = None
+    TORCH_AVAILABLE = False
+    DEVICE = "cpu"
+
+# Try importing torch-tensorrt (registers the "torch_tensorrt" compile backend)
+try:
+    import torch_tensorrt
+    TENSORRT_AVAILABLE = True
+except ImportError:
+    TENSORRT_AVAILABLE = False
+
+# Try importing torchao for FP8 quantization
+try:
+    from torchao.quantization import (
+        quantize_,
+        Float8DynamicActivationFloat8WeightConfig,
+        PerRow
+    )
+    TORCHAO_AVAILABLE = True
+except ImportError:
+    TORCHAO_AVAILABLE = False
+
+# Try importing xformers memory-efficient attention
+try:
+    import xformers
+    XFORMERS_AVAILABLE = True
+except ImportError:
+    XFORMERS_AVAILABLE = False
+
+# Try importing DeepCache for cross-step UNet feature reuse
+try:
+    from DeepCache import DeepCacheSDHelper
+    DEEPCACHE_AVAILABLE = True
+except ImportError:
+    DEEPCACHE_AVAILABLE = False
+
+# Engine builds take minutes per UNet, so TensorRT is opt-in
+USE_TENSORRT = bool(os.getenv("MULTI_MODEL_TENSORRT"))
+
+# FP8 UNet quantization (Ada/Hopper/Blackwell tensor cores only)
+USE_FP8 = bool(os.getenv("MULTI_MODEL_FP8"))
+
+# Keep idle pipelines in CPU RAM and move them in on use: "model" swaps
+# whole components, "sequential" streams individual layers (lowest VRAM)
+OFFLOAD_MODE = os.getenv("MULTI_MODEL_OFFLOAD", "").lower()
+
+# Split the refiner UNet's blocks across GPUs when several are available
+SHARD_REFINER = int(os.getenv("WORLD_SIZE", "1")) > 1
+GPU_MEMORY_PER_DEVICE = os.getenv("MULTI_MODEL_GPU_MEMORY", "10GiB")
+
+# torch.compile(mode="reduce-overhead") captures CUDA Graphs, which need
+# static shapes - requested sizes are snapped to these buckets when enabled
+USE_TORCH_COMPILE = bool(os.getenv("MULTI_MODEL_COMPILE"))
+SHAPE_BUCKETS = (512, 768, 1024, 1536)
+
+# Stage 1/2 sampler settings per quality tier. "fast" runs LCM-LoRA distilled
+# weights (CFG-free, a handful of steps); "max" keeps the full schedules.
+STAGE_SETTINGS = {
+    "fast": {
+        "base": {"model": "lcm_sd_1_5", "num_inference_steps": 4, "guidance_scale": 1.0},
+        "style": {"model": "lcm_sdxl", "num_inference_steps": 6, "guidance_scale": 1.0}
+    },
+    "max": {
+        "base": {"model": "sd_1_5", "num_inference_steps": 25, "guidance_scale": 7.5},
+        "style": {"model": "sdxl_base", "num_inference_steps": 30, "guidance_scale": 8.0}
+    }
+}
+
+# Loaded diffusion pipelines, keyed by model id + dtype + device.
+# Weights are deserialized and moved to the device once per process.
+# Re-entrant: a factory may pull shared components from the registry.
+_PIPELINE_REGISTRY: Dict[str, Any] = {}
+_PIPELINE_LOCK = threading.RLock()
+
+
+def _fp8_supported() -> bool:
+    """FP8 matmuls need compute capability 8.9 or newer."""
+    return DEVICE == "cuda" and torch.cuda.get_device_capability() >= (8, 9)
+
+
+def _quantizable(module: Any, fqn: str) -> bool:
+    """Quantize UNet linears except attention output projections."""
+    return isinstance(module, torch.nn.Linear) and "to_out" not in fqn
+
+
+def _optimize_pipeline(pipe: Any) -> Any:
+    """Apply the configured inference optimizations to a freshly loaded pipeline."""
+    if DEVICE == "cuda":
+        # NHWC convolutions hit the faster cuDNN tensor-core kernels
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        
+        if XFORMERS_AVAILABLE:
+            pipe.enable_xformers_memory_efficient_attention()
+        else:
+            from diffusers.models.attention_processor import AttnProcessor2_0
+            pipe.unet.set_attn_processor(AttnProcessor2_0())
+    
+    if USE_FP8 and TORCHAO_AVAILABLE and _fp8_supported():
+        quantize_(
+            pipe.unet,
+            Float8DynamicActivationFloat8WeightConfig(granularity=PerRow()),
+            filter_fn=_quantizable
+        )
+    
+    if DEVICE == "cuda" and USE_TENSORRT and TENSORRT_AVAILABLE:
+        # Static-shape fp16 engines, built on the first call at each
+        # resolution; no auxiliary streams keeps engine scratch memory small
+        trt_options = {"enabled_precisions": {torch.float16}, "max_aux_streams": 0}
+        pipe.unet = torch.compile(
+            pipe.unet,
+            backend="torch_tensorrt",
+            dynamic=False,
+            options=trt_options
+        )
+        if getattr(pipe, "controlnet", None) is not None:
+            pipe.controlnet = torch.compile(
+                pipe.controlnet,
+                backend="torch_tensorrt",
+                dynamic=False,
+                options=trt_options
+            )
+    elif DEVICE == "cuda" and USE_TORCH_COMPILE:
+        pipe.unet = torch.compile(pipe.unet, mode="reduce-overhead", fullgraph=True)
+        if not hasattr(pipe.vae.decoder, "_orig_mod"):  # VAE may be shared
+            pipe.vae.decoder = torch.compile(pipe.vae.decoder, mode="reduce-overhead")
+    return pipe
+
+
+def _bucket(value: int) -> int:
+    """Snap a dimension to the nearest static-shape bucket."""
+    return min(SHAPE_BUCKETS, key=lambda bucket: abs(bucket - value))
+
+
+def get_or_create(
+    model_id: str,
+    factory: Callable[[], Any],
+    dtype: str = "float16",
+    optimize: bool = True
+) -> Any:
+    """
+    Return the cached pipeline for model_id, building it with factory on first use.
+    
+    Args:
+        model_id: Model identifier (repo name or local alias)
+        factory: Zero-argument callable that loads the pipeline (see _place)
+        dtype: Weight dtype name, part of the cache key
+        optimize: Apply _optimize_pipeline (off for bare components)
+    """
+    key = f"{model_id}|{dtype}|{DEVICE}"
+    pipe = _PIPELINE_REGISTRY.get(key)
+    if pipe is not None:
+        return pipe
+    
+    with _PIPELINE_LOCK:
+        pipe = _PIPELINE_REGISTRY.get(key)
+        if pipe is None:
+            logger.info(f"Loading pipeline {model_id} ({dtype}) on {DEVICE}")
+            pipe = factory()
+            if optimize:
+                pipe = _optimize_pipeline(pipe)
+            _PIPELINE_REGISTRY[key] = pipe
+        return pipe
+
+
+SDXL_BASE = "stabilityai/stable-diffusion-xl-base-1.0"
+SDXL_REFINER = "stabilityai/stable-diffusion-xl-refiner-1.0"
+
+
+def _place(pipe: Any) -> Any:
+    """Move a pipeline onto DEVICE, or wire CPU offload hooks if configured."""
+    if DEVICE != "cuda" or OFFLOAD_MODE not in ("model", "sequential"):
+        return pipe.to(DEVICE)
+    
+    if OFFLOAD_MODE == "sequential":
+        pipe.enable_sequential_cpu_offload()
+    else:
+        pipe.enable_model_cpu_offload()
+    pipe.vae.enable_slicing()
+    return pipe
+
+
+def _place_sharded(pipe: Any) -> Any:
+    """
+    Spread the pipeline's UNet across all visible GPUs.
+    
+    Whole transformer/resnet blocks are assigned to devices by accelerate and
+    activations hop between them; the rest of the pipeline lives on cuda:0.
+    Falls back to _place on single-GPU hosts or when offloading.
+    """
+    gpu_count = torch.cuda.device_count() if DEVICE == "cuda" else 0
+    if gpu_count < 2 or OFFLOAD_MODE in ("model", "sequential"):
+        return _place(pipe)
+    
+    from accelerate import dispatch_model, infer_auto_device_map
+    
+    for name, component in pipe.components.items():
+        if name != "unet" and isinstance(component, torch.nn.Module):
+            component.to("cuda:0")
+    
+    device_map = infer_auto_device_map(
+        pipe.unet,
+        max_memory={i: GPU_MEMORY_PER_DEVICE for i in range(gpu_count)},
+        no_split_module_classes=["BasicTransformerBlock", "ResnetBlock2D"],
+        dtype=torch.float16
+    )
+    pipe.unet = dispatch_model(pipe.unet, device_map=device_map)
+    logger.info(f"Refiner UNet split across {gpu_count} GPUs")
+    return pipe
+
+
+def _tile_vae(pipe: Any) -> Any:
+    """
+    Decode in overlapping tiles, one image at a time.
+    
+    For the 2x stages, where a whole-frame VAE decode would spike VRAM.
+    """
+    pipe.vae.enable_tiling()
+    pipe.vae.enable_slicing()
+    return pipe
+
+
+def _component_device() -> str:
+    """Where standalone components load; offload hooks move them later."""
+    return "cpu" if OFFLOAD_MODE in ("model", "sequential") else DEVICE
+
+
+def _load_sdxl_shared() -> Dict[str, Any]:
+    """
+    Load the components SDXL base and refiner have in common.
+    
+    Both use the same OpenCLIP bigG text encoder and the same VAE, so one
+    copy on the device (~1.5 GB saved) serves every SDXL pipeline.
+    """
+    from diffusers import AutoencoderKL
+    from transformers import CLIPTextModelWithProjection, CLIPTokenizer
+    return {
+        "text_encoder_2": CLIPTextModelWithProjection.from_pretrained(
+            SDXL_BASE,
+            subfolder="text_encoder_2",
+            torch_dtype=torch.float16,
+            variant="fp16",
+            use_safetensors=True
+        ).to(_component_device()),
+        "tokenizer_2": CLIPTokenizer.from_pretrained(SDXL_BASE, subfolder="tokenizer_2"),
+        "vae": AutoencoderKL.from_pretrained(
+            SDXL_BASE,
+            subfolder="vae",
+            torch_dtype=torch.float16,
+            variant="fp16",
+            use_safetensors=True
+        ).to(_component_device())
+    }
+
+
+def _sdxl_shared() -> Dict[str, Any]:
+    """Shared SDXL components from the registry."""
+    return get_or_create(f"{SDXL_BASE}+shared", _load_sdxl_shared, optimize=False)
+
+
+def _load_sdxl_refiner() -> Any:
+    """Load the SDXL refiner (img2img) pipeline onto DEVICE."""
+    from diffusers import DiffusionPipeline
+    place = _place_sharded if SHARD_REFINER else _place
+    return _tile_vae(place(DiffusionPipeline.from_pretrained(
+        SDXL_REFINER,
+        torch_dtype=torch.float16,
+        variant="fp16",
+        use_safetensors=True,
+        **_sdxl_shared()
+    )))
+
+
+def _load_sdxl_img2img(lora: Optional[str] = None) -> Any:
+    """Load the SDXL base model as an img2img pipeline onto DEVICE, optionally with an LCM LoRA fused in."""
+    from diffusers import LCMScheduler, StableDiffusionXLImg2ImgPipeline
+    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+        SDXL_BASE,
+        torch_dtype=torch.float16,
+        variant="fp16",
+        use_safetensors=True,
+        **_sdxl_shared()
+    )
+    if lora:
+        # Fusing rewrites the UNet, so the LCM variant is its own registry entry
+        pipe.load_lora_weights(lora)
+        pipe.fuse_lora()
+        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+    return _place(pipe)
+
+
+def _sdxl_img2img(model: str) -> Any:
+    """SDXL base img2img from the registry; model is a STAGE_SETTINGS alias."""
+    lora = LCM_LORAS.get(model)
+    if lora is None:
+        return get_or_create(f"{SDXL_BASE}+img2img", _load_sdxl_img2img)
+    return get_or_create(f"{SDXL_BASE}+img2img+{lora}", lambda: _load_sdxl_img2img(lora))
+
+
+class PatchActivationCache:
+    """
+    Token-level activation reuse for a UNet's transformer blocks.
+    
+    Wraps every BasicTransformerBlock so that, from the second denoising step
+    on, only tokens whose input moved more than `threshold` (relative mean
+    absolute change since they were last computed) go through the block.
+    Stationary tokens reuse their cached output plus the residual change in
+    their input. Meant for low-strength refinement, where most of the image
+    barely changes between steps.
+    """
+    
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._entries: Dict[int, tuple] = {}
+    
+    def reset(self) -> None:
+        """Forget cached activations (call before each new generation)."""
+        self._entries.clear()
+    
+    def attach(self, unet: Any) -> None:
+        """Wrap the forward of each transformer block in unet."""
+        from diffusers.models.attention import BasicTransformerBlock
+        
+        for block in unet.modules():
+            if isinstance(block, BasicTransformerBlock):
+                block.forward = self._wrap(id(block), block.forward)
+    
+    def _wrap(self, block_id: int, forward: Callable[..., Any]) -> Callable[..., Any]:
+        def cached_forward(hidden_states, *args, **kwargs):
+            entry = self._entries.get(block_id)
+            if self.threshold <= 0 or entry is None or entry[0].shape != hidden_states.shape:
+                output = forward(hidden_states, *args, **kwargs)
+                if self.threshold > 0:
+                    self._entries[block_id] = (hidden_states, output)
+                return output
+            
+            cached_in, cached_out = entry
+            delta = (hidden_states - cached_in).abs().mean(-1)
+            delta = delta / (cached_in.abs().mean(-1) + 1e-6)
+            active = (delta > self.threshold).any(0)  # union over batch
+            
+            if active.all():
+                output = forward(hidden_states, *args, **kwargs)
+                self._entries[block_id] = (hidden_states, output)
+                return output
+            
+            # Transformer blocks are residual: carry the input change through
+            output = cached_out + (hidden_states - cached_in)
+            if active.any():
+                idx = active.nonzero(as_tuple=True)[0]
+                computed = forward(hidden_states[:, idx], *args, **kwargs)
+                output[:, idx] = computed
+                new_in, new_out = cached_in.clone(), cached_out.clone()
+                new_in[:, idx] = hidden_states[:, idx]
+                new_out[:, idx] = computed
+                self._entries[block_id] = (new_in, new_out)
+            return output
+        
+        return cached_forward
+
+
+class LazyImage:
+    """
+    Intermediate stage image held as JPEG bytes, decoded on demand.
+    
+    Roughly a tenth of the raw RGB footprint while a request is in flight.
+    """
+    
+    __slots__ = ("_data", "size")
+    
+    def __init__(self, image: Image.Image, quality: int = 85):
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+        self._data = buffer.getvalue()
+        self.size = image.size
+    
+    def open(self) -> Image.Image:
+        """Decode the stored JPEG."""
+        return Image.open(io.BytesIO(self._data))
+
+
+def _stage_entry(
+    stage: str,
+    model: str,
+    image: Image.Image,
+    return_intermediates: bool
+) -> Dict[str, Any]:
+    """Stage record for results["stages"], with the image only when asked for."""
+    entry = {"stage": stage, "model": model}
+    if return_intermediates:
+        entry["image"] = LazyImage(image)
+    return entry
+
+
+def _image_size(item: Dict[str, Any]) -> Hashable:
+    """Batch key: pipelines can only stack images of one size."""
+    return item["image"].size
+
 
 class MultiModelGenerator:
     """
@@ -25,7 +445,54 @@ class MultiModelGenerator:
     4. Post-Processing - Final polish with img2img refinement
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        cache_interval: int = 3,
+        base_cache_threshold: Optional[float] = 0.9,
+        base_cache_size: int = 64,
+        max_batch: int = 4,
+        batch_window_ms: int = 20,
+        ensemble: bool = False,
+        patch_cache_threshold: float = 0.0
+    ):
+        """
+        Initialize the generator.
+        
+        Args:
+            cache_interval: Recompute deep UNet blocks every N denoising steps
+                and reuse cached features in between (DeepCache). 1 disables.
+            base_cache_threshold: Prompt similarity above which a cached stage 1
+                image is reused instead of running SD 1.5. None disables.
+            base_cache_size: Number of stage 1 images to keep
+            max_batch: Most concurrent requests stacked into one upscaler or
+                refiner call
+            batch_window_ms: How long a call waits for others to join its batch
+            ensemble: Fuse stages 2 and 4 into one SDXL base+refiner latent
+                hand-off before upscaling (3 stages instead of 4)
+            patch_cache_threshold: In the stage 4 refiner, only recompute tokens
+                whose block input changed by more than this relative amount
+                since their last computation. 0 disables.
+        """
+        self.cache_interval = cache_interval
+        # One service for stage 1 so its loaded pipelines stay warm; built on
+        # first use (it needs diffusers and starts a thread pool)
+        self._sd_service: Optional[StableDiffusionService] = None
+        self._sd_lock = threading.Lock()
+        self._base_cache: Optional[ApproximateImageCache] = None
+        if base_cache_threshold is not None:
+            base_cache = ApproximateImageCache(
+                threshold=base_cache_threshold,
+                max_entries=base_cache_size
+            )
+            if base_cache.available:
+                self._base_cache = base_cache
+        self._streams: Dict[Any, Any] = {}
+        self._pinned: Dict[tuple, Any] = {}
+        self.max_batch = max_batch
+        self.batch_window_ms = batch_window_ms
+        self._batchers: Dict[int, RequestBatcher] = {}
+        self.ensemble = ensemble
+        self.patch_cache_threshold = patch_cache_threshold
         self.models_config = {
             "base_generator": {
                 "model": "runwayml/stable-diffusion-v1-5",
@@ -45,20 +512,198 @@ class MultiModelGenerator:
             }
         }
     
+    @property
+    def _sd(self) -> StableDiffusionService:
+        """The stage 1 service, created on first access."""
+        if self._sd_service is None:
+            with self._sd_lock:
+                if self._sd_service is None:
+                    self._sd_service = StableDiffusionService()
+        return self._sd_service
+    
+    def _patch_cache(self, pipe: Any) -> Optional[PatchActivationCache]:
+        """
+        Attach a PatchActivationCache to the pipe's UNet on first use.
+        
+        Not used with compiled UNets: the data-dependent token subsets would
+        force a recompile on nearly every step.
+        """
+        if self.patch_cache_threshold <= 0 or USE_TORCH_COMPILE or USE_TENSORRT:
+            return None
+        
+        cache = getattr(pipe, "_patch_cache", None)
+        if cache is None:
+            cache = PatchActivationCache(self.patch_cache_threshold)
+            cache.attach(pipe.unet)
+            pipe._patch_cache = cache
+        return cache
+    
+    def _enable_block_cache(self, pipe: Any) -> None:
+        """Attach (or retune) DeepCache block caching on a shared pipeline."""
+        if not DEEPCACHE_AVAILABLE or self.cache_interval < 2:
+            return
+        
+        try:
+            helper = getattr(pipe, "_deepcache_helper", None)
+            if helper is None:
+                helper = DeepCacheSDHelper(pipe=pipe)
+                helper.set_params(cache_interval=self.cache_interval, cache_branch_id=0)
+                helper.enable()
+                pipe._deepcache_helper = helper
+            else:
+                # Params are read per call, so retuning a live helper is enough
+                helper.set_params(cache_interval=self.cache_interval, cache_branch_id=0)
+        except Exception as e:
+            logger.warning(f"DeepCache not applied: {e}")
+    
+    def _batcher(
+        self,
+        stage: int,
+        run_batch: Callable[[List[Dict[str, Any]]], List[Any]]
+    ) -> RequestBatcher:
+        """Per-stage batcher, created on first use."""
+        batcher = self._batchers.get(stage)
+        if batcher is None:
+            batcher = self._batchers[stage] = RequestBatcher(
+                run_batch,
+                max_batch=self.max_batch,
+                window_ms=self.batch_window_ms,
+                key=_image_size
+            )
+        return batcher
+    
+    def _stage_stream(self, stage: Any) -> Any:
+        """Dedicated CUDA stream for a pipeline stage (None on CPU)."""
+        if DEVICE != "cuda":
+            return None
+        stream = self._streams.get(stage)
+        if stream is None:
+            stream = self._streams[stage] = torch.cuda.Stream()
+        return stream
+    
+    def _readback(self, images: Any, stage: Any) -> List[Image.Image]:
+        """
+        Convert pipeline output to PIL via a pinned host buffer.
+        
+        The uint8 conversion runs on the GPU and the copy is issued on a
+        dedicated stream into page-locked memory, so the DMA does not
+        serialize with the compute stream. Called from the stage's worker
+        thread, which is the only place that waits on the copy.
+        """
+        if not torch.is_tensor(images):
+            return images
+        
+        rgb = (images.clamp(0, 1) * 255).round().to(torch.uint8)
+        rgb = rgb.permute(0, 2, 3, 1).contiguous()
+        
+        # One buffer per stage: each stage reads back from a single thread
+        key = (stage, tuple(rgb.shape))
+        pinned = self._pinned.get(key)
+        if pinned is None:
+            pinned = self._pinned[key] = torch.empty(
+                rgb.shape, dtype=torch.uint8, pin_memory=True
+            )
+        
+        copy_stream = self._stage_stream("readback")
+        copy_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(copy_stream):
+            pinned.copy_(rgb, non_blocking=True)
+            done = copy_stream.record_event()
+        done.synchronize()
+        
+        _, height, width, _ = rgb.shape
+        return [
+            Image.frombuffer("RGB", (width, height), pinned[i].numpy().tobytes(), "raw", "RGB", 0, 1)
+            for i in range(rgb.shape[0])
+        ]
+    
+    async def _run_on_stream(self, stage: int, fn: Callable[[], Any]) -> Any:
+        """
+        Run a blocking pipeline call in a worker thread on the stage's stream.
+        
+        The event loop stays free while the GPU works, so other prompts can
+        enter earlier stages concurrently.
+        """
+        stream = self._stage_stream(stage)
+        
+        def call():
+            if stream is None:
+                return fn()
+            with torch.cuda.stream(stream):
+                output = fn()
+            stream.synchronize()
+            return output
+        
+        return await asyncio.to_thread(call)
+    
+    @staticmethod
+    async def _in_stage(
+        stage_locks: Optional[List[asyncio.Lock]],
+        stage: int,
+        step: Awaitable[Any]
+    ) -> Any:
+        """Await a stage, holding that stage's lock when pipelining a batch."""
+        if stage_locks is None:
+            return await step
+        async with stage_locks[stage]:
+            return await step
+    
+    async def generate_multi_model_batch(
+        self,
+        prompts: List[str],
+        negative_prompt: str = "",
+        width: int = 1024,
+        height: int = 768,
+        style: str = "professional",
+        quality: str = "fast",
+        return_intermediates: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate several prompts with the stages overlapped.
+        
+        Each stage admits one prompt at a time, so while prompt i is being
+        upscaled or refined, prompt i+1 can already run its base generation.
+        Throughput approaches the slowest stage rather than the sum of all four.
+        
+        Returns:
+            One generate_multi_model result per prompt, in order
+        """
+        stage_locks = [asyncio.Lock() for _ in range(4)]
+        return await asyncio.gather(*[
+            self.generate_multi_model(
+                prompt, negative_prompt, width, height, style, quality,
+                return_intermediates, stage_locks=stage_locks
+            )
+            for prompt in prompts
+        ])
+    
     async def generate_multi_model(
         self,
         prompt: str,
         negative_prompt: str = "",
         width: int = 1024,
         height: int = 768,
-        style: str = "professional"
+        style: str = "professional",
+        quality: str = "fast",
+        return_intermediates: bool = False,
+        stage_locks: Optional[List[asyncio.Lock]] = None
     ) -> Dict[str, Any]:
         """
         Generate image using multi-model pipeline.
         
+        Args:
+            quality: "fast" for LCM-distilled stages 1-2, "max" for full schedules
+            return_intermediates: Attach each stage's image to results["stages"]
+                as a JPEG-backed LazyImage (otherwise only stage/model names)
+            stage_locks: Per-stage locks shared by generate_multi_model_batch
+        
         Returns:
             Dict with final image, intermediate results, and metadata
         """
+        if USE_TORCH_COMPILE and DEVICE == "cuda":
+            # Keep compiled graphs to a handful of shapes
+            width, height = _bucket(width), _bucket(height)
+        
         results = {
             "stages": [],
             "models_used": [],
@@ -67,57 +712,86 @@ class MultiModelGenerator:
         }
         
         try:
-            # Stage 1: Base Generation with SD 1.5
-            logger.info("Stage 1: Base generation with SD 1.5")
-            base_image = await self._stage1_base_generation(
-                prompt, negative_prompt, width, height
-            )
-            results["stages"].append({
-                "stage": "base_generation",
-                "model": "stable-diffusion-v1-5",
-                "image": base_image
-            })
-            results["models_used"].append("SD 1.5")
+            # Stage 1: Base Generation with SD 1.5, unless a near-identical
+            # prompt was already generated at this size; stage 2's img2img
+            # re-noises the cached base image so the result still varies.
+            # Embedding is a blocking encode (and a model load on first use),
+            # so it runs off the event loop
+            embedding = None
+            base_image = None
+            if self._base_cache is not None:
+                embedding = await asyncio.to_thread(self._base_cache.embed, prompt)
+                base_image = await asyncio.to_thread(
+                    self._base_cache.lookup, embedding, (width, height)
+                )
             
-            # Stage 2: Style Enhancement with SDXL
-            logger.info("Stage 2: Style enhancement with SDXL")
-            enhanced_image = await self._stage2_style_enhancement(
-                base_image, prompt, negative_prompt
-            )
-            results["stages"].append({
-                "stage": "style_enhancement",
-                "model": "stable-diffusion-xl",
-                "image": enhanced_image
-            })
-            results["models_used"].append("SDXL")
+            if base_image is not None:
+                logger.info("Stage 1: Reusing cached base image for similar prompt")
+                results["stages"].append(_stage_entry(
+                    "base_generation", "approximate-cache", base_image, return_intermediates
+                ))
+            else:
+                logger.info("Stage 1: Base generation with SD 1.5")
+                base_image = await self._in_stage(stage_locks, 0, self._stage1_base_generation(
+                    prompt, negative_prompt, width, height, quality
+                ))
+                if embedding is not None:
+                    await asyncio.to_thread(
+                        self._base_cache.store, embedding, (width, height), base_image
+                    )
+                results["stages"].append(_stage_entry(
+                    "base_generation", "stable-diffusion-v1-5", base_image, return_intermediates
+                ))
+                results["models_used"].append("SD 1.5")
+            
+            if self.ensemble:
+                # Stages 2+4 as one SDXL base+refiner pass at base resolution,
+                # then upscale the refined image
+                logger.info("Stage 2: SDXL base + refiner ensemble")
+                enhanced_image = await self._in_stage(stage_locks, 1, self._stage_ensemble(
+                    base_image, prompt, negative_prompt
+                ))
+                results["stages"].append(_stage_entry(
+                    "ensemble_refinement", "sdxl-base+refiner", enhanced_image, return_intermediates
+                ))
+                results["models_used"].extend(["SDXL", "SDXL Refiner"])
+            else:
+                # Stage 2: Style Enhancement with SDXL
+                logger.info("Stage 2: Style enhancement with SDXL")
+                enhanced_image = await self._in_stage(stage_locks, 1, self._stage2_style_enhancement(
+                    base_image, prompt, negative_prompt, quality
+                ))
+                results["stages"].append(_stage_entry(
+                    "style_enhancement", "stable-diffusion-xl", enhanced_image, return_intermediates
+                ))
+                results["models_used"].append("SDXL")
             
             # Stage 3: AI Upscaling
             logger.info("Stage 3: AI upscaling")
-            upscaled_image = await self._stage3_upscaling(
+            upscaled_image = await self._in_stage(stage_locks, 2, self._stage3_upscaling(
                 enhanced_image, prompt
-            )
-            results["stages"].append({
-                "stage": "upscaling",
-                "model": "sd-x2-latent-upscaler",
-                "image": upscaled_image
-            })
+            ))
+            results["stages"].append(_stage_entry(
+                "upscaling", "sd-x2-latent-upscaler", upscaled_image, return_intermediates
+            ))
             results["models_used"].append("SD Upscaler")
             
-            # Stage 4: Final Refinement with SDXL Refiner
-            logger.info("Stage 4: Final refinement")
-            final_image = await self._stage4_refinement(
-                upscaled_image, prompt, negative_prompt
-            )
-            results["stages"].append({
-                "stage": "refinement",
-                "model": "sdxl-refiner",
-                "image": final_image
-            })
-            results["models_used"].append("SDXL Refiner")
+            if self.ensemble:
+                final_image = upscaled_image
+            else:
+                # Stage 4: Final Refinement with SDXL Refiner
+                logger.info("Stage 4: Final refinement")
+                final_image = await self._in_stage(stage_locks, 3, self._stage4_refinement(
+                    upscaled_image, prompt, negative_prompt
+                ))
+                results["stages"].append(_stage_entry(
+                    "refinement", "sdxl-refiner", final_image, return_intermediates
+                ))
+                results["models_used"].append("SDXL Refiner")
             
             results["final_image"] = final_image
             results["metadata"] = {
-                "total_stages": 4,
+                "total_stages": len(results["stages"]),
                 "models_count": len(results["models_used"]),
                 "final_resolution": f"{width*2}x{height*2}",
                 "pipeline": "Multi-Model Ensemble"
@@ -135,27 +809,23 @@ class MultiModelGenerator:
         prompt: str,
         negative_prompt: str,
         width: int,
-        height: int
+        height: int,
+        quality: str = "fast"
     ) -> Image.Image:
         """
         Stage 1: Generate base composition with SD 1.5
         Fast generation for initial layout and composition
+        (4-step LCM unless quality is "max")
         """
-        from .stable_diffusion import StableDiffusionService
-        
-        sd_service = StableDiffusionService()
-        
         # Build enhanced prompt for base generation
         enhanced_prompt = f"{prompt}, professional composition, rule of thirds, dynamic layout, detailed"
         
-        result = await sd_service.generate_image(
+        result = await self._sd.generate_image(
             prompt=enhanced_prompt,
             negative_prompt=negative_prompt or "blurry, low quality, distorted, deformed",
             width=width,
             height=height,
-            num_inference_steps=25,
-            guidance_scale=7.5,
-            model="sd_1_5"
+            **STAGE_SETTINGS[quality]["base"]
         )
         
         return result["image"]
@@ -164,37 +834,30 @@ class MultiModelGenerator:
         self,
         base_image: Image.Image,
         prompt: str,
-        negative_prompt: str
+        negative_prompt: str,
+        quality: str = "fast"
     ) -> Image.Image:
         """
         Stage 2: Enhance style and details with SDXL img2img
         Adds sophisticated styling and improves details
+        (6-step LCM-SDXL unless quality is "max")
         """
-        from .stable_diffusion import StableDiffusionService
-        
-        sd_service = StableDiffusionService()
-        
         # Build style-focused prompt
         style_prompt = f"{prompt}, enhanced details, premium quality, sophisticated design, professional color grading, cinematic lighting"
+        settings = STAGE_SETTINGS[quality]["style"]
         
-        # Convert PIL image to base64 for img2img
-        buffered = io.BytesIO()
-        base_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Registry pipeline: shares text_encoder_2 and VAE with the refiner
+        pipe = _sdxl_img2img(settings["model"])
+        self._enable_block_cache(pipe)
         
-        result = await sd_service.generate_image(
+        return await self._run_on_stream(1, lambda: pipe(
             prompt=style_prompt,
             negative_prompt=negative_prompt or "blurry, low quality, artifacts, noise",
-            width=base_image.width,
-            height=base_image.height,
-            num_inference_steps=30,
-            guidance_scale=8.0,
-            model="sdxl_base",
-            init_image=img_str,
-            strength=0.4  # Keep 60% of original, refine 40%
-        )
-        
-        return result["image"]
+            image=base_image,
+            strength=0.4,  # Keep 60% of original, refine 40%
+            num_inference_steps=settings["num_inference_steps"],
+            guidance_scale=settings["guidance_scale"]
+        ).images[0])
     
     async def _stage3_upscaling(
         self,
@@ -207,31 +870,58 @@ class MultiModelGenerator:
         """
         try:
             from diffusers import StableDiffusionLatentUpscalePipeline
-            import torch
             
-            # Initialize upscaler pipeline
-            upscaler = StableDiffusionLatentUpscalePipeline.from_pretrained(
+            upscaler = get_or_create(
                 "stabilityai/sd-x2-latent-upscaler",
-                torch_dtype=torch.float16
+                lambda: _tile_vae(_place(StableDiffusionLatentUpscalePipeline.from_pretrained(
+                    "stabilityai/sd-x2-latent-upscaler",
+                    torch_dtype=torch.float16
+                )))
             )
-            upscaler = upscaler.to("cuda" if torch.cuda.is_available() else "cpu")
+            self._enable_block_cache(upscaler)
             
-            # Upscale with prompt guidance
-            upscaled = upscaler(
-                prompt=prompt,
-                image=image,
+            # Upscale with prompt guidance, batched with concurrent requests
+            batcher = self._batcher(2, lambda items: upscaler(
+                prompt=[item["prompt"] for item in items],
+                image=[item["image"] for item in items],
                 num_inference_steps=20,
                 guidance_scale=0
-            ).images[0]
+            ).images)
+            upscaled = await self._run_on_stream(
+                2, lambda: batcher.submit({"prompt": prompt, "image": image})
+            )
             
             return upscaled
             
         except Exception as e:
             logger.warning(f"AI upscaling failed, using fallback: {e}")
+            if DEVICE == "cuda":
+                try:
+                    return self._gpu_upscale(image)
+                except Exception as gpu_error:
+                    logger.warning(f"GPU resize failed, using PIL: {gpu_error}")
             # Fallback to high-quality PIL upscaling
             new_size = (image.width * 2, image.height * 2)
             return image.resize(new_size, Image.Resampling.LANCZOS)
     
+    @staticmethod
+    def _gpu_upscale(image: Image.Image) -> Image.Image:
+        """2x bicubic resize on the GPU instead of a CPU Lanczos pass."""
+        rgb = image.convert("RGB")
+        pixels = torch.frombuffer(bytearray(rgb.tobytes()), dtype=torch.uint8)
+        pixels = pixels.view(rgb.height, rgb.width, 3).permute(2, 0, 1).unsqueeze(0)
+        pixels = pixels.to("cuda", non_blocking=True).float() / 255
+        
+        upscaled = torch.nn.functional.interpolate(
+            pixels,
+            size=(rgb.height * 2, rgb.width * 2),
+            mode="bicubic",
+            antialias=True
+        )
+        
+        out = (upscaled[0].clamp(0, 1) * 255).round().byte().permute(1, 2, 0).contiguous().cpu()
+        return Image.fromarray(out.numpy(), "RGB")
+    
     async def _stage4_refinement(
         self,
         image: Image.Image,
@@ -243,25 +933,28 @@ class MultiModelGenerator:
         Polishes final details and enhances overall quality
         """
         try:
-            from diffusers import DiffusionPipeline
-            import torch
+            refiner = get_or_create(SDXL_REFINER, _load_sdxl_refiner)
+            self._enable_block_cache(refiner)
+            patch_cache = self._patch_cache(refiner)
             
-            # Initialize SDXL refiner
-            refiner = DiffusionPipeline.from_pretrained(
-                "stabilityai/stable-diffusion-xl-refiner-1.0",
-                torch_dtype=torch.float16,
-                variant="fp16",
-                use_safetensors=True
-            )
-            refiner = refiner.to("cuda" if torch.cuda.is_available() else "cpu")
+            def refine_batch(items):
+                if patch_cache is not None:
+                    patch_cache.threshold = self.patch_cache_threshold
+                    patch_cache.reset()
+                return self._readback(refiner(
+                    prompt=[item["prompt"] for item in items],
+                    image=[item["image"] for item in items],
+                    num_inference_steps=20,
+                    strength=0.25,  # Gentle refinement
+                    output_type="pt" if DEVICE == "cuda" else "pil"
+                ).images, 3)
             
             # Refine with high aesthetic score target
-            refined = refiner(
-                prompt=f"{prompt}, masterpiece, best quality, high detail",
-                image=image,
-                num_inference_steps=20,
-                strength=0.25  # Gentle refinement
-            ).images[0]
+            batcher = self._batcher(3, refine_batch)
+            refined = await self._run_on_stream(3, lambda: batcher.submit({
+                "prompt": f"{prompt}, masterpiece, best quality, high detail",
+                "image": image
+            }))
             
             return refined
             
@@ -269,6 +962,47 @@ class MultiModelGenerator:
             logger.warning(f"SDXL refiner not available, returning upscaled image: {e}")
             return image
     
+    async def _stage_ensemble(
+        self,
+        base_image: Image.Image,
+        prompt: str,
+        negative_prompt: str
+    ) -> Image.Image:
+        """
+        Stages 2+4 fused: SDXL base img2img hands its latents to the refiner
+        Runs the base for the first 80% of the schedule and the refiner for the
+        rest, skipping the intermediate VAE decode/encode
+        """
+        base = _sdxl_img2img("sdxl_base")
+        refiner = get_or_create(SDXL_REFINER, _load_sdxl_refiner)
+        
+        style_prompt = f"{prompt}, enhanced details, premium quality, sophisticated design, professional color grading, cinematic lighting"
+        negative_prompt = negative_prompt or "blurry, low quality, artifacts, noise"
+        
+        def run():
+            patch_cache = getattr(refiner, "_patch_cache", None)
+            if patch_cache is not None:
+                # Full-strength hand-off: every token changes, compute all
+                patch_cache.threshold = 0.0
+            latents = base(
+                prompt=style_prompt,
+                negative_prompt=negative_prompt,
+                image=base_image,
+                strength=0.4,
+                num_inference_steps=30,
+                denoising_end=0.8,
+                output_type="latent"
+            ).images
+            return refiner(
+                prompt=f"{prompt}, masterpiece, best quality, high detail",
+                negative_prompt=negative_prompt,
+                image=latents,
+                num_inference_steps=30,
+                denoising_start=0.8
+            ).images[0]
+        
+        return await self._run_on_stream(1, run)
+    
     async def generate_with_controlnet(
         self,
         prompt: str,
@@ -282,27 +1016,30 @@ class MultiModelGenerator:
         """
         try:
             from diffusers import StableDiffusionControlNetPipeline, ControlNetModel
-            import torch
             
-            # Load ControlNet model
-            controlnet = ControlNetModel.from_pretrained(
-                f"lllyasviel/sd-controlnet-{controlnet_type}",
-                torch_dtype=torch.float16
-            )
+            def load_controlnet_pipeline():
+                controlnet = ControlNetModel.from_pretrained(
+                    f"lllyasviel/sd-controlnet-{controlnet_type}",
+                    torch_dtype=torch.float16
+                )
+                return _place(StableDiffusionControlNetPipeline.from_pretrained(
+                    "runwayml/stable-diffusion-v1-5",
+                    controlnet=controlnet,
+                    torch_dtype=torch.float16
+                ))
             
-            pipe = StableDiffusionControlNetPipeline.from_pretrained(
-                "runwayml/stable-diffusion-v1-5",
-                controlnet=controlnet,
-                torch_dtype=torch.float16
+            pipe = get_or_create(
+                f"runwayml/stable-diffusion-v1-5+controlnet-{controlnet_type}",
+                load_controlnet_pipeline
             )
-            pipe = pipe.to("cuda" if torch.cuda.is_available() else "cpu")
             
             # Generate with ControlNet guidance
-            base_image = pipe(
+            base_image = (await self._run_on_stream("controlnet", lambda: self._readback(pipe(
                 prompt=prompt,
                 image=control_image,
-                num_inference_steps=30
-            ).images[0]
+                num_inference_steps=30,
+                output_type="pt" if DEVICE == "cuda" else "pil"
+            ).images, "controlnet")))[0]
             
             # Continue with enhancement pipeline
             return await self.generate_multi_model(
@@ -0,0 +1,239 @@
+"""
+Semantic Prompt Cache
+Reuses LLM responses for prompts that are near-duplicates of earlier ones,
+re-substituting slot values (product, brand, ...) into the cached response.
+"""
+
+import re
+import json
+import threading
+from typing import Dict, Optional, List, Tuple
+from loguru import logger
+
+# Try importing numpy
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Try importing sentence-transformers (pulls in torch - optional)
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+# Try importing FAISS (falls back to a numpy dot product)
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+
+class SemanticCache:
+    """
+    Embedding-based prompt cache.
+    
+    Each entry stores the prompt embedding and the response with fields
+    that echo a slot value replaced by {{slot}} placeholders. A lookup whose
+    nearest neighbour scores above the threshold returns that response with
+    the current slot values filled back in.
+    """
+    
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        model_name: str = "all-MiniLM-L6-v2",
+        max_entries: int = 1024
+    ):
+        """
+        Initialize semantic cache.
+        
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            model_name: sentence-transformers embedding model
+            max_entries: Stop adding entries beyond this many
+        """
+        self.threshold = threshold
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._model = None
+        self._lock = threading.Lock()
+        self._templates: List[str] = []
+        self._index = None
+        self._vectors = None
+    
+    @property
+    def available(self) -> bool:
+        """Whether the embedding dependencies are installed."""
+        return SENTENCE_TRANSFORMERS_AVAILABLE and NUMPY_AVAILABLE
+    
+    def _embed(self, text: str) -> "np.ndarray":
+        """Embed normalized text as a unit-length float32 row vector."""
+        with self._lock:
+            if self._model is None:
+                logger.info(f"Loading semantic cache embedding model: {self.model_name}")
+                self._model = SentenceTransformer(self.model_name)
+            model = self._model
+        normalized = " ".join(text.lower().split())
+        vector = model.encode(normalized, normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32).reshape(1, -1)
+    
+    @staticmethod
+    def _json_escape(value: str) -> str:
+        """A slot value as it appears inside a JSON string literal."""
+        return json.dumps(str(value), ensure_ascii=False)[1:-1]
+    
+    @classmethod
+    def _slot_patterns(cls, slots: Dict[str, str]) -> List[Tuple[str, "re.Pattern", "re.Pattern"]]:
+        """
+        (name, anywhere, whole-field) patterns for JSON-escaped slot values,
+        longest value first. "anywhere" matches the value word-bounded inside
+        any text, "whole-field" only as a complete JSON string.
+        """
+        values = [(k, cls._json_escape(v)) for k, v in slots.items() if v]
+        values.sort(key=lambda kv: len(kv[1]), reverse=True)
+        return [
+            (k, re.compile(rf"(?<!\w){re.escape(v)}(?!\w)"), re.compile(rf'"{re.escape(v)}"'))
+            for k, v in values
+        ]
+    
+    def _search(self, query: "np.ndarray") -> Tuple[float, int]:
+        """Return (score, index) of the nearest cached prompt."""
+        if FAISS_AVAILABLE:
+            scores, ids = self._index.search(query, 1)
+            return float(scores[0][0]), int(ids[0][0])
+        scores = self._vectors @ query[0]
+        best = int(np.argmax(scores))
+        return float(scores[best]), best
+    
+    def lookup(self, prompt: str, slots: Dict[str, str]) -> Optional[str]:
+        """Return a cached response re-filled with the given slots, or None."""
+        if not self.available:
+            return None
+        
+        if not self._templates:
+            return None
+        # Embed outside the lock: encoding is the slow part
+        query = self._embed(prompt)
+        
+        with self._lock:
+            score, idx = self._search(query)
+            if idx < 0 or score < self.threshold:
+                return None
+            response = self._templates[idx]
+        
+        # Templates are JSON text: escape values so quotes and backslashes
+        # in a product name don't break the document
+        for name, value in slots.items():
+            response = response.replace("{{" + name + "}}", self._json_escape(value))
+        logger.debug(f"Semantic cache hit (score={score:.3f})")
+        return response
+    
+    def store(self, prompt: str, slots: Dict[str, str], response: str) -> None:
+        """
+        Cache a response, replacing fields that echo a slot value with placeholders.
+        
+        Only whole JSON strings equal to a slot value are templated. A slot
+        value inside other text ("Big sale today" for theme="sale") can't be
+        swapped safely, so such responses are not cached at all.
+        """
+        if not self.available:
+            return
+        
+        template = response
+        for name, anywhere, whole_field in self._slot_patterns(slots):
+            fields = len(whole_field.findall(template))
+            if len(anywhere.findall(template)) > fields:
+                return
+            if fields:
+                template = whole_field.sub('"{{' + name + '}}"', template)
+        
+        if len(self._templates) >= self.max_entries:
+            return
+        vector = self._embed(prompt)
+        
+        with self._lock:
+            if len(self._templates) >= self.max_entries:
+                return
+            if FAISS_AVAILABLE:
+                if self._index is None:
+                    self._index = faiss.IndexFlatIP(vector.shape[1])
+                self._index.add(vector)
+            elif self._vectors is None:
+                self._vectors = vector
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._templates.append(template)
+
+
+class ApproximateImageCache:
+    """
+    Embedding-keyed cache of generated images.
+    
+    Entries are bucketed by output size; a lookup returns the image of the
+    most similar cached prompt at that size when the cosine similarity clears
+    the threshold. Least recently used entries are evicted past max_entries.
+    """
+    
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        model_name: str = "clip-ViT-B-32",
+        max_entries: int = 64
+    ):
+        """
+        Initialize image cache.
+        
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            model_name: sentence-transformers model (CLIP text tower by default)
+            max_entries: Evict least recently used entries beyond this many
+        """
+        self.threshold = threshold
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._model = None
+        self._lock = threading.Lock()
+        self._entries: List[Tuple["np.ndarray", Tuple[int, int], object]] = []
+    
+    @property
+    def available(self) -> bool:
+        """Whether the embedding dependencies are installed."""
+        return SENTENCE_TRANSFORMERS_AVAILABLE and NUMPY_AVAILABLE
+    
+    def embed(self, prompt: str) -> "np.ndarray":
+        """Embed normalized prompt text as a unit-length float32 vector."""
+        with self._lock:
+            if self._model is None:
+                logger.info(f"Loading image cache embedding model: {self.model_name}")
+                self._model = SentenceTransformer(self.model_name)
+            model = self._model
+        normalized = " ".join(prompt.lower().split())
+        vector = model.encode(normalized, normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+    
+    def lookup(self, embedding: "np.ndarray", size: Tuple[int, int]) -> Optional[object]:
+        """Return the cached image nearest to embedding at this size, or None."""
+        with self._lock:
+            candidates = [i for i, entry in enumerate(self._entries) if entry[1] == size]
+            if not candidates:
+                return None
+            scores = np.stack([self._entries[i][0] for i in candidates]) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry = self._entries.pop(candidates[best])
+            self._entries.append(entry)
+        
+        logger.debug(f"Image cache hit (score={float(scores[best]):.3f})")
+        return entry[2]
+    
+    def store(self, embedding: "np.ndarray", size: Tuple[int, int], image: object) -> None:
+        """Cache an image under its prompt embedding and output size."""
+        with self._lock:
+            self._entries.append((embedding, size, image))
+            if len(self._entries) > self.max_entries:
+                del self._entries[0]
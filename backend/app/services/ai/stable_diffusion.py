@@ -6,40 +6,90 @@ Supports AUTOMATIC1111 API, ComfyUI, and direct Diffusers integration.
 
 import os
 import io
+import time
 import base64
 import asyncio
+import functools
+import hashlib
+import shutil
+import threading
+import concurrent.futures
 import aiohttp
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union, Literal
+from collections import OrderedDict
 from dataclasses import dataclass, asdict
 from enum import Enum
 from pathlib import Path
 from loguru import logger
 import json
+from .batching import RequestBatcher
 
-# Try importing diffusers for local generation
+# Faster parsing of base64-heavy API responses when orjson is installed
 try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# SIMD-accelerated base64 when pybase64 is installed
+try:
+    import pybase64
+    _b64encode = pybase64.b64encode
+    _b64decode = pybase64.b64decode
+except ImportError:
+    _b64encode = base64.b64encode
+    _b64decode = base64.b64decode
+
+# Persist Inductor's compiled kernels so torch.compile is paid once per host,
+# not once per process (override with TORCHINDUCTOR_CACHE_DIR)
+os.environ.setdefault(
+    "TORCHINDUCTOR_CACHE_DIR",
+    os.path.expanduser("~/.cache/rmcb/inductor")
+)
+
+# Model weights are cached under HF_HOME (default ~/.cache/huggingface); point
+# it, or DIFFUSERS_CACHE, at a persistent volume so cold starts mmap local
+# safetensors instead of downloading
+DIFFUSERS_CACHE = os.environ.get("DIFFUSERS_CACHE")
+
+# Quantized UNets are saved here after the first quantization and reloaded
+# as-is on later starts (override with SD_QUANTIZED_CACHE_DIR)
+QUANTIZED_CACHE_DIR = Path(os.environ.get(
+    "SD_QUANTIZED_CACHE_DIR",
+    os.path.expanduser("~/.cache/rmcb/quantized")
+))
+
+# torch.compile the UNet/VAE decoder on CUDA (SD_TORCH_COMPILE=0 to disable)
+TORCH_COMPILE = os.environ.get("SD_TORCH_COMPILE", "1") != "0"
+
+# Try importing torch, PIL and diffusers for local generation (all or nothing)
+try:
+    import torch
+    from PIL import Image
     from diffusers import (
         StableDiffusionPipeline,
         StableDiffusionXLPipeline,
         DiffusionPipeline,
+        AutoPipelineForImage2Image,
+        AutoencoderKL,
         DPMSolverMultistepScheduler,
+        LCMScheduler,
         EulerAncestralDiscreteScheduler
     )
-    import torch
-    from PIL import Image
+    from diffusers.models.attention_processor import AttnProcessor2_0
     DIFFUSERS_AVAILABLE = True
-    TORCH_AVAILABLE = True
 except ImportError as e:
     DIFFUSERS_AVAILABLE = False
-    TORCH_AVAILABLE = False
     torch = None
     logger.warning(f"Diffusers not installed or import error: {e}. Install with: pip install diffusers torch accelerate")
 
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
+if DIFFUSERS_AVAILABLE:
+    # TF32 tensor cores for fp32 matmuls/convs on Ampere+, and cuDNN
+    # autotuning for the fixed generation shapes
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
 
 
 class SDBackend(str, Enum):
@@ -60,6 +110,48 @@ class SDModel(str, Enum):
     REALISTIC_VISION = "SG161222/Realistic_Vision_V5.1_noVAE"
 
 
+# Short names accepted by generate_image(model=...)
+MODEL_ALIASES = {
+    "sd_1_5": SDModel.SD_1_5,
+    "sd_2_1": SDModel.SD_2_1,
+    "sdxl_base": SDModel.SDXL_BASE,
+    "openjourney": SDModel.OPENJOURNEY,
+    "dreamshaper": SDModel.DREAMSHAPER,
+    "realistic_vision": SDModel.REALISTIC_VISION,
+    "lcm_sd_1_5": SDModel.SD_1_5,
+    "lcm_sdxl": SDModel.SDXL_BASE
+}
+
+# Latent-consistency LoRAs: distilled variants that sample in 4-8 steps without CFG
+LCM_LORAS = {
+    "lcm_sd_1_5": "latent-consistency/lcm-lora-sdv1-5",
+    "lcm_sdxl": "latent-consistency/lcm-lora-sdxl"
+}
+
+# A1111 sampler names -> Diffusers scheduler class and config overrides.
+# Karras sigmas let DPM++ 2M converge in ~20 steps.
+SAMPLERS = {
+    "DPM++ 2M Karras": ("DPMSolverMultistepScheduler", {
+        "algorithm_type": "dpmsolver++",
+        "solver_order": 2,
+        "use_karras_sigmas": True
+    }),
+    "DPM++ 2M": ("DPMSolverMultistepScheduler", {
+        "algorithm_type": "dpmsolver++",
+        "solver_order": 2,
+        "use_karras_sigmas": False
+    }),
+    "Euler a": ("EulerAncestralDiscreteScheduler", {})
+}
+DEFAULT_SAMPLER = "DPM++ 2M Karras"
+
+# Negative prompts whose text-encoder output is kept on the GPU
+NEGATIVE_EMBED_CACHE_SIZE = 32
+
+# SDXL VAE patched to decode in fp16 without NaNs (the stock one needs fp32)
+SDXL_FP16_VAE = "madebyollin/sdxl-vae-fp16-fix"
+
+
 @dataclass
 class GenerationParams:
     """Parameters for image generation."""
@@ -67,11 +159,13 @@ class GenerationParams:
     negative_prompt: str = "blurry, low quality, distorted, text, watermark, signature"
     width: int = 1024
     height: int = 768
-    num_inference_steps: int = 25
+    num_inference_steps: int = 20
     guidance_scale: float = 7.5
     seed: int = -1
     batch_size: int = 1
-    sampler: str = "DPM++ 2M Karras"
+    sampler: str = DEFAULT_SAMPLER
+    image_format: str = "WEBP"  # or "PNG" for lossless output
+    prompts: Optional[List[str]] = None  # local backend: one job, many prompts
 
 
 @dataclass
@@ -85,6 +179,56 @@ class GenerationResult:
     error: Optional[str] = None
 
 
+def _encode_image(image, image_format: str = "WEBP") -> str:
+    """Encode a PIL image as base64 WEBP (quality 90) or lossless PNG."""
+    buffered = io.BytesIO()
+    if image_format.upper() == "PNG":
+        image.save(buffered, format="PNG")
+    else:
+        image.save(buffered, format="WEBP", quality=90, method=4)
+    return _b64encode(buffered.getbuffer()).decode()
+
+
+def _batch_key(item: Dict[str, Any]) -> Tuple:
+    """Requests sharing this key can run in the same pipeline call."""
+    params = item["params"]
+    return (
+        params.width,
+        params.height,
+        params.num_inference_steps,
+        params.guidance_scale,
+        params.batch_size,
+        params.sampler
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _format_ad_prompt(
+    template: str,
+    style: str,
+    mood: str,
+    colors: Tuple[str, ...],
+    festival: Optional[str],
+    custom_additions: str
+) -> str:
+    """Fill a pre-normalized ad prompt template (memoized)."""
+    color_str = ""
+    if colors:
+        color_str = f"color scheme with {', '.join(colors)}"
+    
+    prompt = template.format_map({
+        "style": style,
+        "mood": mood,
+        "colors": color_str,
+        "festival": festival or "celebration"
+    })
+    
+    if custom_additions:
+        prompt = f"{prompt}, {custom_additions}"
+    
+    return prompt
+
+
 class StableDiffusionService:
     """
     Unified Stable Diffusion service supporting multiple backends.
@@ -132,7 +276,7 @@ class StableDiffusionService:
     ]
     
     # Ad-optimized prompt templates
-    AD_PROMPT_TEMPLATES = {
+    _RAW_AD_PROMPT_TEMPLATES = {
         "product_background": """
             professional product photography background, {style}, 
             studio lighting, clean composition, advertising quality,
@@ -166,7 +310,7 @@ class StableDiffusionService:
     }
     
     # Negative prompts for clean ad backgrounds
-    AD_NEGATIVE_PROMPTS = {
+    _RAW_AD_NEGATIVE_PROMPTS = {
         "default": """
             text, words, letters, numbers, watermark, signature, logo,
             human, person, face, hands, body parts,
@@ -183,12 +327,21 @@ class StableDiffusionService:
         """
     }
     
+    # Whitespace-normalized once, at class creation
+    AD_PROMPT_TEMPLATES = {k: " ".join(v.split()) for k, v in _RAW_AD_PROMPT_TEMPLATES.items()}
+    AD_NEGATIVE_PROMPTS = {k: " ".join(v.split()) for k, v in _RAW_AD_NEGATIVE_PROMPTS.items()}
+    
     def __init__(
         self,
         backend: SDBackend = SDBackend.LOCAL_DIFFUSERS,
         model: SDModel = SDModel.SD_1_5,
         api_url: str = None,
-        api_key: str = None
+        api_key: str = None,
+        enable_quantization: Literal["none", "int8", "nf4"] = "none",
+        max_batch: int = 4,
+        batch_window_ms: int = 20,
+        low_vram: Optional[bool] = None,
+        local_files_only: bool = False
     ):
         """
         Initialize Stable Diffusion service.
@@ -198,16 +351,66 @@ class StableDiffusionService:
             model: Which model to load (for local)
             api_url: API URL for AUTOMATIC1111 or ComfyUI
             api_key: API key for HuggingFace
+            enable_quantization: bitsandbytes weight-only UNet quantization for
+                VRAM-constrained CUDA hosts ("int8" or "nf4")
+            max_batch: Most concurrent local requests run as one pipeline call
+            batch_window_ms: How long to wait for concurrent requests to batch
+            low_vram: Offload idle pipeline components to CPU; detected from
+                total GPU memory (< 16 GB) when left as None
+            local_files_only: Load weights from the local cache only, never
+                the network
         """
         self.backend = backend
         self.model_id = model.value if isinstance(model, SDModel) else model
         self.api_url = api_url or "http://127.0.0.1:7860"
         self.api_key = api_key or os.environ.get("HF_API_KEY", "")
+        self.quantization = enable_quantization
+        self.local_files_only = local_files_only
         
         self.pipeline = None
+        self._pipelines: Dict[str, Any] = {}
+        self._load_lock = threading.Lock()
+        self._neg_embed_cache: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+        self._neg_embed_lock = threading.Lock()
+        # The pooled HTTP session lives on one long-lived loop thread:
+        # sessions are bound to their loop, and Flask routes run each request
+        # on a new one
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http_lock = threading.Lock()
+        # One shared pool for pipeline calls and image encoding. asyncio's
+        # default executor belongs to the loop, and Flask routes run each
+        # request on a new loop. Needs at least max_batch workers to batch.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(int(os.environ.get("SD_MAX_CONCURRENCY", "8")), max_batch),
+            thread_name_prefix="sd"
+        )
+        self._batcher = RequestBatcher(
+            self._run_local_batch,
+            max_batch=max_batch,
+            window_ms=batch_window_ms,
+            key=_batch_key
+        )
+        if backend == SDBackend.LOCAL_DIFFUSERS and not DIFFUSERS_AVAILABLE:
+            raise RuntimeError(
+                "Local Diffusers backend needs torch, Pillow and diffusers: "
+                "pip install diffusers torch accelerate"
+            )
+        
+        # Resolved once; the rest of the service checks these attributes
+        self._use_cuda = DIFFUSERS_AVAILABLE and torch.cuda.is_available()
         self.device = None
-        if TORCH_AVAILABLE and torch is not None:
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = None
+        if DIFFUSERS_AVAILABLE:
+            self.device = "cuda" if self._use_cuda else "cpu"
+            # bf16 where the GPU supports it (Ampere+): fp32 dynamic range, so
+            # no fp16 overflow/NaN workarounds; fp16 on older GPUs, fp32 on CPU
+            self.dtype = torch.float32
+            if self._use_cuda:
+                self.dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        if low_vram is None:
+            low_vram = self._use_cuda and torch.cuda.mem_get_info()[1] < 16 * 2**30
+        self.low_vram = low_vram
         self._initialized = False
         
     async def initialize(self) -> bool:
@@ -231,42 +434,10 @@ class StableDiffusionService:
     
     async def _init_local_diffusers(self) -> bool:
         """Initialize local Diffusers pipeline."""
-        if not DIFFUSERS_AVAILABLE:
-            logger.error("Diffusers not available")
-            return False
-            
         try:
-            logger.info(f"Loading Stable Diffusion model: {self.model_id}")
-            
-            # Load appropriate pipeline
-            if "xl" in self.model_id.lower():
-                self.pipeline = StableDiffusionXLPipeline.from_pretrained(
-                    self.model_id,
-                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                    use_safetensors=True,
-                    variant="fp16" if self.device == "cuda" else None
-                )
-            else:
-                self.pipeline = StableDiffusionPipeline.from_pretrained(
-                    self.model_id,
-                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                    safety_checker=None
-                )
-            
-            # Optimize scheduler
-            self.pipeline.scheduler = DPMSolverMultistepScheduler.from_config(
-                self.pipeline.scheduler.config
-            )
-            
-            # Move to device
-            self.pipeline = self.pipeline.to(self.device)
-            
-            # Enable memory optimizations
-            self.pipeline.enable_attention_slicing()
-            
-            # Note: xformers disabled for compatibility
-            # Works with CPU and CUDA without additional dependencies
-            
+            self.pipeline = await self._run_blocking(self._load_pipeline, self.model_id)
+            with self._neg_embed_lock:
+                self._neg_embed_cache.clear()
             self._initialized = True
             logger.info(f"✓ Stable Diffusion loaded on {self.device}")
             return True
@@ -275,15 +446,271 @@ class StableDiffusionService:
             logger.error(f"Failed to load SD model: {e}")
             return False
     
+    def _load_pipeline(self, model_id: str, lora: str = None):
+        """Load a text-to-image pipeline, reusing it if already loaded."""
+        key = f"{model_id}+{lora}" if lora else model_id
+        # Loads run on pool threads; don't build the same pipeline twice
+        with self._load_lock:
+            if key not in self._pipelines:
+                self._pipelines[key] = self._build_pipeline(model_id, lora)
+            return self._pipelines[key]
+    
+    def _build_pipeline(self, model_id: str, lora: str = None):
+        """Build and optimize a text-to-image pipeline."""
+        logger.info(f"Loading Stable Diffusion model: {model_id}")
+        
+        load_kwargs = dict(
+            use_safetensors=True,
+            local_files_only=self.local_files_only,
+            cache_dir=DIFFUSERS_CACHE
+        )
+        
+        # Quantized UNet is loaded on its own and handed to the pipeline
+        quantized = self._use_cuda and self.quantization in ("int8", "nf4")
+        components = {"unet": self._load_quantized_unet(model_id, **load_kwargs)} if quantized else {}
+        
+        # Load appropriate pipeline
+        if "xl" in model_id.lower():
+            if self.dtype == torch.float16:
+                # Stock SDXL VAE overflows in fp16; bf16 doesn't need the fix
+                components["vae"] = AutoencoderKL.from_pretrained(
+                    SDXL_FP16_VAE,
+                    torch_dtype=torch.float16,
+                    **load_kwargs
+                )
+            pipeline = StableDiffusionXLPipeline.from_pretrained(
+                model_id,
+                torch_dtype=self.dtype,
+                variant="fp16" if self.dtype == torch.float16 else None,
+                **load_kwargs,
+                **components
+            )
+        else:
+            pipeline = StableDiffusionPipeline.from_pretrained(
+                model_id,
+                torch_dtype=self.dtype,
+                safety_checker=None,
+                **load_kwargs,
+                **components
+            )
+        
+        if lora:
+            # Fuse the LCM LoRA into the weights once; sample with LCM
+            pipeline.load_lora_weights(lora)
+            pipeline.fuse_lora()
+            pipeline.scheduler = LCMScheduler.from_config(pipeline.scheduler.config)
+        else:
+            self._use_sampler(pipeline, DEFAULT_SAMPLER)
+        
+        # Move to device, or keep weights on CPU and move each model to the
+        # GPU only while it runs
+        offload = self._use_cuda and self.low_vram
+        if offload:
+            pipeline.enable_model_cpu_offload()
+        else:
+            pipeline = pipeline.to(self.device)
+        
+        # Decode large images tile by tile and batches one image at a time,
+        # bounding VAE memory for SDXL / 1024px outputs
+        pipeline.enable_vae_tiling()
+        pipeline.enable_vae_slicing()
+        
+        # NHWC lets cuDNN use tensor-core convolutions (Volta and newer)
+        if self._use_cuda and not quantized and torch.cuda.get_device_capability()[0] >= 7:
+            pipeline.unet.to(memory_format=torch.channels_last)
+            pipeline.vae.to(memory_format=torch.channels_last)
+        
+        # Fused attention on CUDA: xformers if installed, else PyTorch SDPA
+        # (FlashAttention / memory-efficient kernels). Slicing only on CPU.
+        if self._use_cuda:
+            try:
+                pipeline.enable_xformers_memory_efficient_attention()
+            except Exception:
+                pipeline.unet.set_attn_processor(AttnProcessor2_0())
+        else:
+            pipeline.enable_attention_slicing()
+        
+        # Compile last, once the attention processors are final
+        if self._use_cuda and TORCH_COMPILE and not quantized and not offload:
+            pipeline.unet = torch.compile(pipeline.unet, mode="reduce-overhead", fullgraph=False)
+            pipeline.vae.decode = torch.compile(pipeline.vae.decode, mode="reduce-overhead")
+        
+        return pipeline
+    
+    def _use_sampler(self, pipeline, sampler: str) -> None:
+        """Switch the pipeline's scheduler to an A1111-style sampler, if known."""
+        if sampler not in SAMPLERS or getattr(pipeline, "_sampler", None) == sampler:
+            return
+        scheduler_name, overrides = SAMPLERS[sampler]
+        scheduler_cls = {
+            "DPMSolverMultistepScheduler": DPMSolverMultistepScheduler,
+            "EulerAncestralDiscreteScheduler": EulerAncestralDiscreteScheduler
+        }[scheduler_name]
+        pipeline.scheduler = scheduler_cls.from_config(pipeline.scheduler.config, **overrides)
+        pipeline._sampler = sampler
+    
+    def _load_quantized_unet(self, model_id: str, **load_kwargs):
+        """Load the UNet with bitsandbytes int8 or NF4 weights."""
+        from diffusers import BitsAndBytesConfig, UNet2DConditionModel
+        
+        if self.quantization == "int8":
+            config = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=self.dtype
+            )
+        
+        key = f"{model_id}|{self.quantization}|{self.dtype}"
+        cache_path = QUANTIZED_CACHE_DIR / hashlib.sha256(key.encode()).hexdigest()[:16]
+        if cache_path.exists():
+            logger.info(f"Loading {self.quantization} UNet from {cache_path}")
+            return UNet2DConditionModel.from_pretrained(
+                cache_path,
+                torch_dtype=self.dtype,
+                use_safetensors=True,
+                local_files_only=True
+            )
+        
+        logger.info(f"Quantizing UNet to {self.quantization}")
+        unet = UNet2DConditionModel.from_pretrained(
+            model_id,
+            subfolder="unet",
+            quantization_config=config,
+            torch_dtype=self.dtype,
+            **load_kwargs
+        )
+        
+        # Write to a temp dir and rename, so a crash never leaves a partial cache
+        try:
+            tmp_path = cache_path.with_name(f"{cache_path.name}.tmp{os.getpid()}")
+            unet.save_pretrained(tmp_path, safe_serialization=True)
+            tmp_path.rename(cache_path)
+        except Exception as e:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            logger.warning(f"Could not cache quantized UNet: {e}")
+        return unet
+    
+    async def generate_image(
+        self,
+        prompt: str,
+        negative_prompt: str = "",
+        width: int = 1024,
+        height: int = 768,
+        num_inference_steps: int = 25,
+        guidance_scale: float = 7.5,
+        model: str = None,
+        init_image: Union[str, "Image.Image", "torch.Tensor"] = None,
+        strength: float = 0.75,
+        seed: int = -1
+    ) -> Dict[str, Any]:
+        """
+        Generate a single image with local Diffusers and return it unencoded.
+        
+        Args:
+            model: Alias from MODEL_ALIASES or a model id (defaults to the service model)
+            init_image: Optional img2img source - a PIL image or tensor is used
+                as-is, a string is decoded as base64 image data
+            strength: How far img2img may move away from init_image
+            
+        Returns:
+            Dict with "image" (PIL.Image) and "seed"
+        """
+        if not DIFFUSERS_AVAILABLE:
+            raise RuntimeError("Diffusers not available")
+        
+        model_id = MODEL_ALIASES.get(model, model) if model else self.model_id
+        model_id = model_id.value if isinstance(model_id, SDModel) else model_id
+        seed = seed if seed > 0 else torch.randint(0, 2**32, (1,)).item()
+        
+        kwargs = dict(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale
+        )
+        
+        image = await self._run_blocking(
+            self._run_image, model_id, LCM_LORAS.get(model), seed,
+            width, height, init_image, strength, kwargs
+        )
+        return {"image": image, "seed": seed}
+    
+    def _run_image(
+        self,
+        model_id: str,
+        lora: Optional[str],
+        seed: int,
+        width: int,
+        height: int,
+        init_image: Any,
+        strength: float,
+        kwargs: Dict[str, Any]
+    ):
+        """Blocking body of generate_image: load the pipeline and sample."""
+        pipeline = self._load_pipeline(model_id, lora=lora)
+        generator = torch.Generator(device=self.device).manual_seed(seed)
+        
+        if init_image is None:
+            result = pipeline(width=width, height=height, generator=generator, **kwargs)
+        else:
+            if isinstance(init_image, str):
+                init_image = Image.open(io.BytesIO(_b64decode(init_image))).convert("RGB")
+            # from_pipe shares the loaded weights, no second copy
+            img2img = AutoPipelineForImage2Image.from_pipe(pipeline)
+            result = img2img(image=init_image, strength=strength, generator=generator, **kwargs)
+        
+        return result.images[0]
+    
+    async def _run_blocking(self, fn, *args):
+        """Run a blocking call on the service's thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+    
+    def _get_http_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the HTTP loop, starting its thread on first use."""
+        with self._http_lock:
+            if self._http_loop is None:
+                self._http_loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._http_loop.run_forever, name="sd-http", daemon=True
+                ).start()
+            return self._http_loop
+    
+    async def _on_http_loop(self, coro):
+        """Run a coroutine on the HTTP loop and await its result."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_http_loop())
+        return await asyncio.wrap_future(future)
+    
+    async def _request(self, method: str, url: str, **kwargs) -> Tuple[int, bytes]:
+        """Send a request through the pooled session; returns (status, body)."""
+        async def send():
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=300)
+                )
+            async with self._session.request(method, url, **kwargs) as resp:
+                return resp.status, await resp.read()
+        
+        return await self._on_http_loop(send())
+    
+    async def aclose(self):
+        """Close the pooled HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._on_http_loop(self._session.close())
+        self._session = None
+    
     async def _check_automatic1111(self) -> bool:
         """Check if AUTOMATIC1111 API is available."""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.api_url}/sdapi/v1/options", timeout=5) as resp:
-                    if resp.status == 200:
-                        self._initialized = True
-                        logger.info("✓ AUTOMATIC1111 API available")
-                        return True
+            status, _ = await self._request("GET", f"{self.api_url}/sdapi/v1/options", timeout=5)
+            if status == 200:
+                self._initialized = True
+                logger.info("✓ AUTOMATIC1111 API available")
+                return True
         except:
             pass
         logger.warning("AUTOMATIC1111 API not available")
@@ -292,12 +719,11 @@ class StableDiffusionService:
     async def _check_comfyui(self) -> bool:
         """Check if ComfyUI API is available."""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.api_url}/system_stats", timeout=5) as resp:
-                    if resp.status == 200:
-                        self._initialized = True
-                        logger.info("✓ ComfyUI API available")
-                        return True
+            status, _ = await self._request("GET", f"{self.api_url}/system_stats", timeout=5)
+            if status == 200:
+                self._initialized = True
+                logger.info("✓ ComfyUI API available")
+                return True
         except:
             pass
         logger.warning("ComfyUI API not available")
@@ -338,49 +764,121 @@ class StableDiffusionService:
     
     async def _generate_local(self, params: GenerationParams) -> GenerationResult:
         """Generate using local Diffusers pipeline."""
-        import time
-        start = time.time()
+        start = time.perf_counter()
         
         # Set seed
-        generator = None
         seed = params.seed if params.seed > 0 else torch.randint(0, 2**32, (1,)).item()
-        if DIFFUSERS_AVAILABLE:
-            generator = torch.Generator(device=self.device).manual_seed(seed)
         
-        # Generate
-        result = self.pipeline(
-            prompt=params.prompt,
-            negative_prompt=params.negative_prompt,
-            width=params.width,
-            height=params.height,
-            num_inference_steps=params.num_inference_steps,
-            guidance_scale=params.guidance_scale,
-            generator=generator,
-            num_images_per_prompt=params.batch_size
+        # Generate, batched with concurrent requests of the same shape
+        images = await self._run_blocking(
+            self._batcher.submit, {"params": params, "seed": seed}
         )
         
-        # Convert to base64
-        images_b64 = []
-        for img in result.images:
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_b64 = base64.b64encode(buffered.getvalue()).decode()
-            images_b64.append(img_b64)
+        # Convert to base64 off the event loop
+        images_b64 = list(await asyncio.gather(*(
+            self._run_blocking(_encode_image, img, params.image_format)
+            for img in images
+        )))
         
-        elapsed = time.time() - start
+        elapsed = time.perf_counter() - start
         
         return GenerationResult(
             success=True,
             images=images_b64,
-            seeds=[seed],
+            seeds=[seed + i for i in range(len(images_b64))],
             generation_time=elapsed,
             model_used=self.model_id
         )
     
+    def _run_local_batch(self, items: List[Dict[str, Any]]) -> List[List[Any]]:
+        """
+        Run same-shaped txt2img requests as one pipeline call.
+        
+        Each request gets its own prompts and seeded generators; the
+        pipeline returns images grouped per prompt, which are split back
+        into one list per request.
+        """
+        params = items[0]["params"]
+        per_prompt = params.batch_size
+        prompts = [item["params"].prompts or [item["params"].prompt] for item in items]
+        
+        # Image k of a request (prompt-major) is seeded with seed + k
+        generators = [
+            torch.Generator(device=self.device).manual_seed(item["seed"] + i)
+            for item, item_prompts in zip(items, prompts)
+            for i in range(len(item_prompts) * per_prompt)
+        ]
+        self._use_sampler(self.pipeline, params.sampler)
+        
+        negative_prompts = [
+            item["params"].negative_prompt
+            for item, item_prompts in zip(items, prompts)
+            for _ in item_prompts
+        ]
+        negative = None
+        if params.guidance_scale > 1:
+            negative = self._negative_embeds(negative_prompts)
+        
+        result = self.pipeline(
+            prompt=[prompt for item_prompts in prompts for prompt in item_prompts],
+            **(negative or {"negative_prompt": negative_prompts}),
+            width=params.width,
+            height=params.height,
+            num_inference_steps=params.num_inference_steps,
+            guidance_scale=params.guidance_scale,
+            generator=generators,
+            num_images_per_prompt=per_prompt
+        )
+        
+        outputs, start = [], 0
+        for item_prompts in prompts:
+            end = start + len(item_prompts) * per_prompt
+            outputs.append(result.images[start:end])
+            start = end
+        return outputs
+    
+    def _negative_embeds(self, negative_prompts: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Pipeline kwargs with cached text-encoder embeddings for negative prompts.
+        
+        Negative prompts repeat across requests, so each one is encoded once
+        and kept (LRU) until the pipeline is reloaded. Returns None for empty
+        prompts, which SDXL encodes as zeros rather than text.
+        """
+        if not all(negative_prompts):
+            return None
+        
+        pipeline = self.pipeline
+        sdxl = isinstance(pipeline, StableDiffusionXLPipeline)
+        embeds = []
+        with self._neg_embed_lock:
+            for text in negative_prompts:
+                cached = self._neg_embed_cache.get(text)
+                if cached is None:
+                    with torch.no_grad():
+                        encoded = pipeline.encode_prompt(
+                            prompt=text,
+                            device=pipeline._execution_device,
+                            num_images_per_prompt=1,
+                            do_classifier_free_guidance=False
+                        )
+                    # SD returns (embeds, None); SDXL adds pooled embeds at index 2
+                    cached = (encoded[0], encoded[2] if sdxl else None)
+                    self._neg_embed_cache[text] = cached
+                    if len(self._neg_embed_cache) > NEGATIVE_EMBED_CACHE_SIZE:
+                        self._neg_embed_cache.popitem(last=False)
+                else:
+                    self._neg_embed_cache.move_to_end(text)
+                embeds.append(cached)
+        
+        kwargs = {"negative_prompt_embeds": torch.cat([e[0] for e in embeds])}
+        if sdxl:
+            kwargs["negative_pooled_prompt_embeds"] = torch.cat([e[1] for e in embeds])
+        return kwargs
+    
     async def _generate_automatic1111(self, params: GenerationParams) -> GenerationResult:
         """Generate using AUTOMATIC1111 API."""
-        import time
-        start = time.time()
+        start = time.perf_counter()
         
         payload = {
             "prompt": params.prompt,
@@ -394,32 +892,32 @@ class StableDiffusionService:
             "sampler_name": params.sampler
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.api_url}/sdapi/v1/txt2img",
-                json=payload,
-                timeout=300
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    elapsed = time.time() - start
-                    return GenerationResult(
-                        success=True,
-                        images=data["images"],
-                        seeds=[data.get("seed", -1)],
-                        generation_time=elapsed,
-                        model_used="automatic1111"
-                    )
-                else:
-                    error = await resp.text()
-                    return GenerationResult(
-                        success=False,
-                        images=[],
-                        seeds=[],
-                        generation_time=0,
-                        model_used="automatic1111",
-                        error=error
-                    )
+        status, body = await self._request(
+            "POST",
+            f"{self.api_url}/sdapi/v1/txt2img",
+            json=payload,
+            headers={"Accept-Encoding": "gzip"},
+            timeout=300
+        )
+        if status == 200:
+            data = _json_loads(body)
+            elapsed = time.perf_counter() - start
+            return GenerationResult(
+                success=True,
+                images=data["images"],
+                seeds=[data.get("seed", -1)],
+                generation_time=elapsed,
+                model_used="automatic1111"
+            )
+        else:
+            return GenerationResult(
+                success=False,
+                images=[],
+                seeds=[],
+                generation_time=0,
+                model_used="automatic1111",
+                error=body.decode("utf-8", errors="replace")
+            )
     
     async def _generate_comfyui(self, params: GenerationParams) -> GenerationResult:
         """Generate using ComfyUI API (simplified workflow)."""
@@ -437,42 +935,39 @@ class StableDiffusionService:
     
     async def _generate_huggingface(self, params: GenerationParams) -> GenerationResult:
         """Generate using HuggingFace Inference API."""
-        import time
-        start = time.time()
+        start = time.perf_counter()
         
         headers = {"Authorization": f"Bearer {self.api_key}"}
         payload = {"inputs": params.prompt}
         
         api_url = f"https://api-inference.huggingface.co/models/{self.model_id}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                api_url,
-                headers=headers,
-                json=payload,
-                timeout=120
-            ) as resp:
-                if resp.status == 200:
-                    image_bytes = await resp.read()
-                    img_b64 = base64.b64encode(image_bytes).decode()
-                    elapsed = time.time() - start
-                    return GenerationResult(
-                        success=True,
-                        images=[img_b64],
-                        seeds=[-1],
-                        generation_time=elapsed,
-                        model_used=self.model_id
-                    )
-                else:
-                    error = await resp.text()
-                    return GenerationResult(
-                        success=False,
-                        images=[],
-                        seeds=[],
-                        generation_time=0,
-                        model_used=self.model_id,
-                        error=error
-                    )
+        status, body = await self._request(
+            "POST",
+            api_url,
+            headers=headers,
+            json=payload,
+            timeout=120
+        )
+        if status == 200:
+            img_b64 = _b64encode(body).decode()
+            elapsed = time.perf_counter() - start
+            return GenerationResult(
+                success=True,
+                images=[img_b64],
+                seeds=[-1],
+                generation_time=elapsed,
+                model_used=self.model_id
+            )
+        else:
+            return GenerationResult(
+                success=False,
+                images=[],
+                seeds=[],
+                generation_time=0,
+                model_used=self.model_id,
+                error=body.decode("utf-8", errors="replace")
+            )
     
     def build_ad_prompt(
         self,
@@ -501,45 +996,28 @@ class StableDiffusionService:
             f"{template_type}_background",
             self.AD_PROMPT_TEMPLATES["banner_background"]
         )
-        
-        # Format colors
-        color_str = ""
-        if colors:
-            color_str = f"color scheme with {', '.join(colors)}"
-        
-        # Build prompt
-        prompt = template.format(
-            style=style,
-            mood=mood,
-            colors=color_str,
-            festival=festival or "celebration"
+        return _format_ad_prompt(
+            template,
+            style,
+            mood,
+            tuple(colors or ()),
+            festival,
+            custom_additions
         )
-        
-        if custom_additions:
-            prompt = f"{prompt}, {custom_additions}"
-        
-        # Clean up whitespace
-        prompt = " ".join(prompt.split())
-        
-        return prompt
     
     def get_negative_prompt(self, type: str = "default") -> str:
         """Get appropriate negative prompt."""
-        prompt = self.AD_NEGATIVE_PROMPTS.get(type, self.AD_NEGATIVE_PROMPTS["default"])
-        return " ".join(prompt.split())
+        return self.AD_NEGATIVE_PROMPTS.get(type, self.AD_NEGATIVE_PROMPTS["default"])
     
     def get_status(self) -> Dict[str, Any]:
         """Get service status."""
-        gpu_available = False
-        if TORCH_AVAILABLE and torch is not None:
-            gpu_available = torch.cuda.is_available()
         return {
             "initialized": self._initialized,
             "backend": self.backend.value,
             "model": self.model_id,
             "device": self.device,
             "diffusers_available": DIFFUSERS_AVAILABLE,
-            "gpu_available": gpu_available
+            "gpu_available": self._use_cuda
         }
 
 
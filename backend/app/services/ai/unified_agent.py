@@ -6,17 +6,151 @@ CTA optimization, localization, A/B generation, and auto-apply with versioning.
 """
 
 import asyncio
+import contextvars
 import json
+import os
 import uuid
 import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, AsyncGenerator
 from dataclasses import dataclass, field, asdict
 from enum import Enum
+from pathlib import Path
 from loguru import logger
 
 from .gemini_service import get_gemini_service
 
+# Faster JSON on the suggestion hot path when orjson is installed. Its
+# JSONDecodeError subclasses json.JSONDecodeError, so handlers catch either.
+try:
+    import orjson
+    _loads = orjson.loads
+    
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
+
+# Undo/redo depth per document. Only every SNAPSHOT_INTERVAL-th version keeps
+# a full copy of the document; the rest are rebuilt by replaying patches.
+MAX_VERSIONS = 50
+SNAPSHOT_INTERVAL = 10
+
+# Content-hash suggestion cache: identical requests within the TTL reuse the
+# earlier suggestion instead of another Gemini round-trip
+SUGGESTION_CACHE_SIZE = 1000
+SUGGESTION_CACHE_TTL = 600  # seconds
+
+# A/B variants produced by offline Batch Mode jobs stay cached much longer,
+# since the job itself can take up to a day
+AB_BATCH_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Submitted A/B batch jobs and their collected results. Kept on disk rather
+# than in a worker's memory: gunicorn recycles workers long before a job
+# finishes, and any worker may be asked to collect it or serve its results
+AB_BATCH_DIR = Path(os.path.expanduser(os.getenv("AGENT_BATCH_DIR", "~/.cache/rmcb/ab-batches")))
+
+# Intents prefetched into the cache when a document is opened, and how many
+# warmups may run at once (further requests are skipped, not queued)
+WARMUP_INTENTS = ("creative_rewrite", "cta_optimization")
+MAX_CONCURRENT_WARMUPS = 2
+
+# Suggestion prompt templates. Static instructions come first and the
+# per-request fields last, so the shared prefix stays byte-identical.
+
+_CREATIVE_REWRITE_PROMPT = """Generate 3 headline variants with different tones:
+1. Urgent - Creates urgency and FOMO
+2. Value-focused - Highlights savings and value (use â‚¹ for prices)
+3. Premium - Sophisticated and aspirational
+
+Requirements:
+- Max 10 words each
+- Use â‚¹ for currency if mentioning price
+- For Hindi/Telugu, provide both original script and transliteration
+
+Current headline: "{current_text}"
+Retailer: {retailer}
+Occasion: {occasion}
+Target locale: {locale}"""
+
+_LAYOUT_PROMPT = """Suggest 3 layout alternatives:
+1. Product-left, text-right
+2. Text-centered, product-bottom
+3. Diagonal/dynamic arrangement
+
+Provide exact positions as percentages (0-100) for each element.
+
+Current layout elements: {blocks}
+Canvas size: {dimensions}
+Platform: {platform}"""
+
+_STYLE_PROMPT = """Suggest color palette and typography that:
+1. Has WCAG AA accessibility (contrast ratio > 4.5:1)
+2. Matches the occasion mood
+3. Works well together
+
+Include: primary, secondary, accent, background colors
+Font recommendations with sizes
+
+Current styles: {styles}
+Festival/Occasion: {festival}
+Brand color: {brand_color}"""
+
+_CTA_PROMPT = """Generate CTAs for different objectives:
+- buy: Direct purchase action
+- learn: Information seeking
+- subscribe: Newsletter/membership
+- save: Deal-focused
+
+Provide urgency level (high/medium/low) for each.
+
+Current CTA: "{current_cta}"
+Objective: {objective}
+Product: {product}"""
+
+_LOCALIZATION_PROMPT = """For Hindi (hi): Use Devanagari script
+For Telugu (te): Use Telugu script  
+For Hinglish (hi-en): Mix Hindi words in Roman with English
+
+Requirements:
+- Keep brand names in English
+- Use â‚¹ for currency
+- Adapt idioms culturally
+- Provide transliteration for non-English scripts
+
+Translate/localize for {locale}:
+{texts}"""
+
+_AB_PROMPT = """Create A/B test variants for the creative below.
+
+Generate:
+- Variant A: Original with minor optimizations
+- Variant B: Significant change (different headline approach, CTA, or layout)
+
+For each variant, explain the hypothesis being tested.
+
+Creative:
+{creative}"""
+
+_TEXT_EDIT_PROMPT = """Apply the edit and return the updated text.
+
+Edit request: {instruction}
+Current document: {document}
+Locale: {locale}"""
+
+# Set by warmup() so every Gemini call it makes runs on the flex tier
+_forced_service_tier: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "forced_service_tier", default=None
+)
+
+# Set for a refresh, so handlers skip the Gemini response cache too and
+# "Get new suggestions" really produces new variants
+_refreshing: contextvars.ContextVar[bool] = contextvars.ContextVar("refreshing", default=False)
+
 
 class Language(str, Enum):
     """Supported languages"""
@@ -53,7 +187,7 @@ class PatchOperation(str, Enum):
     CHANGE_LAYOUT = "change_layout"
 
 
-@dataclass
+@dataclass(slots=True)
 class Block:
     """Document block structure"""
     id: str
@@ -73,6 +207,23 @@ class DocumentModel:
     meta: Dict[str, Any] = field(default_factory=dict)
     background: Dict[str, Any] = field(default_factory=dict)
     dimensions: Dict[str, int] = field(default_factory=lambda: {"width": 1200, "height": 628})
+    # role -> block, built on first lookup; not serialized
+    _roles: Optional[Dict[str, Block]] = field(default=None, init=False, repr=False, compare=False)
+    
+    def role_block(self, role: str) -> Optional[Block]:
+        """First "headline" or "cta" block, from an index built in one pass"""
+        if self._roles is None:
+            roles = {}
+            for b in self.blocks:
+                block_id = b.id.lower()
+                if "headline" not in roles and b.type == "text" and (
+                    "headline" in block_id or b.style.get("size", 0) > 30
+                ):
+                    roles["headline"] = b
+                if "cta" not in roles and (b.type == "button" or "cta" in block_id):
+                    roles["cta"] = b
+            self._roles = roles
+        return self._roles.get(role)
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -117,9 +268,30 @@ class DocumentModel:
             background=data.get("background", {}),
             dimensions=dimensions
         )
+    
+    def clone(self) -> "DocumentModel":
+        """Copy the document, its blocks and their dicts without a dict round-trip"""
+        return DocumentModel(
+            id=self.id,
+            blocks=[
+                Block(
+                    id=b.id,
+                    type=b.type,
+                    text=b.text,
+                    style=b.style.copy(),
+                    position=b.position.copy(),
+                    size=b.size.copy()
+                )
+                for b in self.blocks
+            ],
+            layout=self.layout,
+            meta=dict(self.meta),
+            background=dict(self.background),
+            dimensions=dict(self.dimensions)
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class PatchOp:
     """Single patch operation"""
     operation: PatchOperation
@@ -128,7 +300,7 @@ class PatchOp:
     reason: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Patch:
     """Collection of patch operations"""
     id: str
@@ -155,7 +327,7 @@ class Patch:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Suggestion:
     """AI suggestion with variants"""
     id: str
@@ -168,16 +340,78 @@ class Suggestion:
     locale: Language = Language.ENGLISH
 
 
-@dataclass
+@dataclass(slots=True)
 class DocumentVersion:
     """Document version for undo/redo"""
     version_id: str
-    document: DocumentModel
+    document: Optional[DocumentModel]  # None when rebuilt from an earlier snapshot
     patch_applied: Optional[Patch]
     timestamp: datetime
     description: str = ""
 
 
+class _StreamedArrayItems:
+    """
+    Incrementally pulls the objects of one top-level JSON array (e.g.
+    "variants") out of a response that arrives in chunks.
+    
+    feed() returns the items completed by each chunk, so callers can act on
+    the first variants while the rest of the response is still streaming.
+    """
+    
+    def __init__(self, key: str):
+        self._marker = f'"{key}"'
+        self._buffer = ""
+        self._pos = -1  # scan position; -1 until the array has opened
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = -1
+        self._done = False
+    
+    def feed(self, chunk: str) -> List[Any]:
+        """Add a chunk and return any array items it completed"""
+        self._buffer += chunk
+        if self._done:
+            return []
+        if self._pos < 0:
+            key_at = self._buffer.find(self._marker)
+            open_at = self._buffer.find("[", key_at + len(self._marker)) if key_at >= 0 else -1
+            if open_at < 0:
+                return []
+            self._pos = open_at + 1
+        
+        items = []
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(_loads(buffer[self._item_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+        self._pos = len(buffer)
+        return items
+
+
 class UnifiedAIAgent:
     """
     Unified AI Agent using Google Gemini for all operations.
@@ -195,7 +429,9 @@ class UnifiedAIAgent:
     - Undo / versioning
     """
     
-    # System prompts for different tasks
+    # System prompts for different tasks. Handler prompts keep their static
+    # instructions first and request-specific fields last, so consecutive
+    # calls share a byte-identical prefix for Gemini's implicit caching.
     SYSTEM_PROMPTS = {
         "creative_editor": """You are a creative marketing editor for Indian e-commerce banners.
 Constraints:
@@ -283,6 +519,16 @@ Output JSON:
 }"""
     }
     
+    # Gemini inference tier per intent: interactive edits the user is waiting
+    # on pay for priority, offline A/B generation takes the flex discount.
+    # Unlisted intents use the standard tier.
+    INTENT_TIERS = {
+        EditIntent.CREATIVE_REWRITE: "priority",
+        EditIntent.CTA_OPTIMIZATION: "priority",
+        EditIntent.AB_GENERATION: "flex",
+        EditIntent.LOCALIZATION: "standard",
+    }
+    
     # Indian festival color palettes
     FESTIVAL_PALETTES = {
         "diwali": {
@@ -337,11 +583,17 @@ Output JSON:
         self._initialized = False
         
         # Version history per document
-        self.document_versions: Dict[str, List[DocumentVersion]] = {}
+        self.document_versions: Dict[str, "deque[DocumentVersion]"] = {}
         self.current_version_index: Dict[str, int] = {}
+        # doc_id -> (version_id, content hash of that version's document with
+        # its patch applied), recorded by apply_patch()
+        self._version_heads: Dict[str, Tuple[str, str]] = {}
         
-        # Suggestion cache
-        self.suggestion_cache: Dict[str, Suggestion] = {}
+        # Suggestion cache: content hash -> (stored_at, suggestion). Guarded by
+        # a thread lock because Flask routes run each request on a new loop.
+        self.suggestion_cache: "OrderedDict[str, Tuple[float, Suggestion]]" = OrderedDict()
+        self._suggestion_cache_lock = threading.Lock()
+        self._warmup_slots = threading.BoundedSemaphore(MAX_CONCURRENT_WARMUPS)
         
         # Telemetry
         self.telemetry = {
@@ -403,36 +655,78 @@ Output JSON:
         )
     
     def save_version(self, doc: DocumentModel, patch: Patch = None, description: str = ""):
-        """Save a document version for undo/redo"""
+        """
+        Save a document version for undo/redo.
+        
+        The document is copied only every SNAPSHOT_INTERVAL versions, or when
+        it differs from what the previous version's patch produced (e.g. it
+        was edited on the client in between). Other versions store just the
+        patch and are rebuilt on undo/redo.
+        """
         doc_id = doc.id
         
         if doc_id not in self.document_versions:
-            self.document_versions[doc_id] = []
+            # Oldest versions drop off the left once the history is full
+            self.document_versions[doc_id] = deque(maxlen=MAX_VERSIONS)
             self.current_version_index[doc_id] = -1
         
         # Remove any versions after current (for new branch)
+        versions = self.document_versions[doc_id]
         current_idx = self.current_version_index[doc_id]
-        self.document_versions[doc_id] = self.document_versions[doc_id][:current_idx + 1]
+        while len(versions) > current_idx + 1:
+            versions.pop()
+        
+        since_snapshot = 0
+        for v in reversed(versions):
+            if v.document is not None:
+                break
+            since_snapshot += 1
+        
+        head = self._version_heads.pop(doc_id, None)
+        is_delta = (
+            since_snapshot + 1 < SNAPSHOT_INTERVAL
+            and head is not None
+            and versions
+            and head[0] == versions[-1].version_id
+            and head[1] == self._doc_hash(doc)
+        )
+        
+        # The oldest version is about to drop off; keep its successor rebuildable
+        if len(versions) == versions.maxlen and len(versions) > 1 and versions[1].document is None:
+            versions[1].document = self._materialize(versions, 1)
         
         # Create new version
         version = DocumentVersion(
             version_id=str(uuid.uuid4()),
-            document=DocumentModel.from_dict(doc.to_dict()),  # Deep copy
+            document=None if is_delta else doc.clone(),
             patch_applied=patch,
             timestamp=datetime.now(),
             description=description
         )
         
-        self.document_versions[doc_id].append(version)
-        self.current_version_index[doc_id] = len(self.document_versions[doc_id]) - 1
-        
-        # Limit history to 50 versions
-        if len(self.document_versions[doc_id]) > 50:
-            self.document_versions[doc_id].pop(0)
-            self.current_version_index[doc_id] -= 1
+        versions.append(version)
+        self.current_version_index[doc_id] = len(versions) - 1
         
         return version.version_id
     
+    @staticmethod
+    def _doc_hash(doc: DocumentModel) -> str:
+        """Content hash of a document, for spotting edits between versions"""
+        payload = json.dumps(doc.to_dict(), sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    
+    def _materialize(self, versions: "deque[DocumentVersion]", index: int) -> DocumentModel:
+        """Document at versions[index], replayed from the nearest earlier snapshot"""
+        start = index
+        while versions[start].document is None:
+            start -= 1
+        
+        # Later deltas replay from the stored snapshot; never hand it out
+        doc = versions[start].document.clone()
+        for i in range(start, index):
+            self._apply_operations(doc, versions[i].patch_applied)
+        return doc
+    
     def undo(self, doc_id: str) -> Optional[DocumentModel]:
         """Undo to previous version"""
         if doc_id not in self.document_versions:
@@ -441,7 +735,7 @@ Output JSON:
         current_idx = self.current_version_index[doc_id]
         if current_idx > 0:
             self.current_version_index[doc_id] = current_idx - 1
-            return self.document_versions[doc_id][current_idx - 1].document
+            return self._materialize(self.document_versions[doc_id], current_idx - 1)
         
         return None
     
@@ -455,7 +749,7 @@ Output JSON:
         
         if current_idx < len(versions) - 1:
             self.current_version_index[doc_id] = current_idx + 1
-            return versions[current_idx + 1].document
+            return self._materialize(versions, current_idx + 1)
         
         return None
     
@@ -479,44 +773,56 @@ Output JSON:
     def apply_patch(self, doc: DocumentModel, patch: Patch) -> DocumentModel:
         """Apply a patch to a document"""
         # Save current state for undo
-        self.save_version(doc, patch, patch.description)
+        version_id = self.save_version(doc, patch, patch.description)
+        self._apply_operations(doc, patch)
+        # What the next save_version() receives if nothing is edited in between
+        self._version_heads[doc.id] = (version_id, self._doc_hash(doc))
+        return doc
+    
+    def _apply_operations(self, doc: DocumentModel, patch: Patch) -> DocumentModel:
+        """Apply a patch's operations in place, without recording a version"""
+        # First block wins on duplicate ids, as with the old linear scan
+        by_id = {b.id: b for b in reversed(doc.blocks)}
         
         for op in patch.operations:
             if op.operation == PatchOperation.REPLACE_TEXT:
-                for block in doc.blocks:
-                    if block.id == op.block_id:
-                        block.text = op.data.get("new_text", block.text)
-                        break
+                block = by_id.get(op.block_id)
+                if block is not None:
+                    block.text = op.data.get("new_text", block.text)
             
             elif op.operation == PatchOperation.UPDATE_STYLE:
-                for block in doc.blocks:
-                    if block.id == op.block_id:
-                        block.style.update(op.data)
-                        break
+                block = by_id.get(op.block_id)
+                if block is not None:
+                    block.style.update(op.data)
             
             elif op.operation == PatchOperation.MOVE_BLOCK:
-                for block in doc.blocks:
-                    if block.id == op.block_id:
-                        block.position.update(op.data)
-                        break
+                block = by_id.get(op.block_id)
+                if block is not None:
+                    block.position.update(op.data)
             
             elif op.operation == PatchOperation.ADD_BLOCK:
+                # Pin generated ids so replaying the patch gives the same block
                 new_block = Block(
-                    id=op.data.get("id", str(uuid.uuid4())),
+                    id=op.data.setdefault("id", str(uuid.uuid4())),
                     type=op.data.get("type", "text"),
                     text=op.data.get("text"),
-                    style=op.data.get("style", {}),
-                    position=op.data.get("position", {}),
-                    size=op.data.get("size", {})
+                    # Copies, so later edits to the block can't rewrite the stored patch
+                    style=dict(op.data.get("style", {})),
+                    position=dict(op.data.get("position", {})),
+                    size=dict(op.data.get("size", {}))
                 )
                 doc.blocks.append(new_block)
+                by_id.setdefault(new_block.id, new_block)
             
             elif op.operation == PatchOperation.DELETE_BLOCK:
-                doc.blocks = [b for b in doc.blocks if b.id != op.block_id]
+                if by_id.pop(op.block_id, None) is not None:
+                    doc.blocks = [b for b in doc.blocks if b.id != op.block_id]
             
             elif op.operation == PatchOperation.CHANGE_LAYOUT:
                 doc.layout = op.data.get("layout", doc.layout)
         
+        # Blocks may have been added, removed or restyled
+        doc._roles = None
         return doc
     
     def create_patch(
@@ -546,28 +852,204 @@ Output JSON:
         doc: DocumentModel,
         intent: str,
         locale: Language = Language.ENGLISH,
-        context: Dict = None
+        context: Dict = None,
+        refresh: bool = False
     ) -> Suggestion:
-        """Get AI suggestions based on intent"""
+        """
+        Get AI suggestions based on intent
+        
+        refresh skips the caches and replaces the cached suggestion, for
+        "Get new suggestions" on an unchanged document.
+        """
         await self.initialize()
         
         intent_enum = EditIntent(intent) if isinstance(intent, str) else intent
+        locale = Language(locale)  # some routes pass the plain code, e.g. 'en'
         
-        # Route to appropriate handler
-        if intent_enum == EditIntent.CREATIVE_REWRITE:
-            return await self._suggest_creative_rewrite(doc, locale, context)
-        elif intent_enum == EditIntent.LAYOUT_SUGGESTION:
-            return await self._suggest_layout(doc, context)
-        elif intent_enum == EditIntent.STYLE_SUGGESTION:
-            return await self._suggest_style(doc, context)
-        elif intent_enum == EditIntent.CTA_OPTIMIZATION:
-            return await self._suggest_cta(doc, context)
-        elif intent_enum == EditIntent.LOCALIZATION:
-            return await self._suggest_localization(doc, locale, context)
-        elif intent_enum == EditIntent.AB_GENERATION:
-            return await self._generate_ab_variants(doc, context)
-        else:
-            return await self._suggest_text_edit(doc, intent_enum, locale, context)
+        cache_key = self._cache_key(intent_enum, locale, doc, context)
+        if not refresh:
+            cached = self._get_cached_suggestion(cache_key)
+            if cached is None and intent_enum == EditIntent.AB_GENERATION:
+                cached = self._load_ab_result(cache_key)
+            if cached is not None:
+                return cached
+        
+        token = _refreshing.set(refresh)
+        try:
+            # Route to appropriate handler
+            if intent_enum == EditIntent.CREATIVE_REWRITE:
+                suggestion = await self._suggest_creative_rewrite(doc, locale, context)
+            elif intent_enum == EditIntent.LAYOUT_SUGGESTION:
+                suggestion = await self._suggest_layout(doc, context)
+            elif intent_enum == EditIntent.STYLE_SUGGESTION:
+                suggestion = await self._suggest_style(doc, context)
+            elif intent_enum == EditIntent.CTA_OPTIMIZATION:
+                suggestion = await self._suggest_cta(doc, context)
+            elif intent_enum == EditIntent.LOCALIZATION:
+                suggestion = await self._suggest_localization(doc, locale, context)
+            elif intent_enum == EditIntent.AB_GENERATION:
+                suggestion = await self._generate_ab_variants(doc, context)
+            else:
+                suggestion = await self._suggest_text_edit(doc, intent_enum, locale, context)
+        finally:
+            _refreshing.reset(token)
+        
+        self._cache_suggestion(cache_key, suggestion)
+        return suggestion
+    
+    @staticmethod
+    def _doc_signature(doc: DocumentModel) -> Dict[str, Any]:
+        """
+        The document fields the handlers read. The id is left out: documents
+        sent without one get a fresh uuid on every request.
+        """
+        data = doc.to_dict()
+        del data["id"]
+        return data
+    
+    def _cache_key(
+        self,
+        intent: EditIntent,
+        locale: Language,
+        doc: DocumentModel,
+        context: Optional[Dict]
+    ) -> str:
+        """SHA-256 over everything that determines a suggestion"""
+        payload = json.dumps(
+            {"i": intent.value, "l": locale.value, "d": self._doc_signature(doc), "c": context or {}},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    def _get_cached_suggestion(self, key: str) -> Optional[Suggestion]:
+        """Return a cached suggestion that is still within its TTL"""
+        with self._suggestion_cache_lock:
+            entry = self.suggestion_cache.get(key)
+            if entry is None:
+                return None
+            expires_at, suggestion = entry
+            if time.monotonic() > expires_at:
+                del self.suggestion_cache[key]
+                return None
+            self.suggestion_cache.move_to_end(key)
+            return suggestion
+    
+    def _cache_suggestion(self, key: str, suggestion: Suggestion, ttl: float = SUGGESTION_CACHE_TTL):
+        """Store a suggestion, evicting the least recently used past the limit"""
+        # Fallbacks mean Gemini failed; let the next request try again
+        if any(isinstance(v, dict) and v.get("fallback") for v in suggestion.variants):
+            return
+        with self._suggestion_cache_lock:
+            self.suggestion_cache[key] = (time.monotonic() + ttl, suggestion)
+            self.suggestion_cache.move_to_end(key)
+            while len(self.suggestion_cache) > SUGGESTION_CACHE_SIZE:
+                self.suggestion_cache.popitem(last=False)
+    
+    def _service_tier(self, intent: EditIntent) -> Optional[str]:
+        """Gemini service tier for a handler's call"""
+        return _forced_service_tier.get() or self.INTENT_TIERS.get(intent)
+    
+    def _evict_suggestion(self, suggestion_id: str):
+        """Drop a suggestion from the cache once the user has acted on it"""
+        with self._suggestion_cache_lock:
+            for key, (_, suggestion) in list(self.suggestion_cache.items()):
+                if suggestion.id == suggestion_id:
+                    del self.suggestion_cache[key]
+                    if suggestion.intent == EditIntent.AB_GENERATION:
+                        self._batch_path("results", key).unlink(missing_ok=True)
+    
+    async def get_suggestions_bulk(
+        self,
+        doc: DocumentModel,
+        intents: List[str],
+        locale: Language = Language.ENGLISH,
+        context: Dict = None,
+        timeout: float = 30
+    ) -> List[Suggestion]:
+        """
+        Get suggestions for several intents concurrently.
+        
+        The Gemini round-trips overlap, so latency is that of the slowest
+        intent rather than the sum. An intent that fails or times out gets a
+        fallback suggestion instead of failing the batch.
+        """
+        await self.initialize()
+        
+        intent_enums = [EditIntent(i) if isinstance(i, str) else i for i in intents]
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(self.get_suggestions(doc, intent, locale, context), timeout=timeout)
+                for intent in intent_enums
+            ),
+            return_exceptions=True
+        )
+        
+        suggestions = []
+        for intent, result in zip(intent_enums, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Bulk suggestion for {intent.value} failed: {result!r}")
+                result = self._create_fallback_suggestion(intent, locale)
+            suggestions.append(result)
+        return suggestions
+    
+    async def warmup(
+        self,
+        doc: DocumentModel,
+        locale: Language = Language.ENGLISH,
+        context: Dict = None,
+        requests: List[Tuple[str, Language, Optional[Dict]]] = None,
+        timeout: float = 30
+    ):
+        """
+        Speculatively fetch the suggestions users usually ask for first.
+        
+        requests lists (intent, locale, context) exactly as the later
+        interactive calls will send them, so the results land under the same
+        cache keys. Without it, WARMUP_INTENTS are fetched with locale and
+        context.
+        """
+        # Nobody is waiting on these, so take the cheapest tier
+        token = _forced_service_tier.set("flex")
+        try:
+            await self.initialize()
+            
+            requests = requests or [(intent, locale, context) for intent in WARMUP_INTENTS]
+            await asyncio.gather(
+                *(
+                    asyncio.wait_for(self.get_suggestions(doc, intent, req_locale, req_context), timeout=timeout)
+                    for intent, req_locale, req_context in requests
+                ),
+                return_exceptions=True
+            )
+        finally:
+            _forced_service_tier.reset(token)
+    
+    def schedule_warmup(
+        self,
+        doc: DocumentModel,
+        locale: Language = Language.ENGLISH,
+        context: Dict = None,
+        requests: List[Tuple[str, Language, Optional[Dict]]] = None
+    ) -> bool:
+        """
+        Run warmup() on a background thread with its own event loop, so it
+        outlives the request that triggered it. Returns False (and does
+        nothing) when all warmup slots are busy.
+        """
+        if not self._warmup_slots.acquire(blocking=False):
+            return False
+        
+        def run():
+            try:
+                asyncio.run(self.warmup(doc, locale, context, requests))
+            except Exception as e:
+                logger.debug(f"Suggestion warmup failed: {e}")
+            finally:
+                self._warmup_slots.release()
+        
+        threading.Thread(target=run, name="agent-warmup", daemon=True).start()
+        return True
     
     async def _suggest_creative_rewrite(
         self,
@@ -576,15 +1058,70 @@ Output JSON:
         context: Dict = None
     ) -> Suggestion:
         """Generate 3 variant headlines with different personas"""
-        context = context or {}
+        headline_block, prompt = self._creative_rewrite_prompt(doc, locale, context)
         
-        # Find headline block
-        headline_block = None
-        for block in doc.blocks:
-            if block.type == "text" and ("headline" in block.id.lower() or block.style.get("size", 0) > 30):
-                headline_block = block
-                break
+        response = await self.gemini.generate(
+            prompt=prompt,
+            system=self.SYSTEM_PROMPTS["creative_editor"],
+            json_mode=True,
+            temperature=0.8,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.CREATIVE_REWRITE)
+        )
+        return self._creative_rewrite_suggestion(response.response, headline_block, locale)
+    
+    async def stream_creative_rewrite(
+        self,
+        doc: DocumentModel,
+        locale: Language = Language.ENGLISH,
+        context: Dict = None,
+        refresh: bool = False
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        Creative rewrite over a streamed Gemini response.
         
+        Yields ("variant", dict) as each headline variant finishes decoding,
+        then ("suggestion", Suggestion) once the whole response is parsed.
+        The suggestion shares the cache with get_suggestions(); refresh
+        skips it and replaces the entry.
+        """
+        await self.initialize()
+        locale = Language(locale)
+        
+        cache_key = self._cache_key(EditIntent.CREATIVE_REWRITE, locale, doc, context)
+        suggestion = None if refresh else self._get_cached_suggestion(cache_key)
+        if suggestion is None:
+            headline_block, prompt = self._creative_rewrite_prompt(doc, locale, context)
+            scanner = _StreamedArrayItems("variants")
+            chunks = []
+            async for chunk in self.gemini.generate_stream(
+                prompt,
+                system=self.SYSTEM_PROMPTS["creative_editor"],
+                temperature=0.8,
+                json_mode=True
+            ):
+                chunks.append(chunk)
+                for variant in scanner.feed(chunk):
+                    yield "variant", variant
+            
+            suggestion = self._creative_rewrite_suggestion("".join(chunks), headline_block, locale)
+            self._cache_suggestion(cache_key, suggestion)
+        else:
+            for variant in suggestion.variants:
+                yield "variant", variant
+        
+        yield "suggestion", suggestion
+    
+    def _creative_rewrite_prompt(
+        self,
+        doc: DocumentModel,
+        locale: Language,
+        context: Dict = None
+    ) -> Tuple[Optional[Block], str]:
+        """Headline block to rewrite and the prompt for its variants"""
+        context = context or {}
+        
+        headline_block = doc.role_block("headline")
         if not headline_block:
             headline_block = doc.blocks[0] if doc.blocks else None
         
@@ -592,30 +1129,25 @@ Output JSON:
         occasion = context.get("occasion") or doc.meta.get("occasion", "")
         retailer = context.get("retailer") or doc.meta.get("retailer", "general")
         
-        prompt = f"""Current headline: "{current_text}"
-Retailer: {retailer}
-Occasion: {occasion or "General sale"}
-Target locale: {locale.value}
-
-Generate 3 headline variants with different tones:
-1. Urgent - Creates urgency and FOMO
-2. Value-focused - Highlights savings and value (use â‚¹ for prices)
-3. Premium - Sophisticated and aspirational
-
-Requirements:
-- Max 10 words each
-- Use â‚¹ for currency if mentioning price
-- For Hindi/Telugu, provide both original script and transliteration"""
-
-        response = await self.gemini.generate(
-            prompt=prompt,
-            system=self.SYSTEM_PROMPTS["creative_editor"],
-            json_mode=True,
-            temperature=0.8
+        prompt = _CREATIVE_REWRITE_PROMPT.format(
+            current_text=current_text,
+            retailer=retailer,
+            occasion=occasion or "General sale",
+            locale=locale.value
         )
+        return headline_block, prompt
+    
+    def _creative_rewrite_suggestion(
+        self,
+        text: str,
+        headline_block: Optional[Block],
+        locale: Language
+    ) -> Suggestion:
+        """Build the creative rewrite suggestion from Gemini's JSON output"""
+        current_text = headline_block.text if headline_block else "Your Headline"
         
         try:
-            data = json.loads(response.response)
+            data = _loads(text)
             variants = data.get("variants", [])
             
             # If variants are missing, create default ones
@@ -671,26 +1203,23 @@ Requirements:
             for b in doc.blocks
         ]
         
-        prompt = f"""Current layout elements: {json.dumps(blocks_info)}
-Canvas size: {doc.dimensions}
-Platform: {context.get('platform', 'general')}
-
-Suggest 3 layout alternatives:
-1. Product-left, text-right
-2. Text-centered, product-bottom
-3. Diagonal/dynamic arrangement
-
-Provide exact positions as percentages (0-100) for each element."""
+        prompt = _LAYOUT_PROMPT.format(
+            blocks=_dumps(blocks_info),
+            dimensions=doc.dimensions,
+            platform=context.get('platform', 'general')
+        )
 
         response = await self.gemini.generate(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["layout_suggester"],
             json_mode=True,
-            temperature=0.7
+            temperature=0.7,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.LAYOUT_SUGGESTION)
         )
         
         try:
-            data = json.loads(response.response)
+            data = _loads(response.response)
             layouts = data.get("layouts", [])
             
             if not layouts:
@@ -752,29 +1281,26 @@ Provide exact positions as percentages (0-100) for each element."""
         brand_color = context.get("brand_color")
         
         # Get festival palette if applicable
-        preset_palette = self.FESTIVAL_PALETTES.get(festival.lower() if festival else "", None)
+        festival_key = (festival or "").lower()
+        preset_palette = self.FESTIVAL_PALETTES.get(festival_key)
         
-        prompt = f"""Current styles: {json.dumps([{b.id: b.style} for b in doc.blocks])}
-Festival/Occasion: {festival or "General"}
-Brand color: {brand_color or "Not specified"}
-
-Suggest color palette and typography that:
-1. Has WCAG AA accessibility (contrast ratio > 4.5:1)
-2. Matches the occasion mood
-3. Works well together
-
-Include: primary, secondary, accent, background colors
-Font recommendations with sizes"""
+        prompt = _STYLE_PROMPT.format(
+            styles=_dumps([{b.id: b.style} for b in doc.blocks]),
+            festival=festival or "General",
+            brand_color=brand_color or "Not specified"
+        )
 
         response = await self.gemini.generate(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["style_suggester"],
             json_mode=True,
-            temperature=0.6
+            temperature=0.6,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.STYLE_SUGGESTION)
         )
         
         try:
-            data = json.loads(response.response)
+            data = _loads(response.response)
             
             # Use preset or generated palette
             palette = preset_palette or data.get("color_palette", {
@@ -859,36 +1385,26 @@ Font recommendations with sizes"""
         context = context or {}
         objective = context.get("objective", "buy")
         
-        # Find CTA block
-        cta_block = None
-        for block in doc.blocks:
-            if block.type == "button" or "cta" in block.id.lower():
-                cta_block = block
-                break
-        
+        cta_block = doc.role_block("cta")
         current_cta = cta_block.text if cta_block else "Shop Now"
         
-        prompt = f"""Current CTA: "{current_cta}"
-Objective: {objective}
-Product: {context.get('product', 'General')}
-
-Generate CTAs for different objectives:
-- buy: Direct purchase action
-- learn: Information seeking
-- subscribe: Newsletter/membership
-- save: Deal-focused
-
-Provide urgency level (high/medium/low) for each."""
+        prompt = _CTA_PROMPT.format(
+            current_cta=current_cta,
+            objective=objective,
+            product=context.get('product', 'General')
+        )
 
         response = await self.gemini.generate(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["cta_optimizer"],
             json_mode=True,
-            temperature=0.7
+            temperature=0.7,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.CTA_OPTIMIZATION)
         )
         
         try:
-            data = json.loads(response.response)
+            data = _loads(response.response)
             ctas = data.get("ctas", [
                 {"text": "Shop Now", "objective": "buy", "urgency": "high"},
                 {"text": "Explore Deals", "objective": "explore", "urgency": "medium"},
@@ -944,28 +1460,22 @@ Provide urgency level (high/medium/low) for each."""
             if block.text:
                 texts.append({"id": block.id, "text": block.text})
         
-        prompt = f"""Translate/localize for {target_locale.value}:
-{json.dumps(texts, indent=2)}
-
-For Hindi (hi): Use Devanagari script
-For Telugu (te): Use Telugu script  
-For Hinglish (hi-en): Mix Hindi words in Roman with English
-
-Requirements:
-- Keep brand names in English
-- Use â‚¹ for currency
-- Adapt idioms culturally
-- Provide transliteration for non-English scripts"""
+        prompt = _LOCALIZATION_PROMPT.format(
+            locale=target_locale.value,
+            texts=json.dumps(texts, indent=2)
+        )
 
         response = await self.gemini.generate(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["localizer"],
             json_mode=True,
-            temperature=0.5
+            temperature=0.5,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.LOCALIZATION)
         )
         
         try:
-            data = json.loads(response.response)
+            data = _loads(response.response)
             translations = data.get("translations", {})
             
             variants = []
@@ -1036,24 +1546,168 @@ Requirements:
     
     async def _generate_ab_variants(self, doc: DocumentModel, context: Dict = None) -> Suggestion:
         """Generate A/B test variants"""
-        prompt = f"""Create A/B test variants for this creative:
-{json.dumps(doc.to_dict(), indent=2)}
-
-Generate:
-- Variant A: Original with minor optimizations
-- Variant B: Significant change (different headline approach, CTA, or layout)
-
-For each variant, explain the hypothesis being tested."""
-
         response = await self.gemini.generate(
-            prompt=prompt,
+            prompt=self._ab_prompt(doc),
             system=self.SYSTEM_PROMPTS["creative_editor"],
             json_mode=True,
-            temperature=0.8
+            temperature=0.8,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(EditIntent.AB_GENERATION)
         )
+        return self._ab_suggestion(response.response)
+    
+    async def submit_ab_batch(
+        self,
+        docs: List[DocumentModel],
+        context: Dict = None
+    ) -> str:
+        """
+        Queue A/B variant generation for many creatives through Gemini Batch Mode.
+        
+        Half the cost of interactive calls, but the job may take up to 24
+        hours, so nothing waits on it: the job is recorded on disk and
+        collected later by collect_ab_batch().
+        
+        Returns:
+            The Gemini job name
+        """
+        await self.initialize()
         
+        name = await self.gemini.submit_offline_batch(
+            prompts={str(i): self._ab_prompt(doc) for i, doc in enumerate(docs)},
+            system=self.SYSTEM_PROMPTS["creative_editor"],
+            json_mode=True,
+            display_name="ab-variants"
+        )
+        self._write_json(self._batch_path("jobs", name), {
+            "name": name,
+            "state": "pending",
+            "requests": {
+                str(i): {
+                    "doc_id": doc.id,
+                    "cache_key": self._cache_key(EditIntent.AB_GENERATION, Language.ENGLISH, doc, context)
+                }
+                for i, doc in enumerate(docs)
+            }
+        })
+        return name
+    
+    async def collect_ab_batch(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Check a submitted A/B batch, storing its results once it has finished.
+        
+        Safe to call repeatedly and from any worker. Results are cached under
+        the same key as an interactive ab_generation request, so a later
+        /ab-test call for the same creative is served without a Gemini call.
+        
+        Returns:
+            The job record ("state" is "pending" or "done"; when done, each
+            request carries its "suggestion"), or None for an unknown job
+        """
+        path = self._batch_path("jobs", name)
+        job = self._read_json(path)
+        if job is None or job["state"] == "done":
+            return job
+        
+        await self.initialize()
+        responses = await self.gemini.get_offline_batch(name, list(job["requests"]))
+        if responses is None:
+            return job
+        
+        for key, entry in job["requests"].items():
+            response = responses[key]
+            if response.success:
+                suggestion = self._ab_suggestion(response.response)
+                self._cache_suggestion(entry["cache_key"], suggestion, ttl=AB_BATCH_CACHE_TTL)
+                self._store_ab_result(entry["cache_key"], suggestion)
+            else:
+                logger.warning(f"Batch A/B generation failed for {entry['doc_id']}: {response.error}")
+                suggestion = self._create_fallback_suggestion(EditIntent.AB_GENERATION)
+            entry["suggestion"] = self._suggestion_to_dict(suggestion)
+        
+        job["state"] = "done"
+        self._write_json(path, job)
+        return job
+    
+    def _store_ab_result(self, key: str, suggestion: Suggestion):
+        """Persist a batch A/B suggestion for other workers"""
+        if any(isinstance(v, dict) and v.get("fallback") for v in suggestion.variants):
+            return
+        self._write_json(self._batch_path("results", key), {
+            "expires": time.time() + AB_BATCH_CACHE_TTL,
+            "suggestion": self._suggestion_to_dict(suggestion)
+        })
+    
+    def _load_ab_result(self, key: str) -> Optional[Suggestion]:
+        """Batch A/B suggestion collected by any worker, moved into this one's cache"""
+        path = self._batch_path("results", key)
+        data = self._read_json(path)
+        if data is None:
+            return None
+        ttl = data["expires"] - time.time()
+        if ttl <= 0:
+            path.unlink(missing_ok=True)
+            return None
+        suggestion = self._suggestion_from_dict(data["suggestion"])
+        self._cache_suggestion(key, suggestion, ttl=ttl)
+        return suggestion
+    
+    @staticmethod
+    def _batch_path(kind: str, name: str) -> Path:
+        """File for a batch job record or result (job names contain '/')"""
+        return AB_BATCH_DIR / kind / f"{name.replace('/', '_')}.json"
+    
+    @staticmethod
+    def _write_json(path: Path, data: Dict[str, Any]):
+        """Write JSON atomically, so readers in other workers never see half a file"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+    
+    @staticmethod
+    def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+        """Read a JSON file, None if it is missing or unreadable"""
         try:
-            data = json.loads(response.response)
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _suggestion_to_dict(suggestion: Suggestion) -> Dict[str, Any]:
+        """Serialize a patch-less suggestion (as produced by A/B generation)"""
+        return {
+            "id": suggestion.id,
+            "intent": suggestion.intent.value,
+            "variants": suggestion.variants,
+            "recommended_index": suggestion.recommended_index,
+            "reason": suggestion.reason,
+            "confidence": suggestion.confidence,
+            "locale": suggestion.locale.value
+        }
+    
+    @staticmethod
+    def _suggestion_from_dict(data: Dict[str, Any]) -> Suggestion:
+        """Inverse of _suggestion_to_dict"""
+        return Suggestion(
+            id=data["id"],
+            intent=EditIntent(data["intent"]),
+            variants=data["variants"],
+            recommended_index=data["recommended_index"],
+            reason=data["reason"],
+            patch=None,
+            confidence=data["confidence"],
+            locale=Language(data["locale"])
+        )
+    
+    def _ab_prompt(self, doc: DocumentModel) -> str:
+        """Prompt for A/B variant generation"""
+        return _AB_PROMPT.format(creative=json.dumps(doc.to_dict(), indent=2))
+    
+    def _ab_suggestion(self, text: str) -> Suggestion:
+        """Build an A/B suggestion from Gemini's JSON output"""
+        try:
+            data = _loads(text)
             variants = data.get("variants", [])
             
             if len(variants) < 2:
@@ -1094,21 +1748,23 @@ For each variant, explain the hypothesis being tested."""
         """Handle generic text edit intents"""
         context = context or {}
         
-        prompt = f"""Edit request: {context.get('instruction', 'improve text')}
-Current document: {json.dumps(doc.to_dict(), indent=2)}
-Locale: {locale.value}
-
-Apply the edit and return the updated text."""
+        prompt = _TEXT_EDIT_PROMPT.format(
+            instruction=context.get('instruction', 'improve text'),
+            document=json.dumps(doc.to_dict(), indent=2),
+            locale=locale.value
+        )
 
         response = await self.gemini.generate(
             prompt=prompt,
             system=self.SYSTEM_PROMPTS["creative_editor"],
             json_mode=True,
-            temperature=0.7
+            temperature=0.7,
+            cache=not _refreshing.get(),
+            service_tier=self._service_tier(intent)
         )
         
         try:
-            data = json.loads(response.response)
+            data = _loads(response.response)
             return Suggestion(
                 id=str(uuid.uuid4()),
                 intent=intent,
@@ -1240,14 +1896,12 @@ Apply the edit and return the updated text."""
     def accept_suggestion(self, suggestion_id: str):
         """Track acceptance of a suggestion"""
         self.telemetry["accepted_suggestions"] += 1
-        if suggestion_id in self.suggestion_cache:
-            del self.suggestion_cache[suggestion_id]
+        self._evict_suggestion(suggestion_id)
     
     def reject_suggestion(self, suggestion_id: str):
         """Track rejection of a suggestion"""
         self.telemetry["rejected_suggestions"] += 1
-        if suggestion_id in self.suggestion_cache:
-            del self.suggestion_cache[suggestion_id]
+        self._evict_suggestion(suggestion_id)
     
     def get_telemetry(self) -> Dict:
         """Get telemetry data"""
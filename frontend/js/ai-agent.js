@@ -20,6 +20,7 @@ class AIAgentController {
         };
         this.pendingPatch = null;
         this.isProcessing = false;
+        this.warmupTimer = null;
         this.telemetry = [];
         
         this.baseUrl = '/api/ai/agent';
@@ -33,9 +34,38 @@ class AIAgentController {
         this.renderLanguageToggle();
         this.renderFestivalPresets();
         this.renderSuggestionsPanel();
+        this.scheduleWarmup();
+    }
+    
+    // Debounced: a document or template load usually arrives in a burst of
+    // changes, and warming a half-loaded canvas caches the wrong keys
+    scheduleWarmup(delay = 1500) {
+        clearTimeout(this.warmupTimer);
+        this.warmupTimer = setTimeout(() => this.warmupSuggestions(), delay);
+    }
+    
+    warmupSuggestions() {
+        // Prefetch what getSuggestions() and optimizeCTA() will ask for,
+        // with the same locale and context so the backend cache hits
+        if (typeof api === 'undefined') return;
+        api.agentWarmup(this.getDocumentModel(), [
+            {
+                intent: 'creative_rewrite',
+                locale: this.currentLanguage,
+                context: { focus_area: 'all' }
+            },
+            {
+                intent: 'cta_optimization',
+                locale: 'en',
+                context: { objective: 'buy', language: this.currentLanguage }
+            }
+        ]);
     }
     
     setupEventListeners() {
+        // The editor fires this when a document or template is loaded
+        document.addEventListener('editor-document-loaded', () => this.scheduleWarmup());
+        
         // AI command input handler
         const aiInput = document.getElementById('aiInput');
         if (aiInput) {
@@ -102,6 +132,7 @@ class AIAgentController {
         this.renderLanguageToggle();
         this.addSystemMessage(`Language set to ${this.getLanguageName(lang)}`);
         this.trackTelemetry('language_change', { language: lang });
+        this.scheduleWarmup();
     }
     
     cycleLanguage() {
@@ -206,7 +237,7 @@ class AIAgentController {
         contentDiv.innerHTML = `
             <div class="suggestions-panel" style="padding: 0; margin: 0; background: transparent; border: none;">
                 <div class="suggestions-header" style="padding: 0.5rem 0;">
-                    <button class="refresh-btn" onclick="aiAgent.getSuggestions()" title="Get new suggestions" style="margin-left: auto;">
+                    <button class="refresh-btn" onclick="aiAgent.getSuggestions(true)" title="Get new suggestions" style="margin-left: auto;">
                         <i class="fas fa-sync-alt"></i> Refresh
                     </button>
                 </div>
@@ -229,19 +260,37 @@ class AIAgentController {
         `;
     }
     
-    async getSuggestions() {
+    // refresh asks for new variants even if the document hasn't changed
+    async getSuggestions(refresh = false) {
         this.addAssistantMessage('💡 Let me take a look at your design and suggest some improvements...');
         this.setProcessing(true);
         
         try {
-            const result = await this.fetchAPI('/suggest', {
-                doc: this.getDocumentModel(),
-                intent: 'creative_rewrite',
-                locale: this.currentLanguage,
-                context: { focus_area: 'all' }
-            });
+            // Streamed: each variant gets a card as soon as it is decoded,
+            // the final event adds confidence and the patch
+            const streamed = [];
+            const result = await api.agentStreamCreativeRewrite(
+                this.getDocumentModel(),
+                this.currentLanguage,
+                { focus_area: 'all' },
+                (variant) => {
+                    streamed.push({
+                        type: 'creative_rewrite',
+                        description: variant,
+                        preview: variant,
+                        confidence: null,
+                        patch: null
+                    });
+                    if (streamed.length === 1) {
+                        this.showSuggestionCards(streamed, 'AI Suggestions');
+                    } else {
+                        this.updateSuggestionNav();
+                    }
+                },
+                refresh
+            );
             
-            if (result.success && result.suggestion) {
+            if (result && result.suggestion) {
                 // Convert suggestion to card format
                 const suggestions = result.suggestion.variants.map((variant, idx) => ({
                     type: result.suggestion.intent || 'creative',
@@ -251,13 +300,20 @@ class AIAgentController {
                     patch: idx === result.suggestion.recommended_index ? result.patch : null
                 }));
                 
+                // Keep the card the user is looking at while variants streamed in
+                const index = this.currentSuggestionIndex;
                 this.showSuggestionCards(suggestions, 'AI Suggestions');
+                if (index > 0 && index < suggestions.length) {
+                    this.currentSuggestionIndex = index;
+                    this.renderCurrentSuggestion();
+                    this.updateSuggestionIndicator();
+                }
                 this.addAssistantMessage(`✨ Great! I found ${suggestions.length} suggestions for you. Swipe through the cards below:`);
             } else {
                 this.addAssistantMessage('✅ Your creative looks great! I don\'t have any suggestions at this moment.');
             }
             
-            this.trackTelemetry('get_suggestions', { count: result.suggestion?.variants?.length || 0 });
+            this.trackTelemetry('get_suggestions', { count: result?.suggestion?.variants?.length || 0 });
         } catch (error) {
             console.error('Suggestions error:', error);
             this.addAssistantMessage('❌ Sorry, I couldn\'t generate suggestions right now. Please try again.');
@@ -266,6 +322,13 @@ class AIAgentController {
         }
     }
     
+    updateSuggestionNav() {
+        const nav = document.getElementById('suggestionsNav');
+        if (!nav) return;
+        nav.style.display = this.suggestions.length > 1 ? 'flex' : 'none';
+        this.updateSuggestionIndicator();
+    }
+    
     showSuggestionCards(suggestions, title = 'Suggestions') {
         this.suggestions = suggestions;
         this.currentSuggestionIndex = 0;
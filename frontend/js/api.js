@@ -278,6 +278,60 @@ class APIService {
         });
     }
 
+    /**
+     * Stream creative rewrite variants. onVariant is called for each headline
+     * variant as it arrives; resolves with the final suggestion event.
+     * refresh skips the server's suggestion cache.
+     */
+    async agentStreamCreativeRewrite(document, locale = 'en', context = null, onVariant = () => {}, refresh = false) {
+        const response = await fetch(`${this.baseUrl}/api/ai/agent/suggest/stream`, {
+            method: 'POST',
+            headers: this.defaultHeaders,
+            body: JSON.stringify({ document, locale, context, refresh })
+        });
+        if (!response.ok) {
+            throw new APIError(`HTTP error ${response.status}`, response.status, null);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const event of events) {
+                if (!event.startsWith('data: ')) continue;
+                const payload = JSON.parse(event.slice(6));
+                if (payload.type === 'variant') {
+                    onVariant(payload.variant);
+                } else {
+                    result = payload;
+                }
+            }
+        }
+        return result;
+    }
+
+    /**
+     * Prefetch likely suggestions for a freshly opened document.
+     * requests lists { intent, locale, context } exactly as the later
+     * suggestion calls send them, so the prefetched results are reused.
+     * Debounced so quickly switching documents only warms the last one.
+     */
+    agentWarmup(document, requests = null, locale = 'en', context = null) {
+        clearTimeout(this._warmupTimer);
+        this._warmupTimer = setTimeout(() => {
+            this.request('/api/ai/agent/warmup', {
+                method: 'POST',
+                body: JSON.stringify({ document, requests, locale, context })
+            }).catch(() => {});
+        }, 800);
+    }
+
     /**
      * Process a natural language command
      */